@@ -1,51 +1,146 @@
 import abc
+import dataclasses
 from logging import getLogger
-from typing import List, Optional
-from decimal import Decimal
+from typing import Collection, Dict, List, Optional, Sequence, Set, Tuple
 
+from eth_abi import encode
 from web3.contract import Contract
-from web3.types import ChecksumAddress
-from indexer_api.models import TokenBalance, Token
+from web3.types import BlockIdentifier, ChecksumAddress
+from indexer_api.models import TokenBalance, Token, TokenTransfer
 from web3 import Web3
 
+from .json_rpc import JsonRpcBatchCaller, BatchRequestsNotSupported
+from .multicall import Call, Multicall
+from .utils import get_rate_limiter
+
 logger = getLogger(__name__)
 
+BALANCE_OF_BATCH_SIZE = 500
+
+
+@dataclasses.dataclass
+class BalanceChanges:
+    # callers only read the database, changes are saved by balance fetchers
+    block_number: Optional[int]
+    # new and changed balances, unsaved
+    balances: List[TokenBalance] = dataclasses.field(default_factory=list)
+    # unchanged balances which are moved to the block
+    confirmed_pks: List[int] = dataclasses.field(default_factory=list)
+    # balances of token ids which holders do not own anymore
+    removed_pks: List[int] = dataclasses.field(default_factory=list)
+
+    def extend(self, other: "BalanceChanges"):
+        self.balances.extend(other.balances)
+        self.confirmed_pks.extend(other.confirmed_pks)
+        self.removed_pks.extend(other.removed_pks)
+
 
 class AbstractBalanceCaller(abc.ABC):
     contract: Optional[Contract]
     token: Token
+    # amount of holders get_balances handles with one request
+    batch_size: int = 1
+    # block which balances are fetched at, latest one if not pinned
+    block_number: Optional[int] = None
+    # holders whose balances could not be fetched, collected until the fetcher takes them
+    failed_holders: Set[ChecksumAddress]
 
     def __init__(self, token: Token, contract: Optional[Contract]):
         self.contract = contract
         self.token = token
+        self.failed_holders = set()
+
+    @property
+    def block_identifier(self) -> BlockIdentifier:
+        return self.block_number if self.block_number is not None else "latest"
 
     @abc.abstractmethod
-    def get_balance(self, holder: ChecksumAddress) -> List[TokenBalance]:
+    def get_balance(self, holder: ChecksumAddress) -> BalanceChanges:
         raise NotImplementedError()
 
+    def get_balances(self, holders: Sequence[ChecksumAddress]) -> BalanceChanges:
+        result = BalanceChanges(self.block_number)
+        for holder in holders:
+            result.extend(self.get_balance(holder))
+        return result
+
+    def _report_failed_holders(self, holders: Sequence[ChecksumAddress], fetched_holders: Collection[ChecksumAddress]):
+        self.failed_holders.update(holder for holder in holders if holder not in fetched_holders)
+
+    def _get_changed_balances(self, amounts: Dict[ChecksumAddress, int]) -> BalanceChanges:
+        return self._get_changed_token_id_balances({(holder, None): amount for holder, amount in amounts.items()})
+
+    def _get_changed_token_id_balances(self, amounts: Dict[Tuple[ChecksumAddress, Optional[int]], int]) \
+            -> BalanceChanges:
+        # existing balances of all holders are read with one query, new and changed ones are returned unsaved
+        token_balances = {(token_balance.holder, int(token_balance.token_id)
+                           if token_balance.token_id is not None else None): token_balance
+                          for token_balance in TokenBalance.objects.filter(
+                              token_instance=self.token, holder__in={holder for holder, _ in amounts})}
+        result = BalanceChanges(self.block_number)
+        for (holder, token_id), amount in amounts.items():
+            token_balance = token_balances.get((holder, token_id))
+            if token_balance is None:
+                # most seen pairs of token ids are emptied, so rows are not created for zero balances of them
+                if token_id is not None and amount == 0:
+                    continue
+                token_balance = TokenBalance(token_instance=self.token, holder=holder, token_id=token_id)
+            if token_balance.amount != amount:
+                token_balance.amount = amount
+                token_balance.block_number = self.block_number
+                result.balances.append(token_balance)
+            elif token_balance.block_number != self.block_number:
+                result.confirmed_pks.append(token_balance.pk)
+        logger.info(f"Balances of {len(result.balances)} of {len(amounts)} holders of token {self.token.name} changed")
+        return result
+
 
 class NativeBalanceFetcher(AbstractBalanceCaller):
+    # balances are fetched with JSON-RPC batches of eth_getBalance over the HTTP session of w3
     w3: Web3
+    batch_caller: JsonRpcBatchCaller
+    batch_requests_supported: bool
 
-    def __init__(self, token: Token):
+    def __init__(self, token: Token, w3: Optional[Web3] = None):
         super().__init__(token, None)
-        self.w3 = Web3(Web3.HTTPProvider(token.network.rpc_url))
-
-    def get_balance(self, holder: ChecksumAddress) -> List[TokenBalance]:
-        balance, created = TokenBalance.objects.get_or_create(token_instance=self.token, holder=holder)
-        if created:
-            logger.info(f"Created a TokenBalance record of holder {holder} on token {self.token.name} (Native)")
-        else:
-            logger.info(
-                f"TokenBalance record of holder {holder} on token {self.token.name} exists with amount: {balance.amount}")
-        current_balance = self.w3.eth.get_balance(holder)
-        if current_balance != balance.amount:
-            logger.info(f"Balance of holder {holder} changed to {current_balance}")
-            balance.amount = current_balance
-            balance.save()
-        else:
-            logger.info(f"Balance of holder {holder} remains the same")
-        return [balance]
+        network = token.network
+        self.w3 = w3 or Web3(Web3.HTTPProvider(network.rpc_url))
+        self.batch_caller = JsonRpcBatchCaller(self.w3, network.rpc_batch_size,
+                                               get_rate_limiter(network.rpc_url, network.rpc_requests_per_second,
+                                                                network.rpc_burst))
+        self.batch_requests_supported = network.rpc_batch_size > 1
+        self.batch_size = self.batch_caller.batch_size
+
+    def get_balance(self, holder: ChecksumAddress) -> BalanceChanges:
+        return self.get_balances([holder])
+
+    def get_balances(self, holders: Sequence[ChecksumAddress]) -> BalanceChanges:
+        amounts = self._get_amounts(holders)
+        self._report_failed_holders(holders, amounts)
+        return self._get_changed_balances(amounts)
+
+    def _get_amounts(self, holders: Sequence[ChecksumAddress]) -> Dict[ChecksumAddress, int]:
+        if self.batch_requests_supported:
+            try:
+                return self._get_batched_amounts(holders)
+            except BatchRequestsNotSupported as e:
+                logger.warning(f"Batch requests are not supported, fall back to sequential requests: {e}")
+                self.batch_requests_supported = False
+            except Exception as e:
+                logger.warning(f"Failed to fetch native balances with batches, fetch them one by one: {e}")
+        result: Dict[ChecksumAddress, int] = {}
+        for holder in holders:
+            try:
+                result[holder] = self.w3.eth.get_balance(holder, self.block_identifier)
+            except Exception as e:
+                logger.warning(f"Failed to fetch native balance of {holder}: {e}")
+        return result
+
+    def _get_batched_amounts(self, holders: Sequence[ChecksumAddress]) -> Dict[ChecksumAddress, int]:
+        block_identifier = hex(self.block_number) if self.block_number is not None else "latest"
+        amounts = self.batch_caller.call("eth_getBalance", [[holder, block_identifier] for holder in holders])
+        logger.info(f"Fetched native balances of {len(holders)} holders with batches")
+        return {holder: int(amount, 16) for holder, amount in zip(holders, amounts)}
 
 
 class ContractBalanceFetcher(AbstractBalanceCaller, abc.ABC):
@@ -57,84 +152,166 @@ class ContractBalanceFetcher(AbstractBalanceCaller, abc.ABC):
         super().__init__(token, contract)
 
 
-class ERC20BalanceCaller(ContractBalanceFetcher):
-
-    def get_balance(self, holder: ChecksumAddress) -> List[TokenBalance]:
-        try:
-            result: int = self.contract.functions.balanceOf(holder).call()
-            logger.info(f"Fetched {result} of holder {holder} on token {self.token.address}")
-            token_balance, created = TokenBalance.objects.get_or_create(token_instance=self.token, holder=holder)
-            if created:
-                logger.info(f"Created a TokenBalance record of holder {holder} on token {self.token.address} (ERC20)")
-            else:
-                logger.info(f"Holder {holder} already owned {self.token.address} with amount of {token_balance.amount}")
-            if token_balance.amount != result:
-                token_balance.amount = result
-                logger.info(f"Holder {holder} balance of token {self.token.address} set to {result}")
-                return [token_balance]
-            else:
-                logger.info(f"Skipped {holder} balance of token {self.token.address} remains to be {result}")
-                return []
-        except Exception as e:
-            logger.warning(f"Failed to fetch balance of {holder} on {self.contract.address}: {e}")
-            return []
-
-
-class ERC721BalanceCaller(ContractBalanceFetcher):
-
-    def get_balance(self, holder: ChecksumAddress) -> List[TokenBalance]:
-        try:
-            result: int = self.contract.functions.balanceOf(holder).call()
-            logger.info(f"Fetched {result} NFTs of holder {holder} on token {self.token.address}")
-            token_balance, created = TokenBalance.objects.get_or_create(token_instance=self.token, holder=holder)
-            if created:
-                logger.info(f"Created a TokenBalance record of holder {holder} on NFT token {self.token.address}")
-            else:
-                logger.info(f"Holder {holder} already owned NFT {self.token.address} of {token_balance.amount} tokens")
-            if token_balance.amount != result:
-                token_balance.amount = result
-                logger.info(f"Holder {holder} balance of token {self.token.address} set to {result}")
-                return [token_balance]
-            else:
-                logger.info(f"Skipped {holder} balance of token {self.token.address} remains to be {result}")
-                return []
-        except Exception as e:
-            logger.warning(f"Failed to fetch balance of {holder} on {self.contract.address}: {e}")
-            return []
-
-
-class ERC721EnumerableBalanceCaller(ContractBalanceFetcher):
-
-    def get_balance(self, holder: ChecksumAddress) -> List[TokenBalance]:
-        try:
-            users_tokens_count: int = self.contract.functions.balanceOf(holder).call()
-            current_tokens = set()
-            tokens_already_held_queryset = TokenBalance.objects.filter(holder=holder, token_instance=self.token).values(
-                "token_id")
-            tokens_already_held = set()
-            for token_balance in tokens_already_held_queryset:
-                if token_id_already_held := token_balance.get("token_id"):
-                    tokens_already_held.add(int(token_id_already_held))
-            for i in range(users_tokens_count):
-                token_id_already_held = self.contract.functions.tokenOfOwnerByIndex(holder, i).call()
-                current_tokens.add(token_id_already_held)
-            logger.info(f"Fetched {current_tokens} of holder {holder} on token {self.token.address}")
-            tokens_to_be_removed = tokens_already_held.difference(current_tokens)
-            tokens_to_be_added = current_tokens.difference(tokens_already_held)
-            if not tokens_to_be_added and not tokens_to_be_added:
-                logger.info(f"Skipped {holder} balance of token {self.token.address} remains to be {current_tokens}")
-                return []
-            for token_id_to_be_removed in tokens_to_be_removed:
-                logger.info(f"Token {token_id_to_be_removed} was moved from {holder}. Delete a record in the database")
-                TokenBalance.objects.filter(holder=holder, token_instance=self.token,
-                                            token_id=Decimal(token_id_to_be_removed)).delete()
-            for token_id_to_be_added in tokens_to_be_added:
-                logger.info(f"Token {token_id_to_be_added} was given to {holder}. Create a record in the database")
-                TokenBalance.objects.create(holder=holder,
-                                            token_instance=self.token,
-                                            token_id=token_id_to_be_added,
-                                            amount=None)
-            return []
-        except Exception as e:
-            logger.warning(f"Failed to fetch balance of {holder} on {self.contract.address}: {e}")
-            return []
+class AggregatedBalanceOfCaller(ContractBalanceFetcher, abc.ABC):
+    # fetches balanceOf of many holders with one aggregate3 call if Multicall is deployed on the network
+    balance_of_selector = Web3.keccak(text="balanceOf(address)")[:4]
+    multicall: Optional[Multicall]
+
+    def __init__(self, token: Token, contract: Optional[Contract]):
+        super().__init__(token, contract)
+        self.multicall = None
+        if multicall_address := token.network.multicall_address:
+            self.multicall = Multicall(self.contract.w3, token.network.chain_id, multicall_address)
+            self.batch_size = self.multicall.batch_size
+
+    def get_balance(self, holder: ChecksumAddress) -> BalanceChanges:
+        return self.get_balances([holder])
+
+    def get_balances(self, holders: Sequence[ChecksumAddress]) -> BalanceChanges:
+        amounts = self._get_amounts(holders)
+        self._report_failed_holders(holders, amounts)
+        return self._get_changed_balances(amounts)
+
+    def _get_amounts(self, holders: Sequence[ChecksumAddress]) -> Dict[ChecksumAddress, int]:
+        if self.multicall:
+            try:
+                return self._get_aggregated_amounts(self.multicall, holders)
+            except Exception as e:
+                logger.warning(f"Failed to aggregate balances on {self.contract.address}, fetch them one by one: {e}")
+        result: Dict[ChecksumAddress, int] = {}
+        for holder in holders:
+            try:
+                result[holder] = self.contract.functions.balanceOf(holder).call(block_identifier=self.block_identifier)
+                logger.info(f"Fetched {result[holder]} of holder {holder} on token {self.token.address}")
+            except Exception as e:
+                logger.warning(f"Failed to fetch balance of {holder} on {self.contract.address}: {e}")
+        return result
+
+    def _get_aggregated_amounts(self, multicall: Multicall,
+                                holders: Sequence[ChecksumAddress]) -> Dict[ChecksumAddress, int]:
+        calls = [Call(self.contract.address, Multicall.encode_address_call(self.balance_of_selector, holder))
+                 for holder in holders]
+        call_results = multicall.aggregate(calls, self.block_identifier)
+        logger.info(f"Fetched balances of {len(holders)} holders on token {self.token.address} with multicall")
+        result: Dict[ChecksumAddress, int] = {}
+        for holder, call_result in zip(holders, call_results):
+            try:
+                result[holder] = Multicall.decode_uint256(call_result)
+            except ValueError as e:
+                logger.warning(f"Failed to fetch balance of {holder} on {self.contract.address}: {e}")
+        return result
+
+
+class ERC20BalanceCaller(AggregatedBalanceOfCaller):
+    pass
+
+
+class ERC721BalanceCaller(AggregatedBalanceOfCaller):
+    pass
+
+
+class ERC1155BalanceCaller(ContractBalanceFetcher):
+    # balances of (holder, id) pairs seen in indexed transfers are fetched with balanceOfBatch, one call per chunk
+    batch_size = BALANCE_OF_BATCH_SIZE
+
+    def get_balance(self, holder: ChecksumAddress) -> BalanceChanges:
+        return self.get_balances([holder])
+
+    def get_balances(self, holders: Sequence[ChecksumAddress]) -> BalanceChanges:
+        pairs = self._get_holder_token_id_pairs(holders)
+        amounts: Dict[Tuple[ChecksumAddress, Optional[int]], int] = {}
+        for start in range(0, len(pairs), BALANCE_OF_BATCH_SIZE):
+            chunk = pairs[start: start + BALANCE_OF_BATCH_SIZE]
+            try:
+                chunk_amounts: List[int] = self.contract.functions.balanceOfBatch(
+                    [holder for holder, _ in chunk], [token_id for _, token_id in chunk]).call(
+                    block_identifier=self.block_identifier)
+            except Exception as e:
+                logger.warning(f"Failed to fetch {len(chunk)} balances on {self.contract.address}: {e}")
+                self.failed_holders.update(holder for holder, _ in chunk)
+                continue
+            amounts.update(zip(chunk, chunk_amounts))
+        logger.info(f"Fetched {len(amounts)} balances of {len(holders)} holders on token {self.token.address}")
+        return self._get_changed_token_id_balances(amounts)
+
+    def _get_holder_token_id_pairs(self, holders: Sequence[ChecksumAddress]) -> List[Tuple[ChecksumAddress, int]]:
+        # a holder may have a balance of token id only if it took part in transfers of it
+        holders_by_address = {holder.lower(): holder for holder in holders}
+        transfers = TokenTransfer.objects.filter(token_instance=self.token, token_id__isnull=False)
+        pairs: Set[Tuple[ChecksumAddress, int]] = set()
+        for participant_field in ("sender", "recipient"):
+            participant_transfers = transfers.filter(**{f"{participant_field}__in": holders})
+            for participant, token_id in participant_transfers.values_list(participant_field, "token_id").distinct():
+                if holder := holders_by_address.get(participant.lower()):
+                    pairs.add((holder, int(token_id)))
+        return sorted(pairs)
+
+
+class ERC721EnumerableBalanceCaller(AggregatedBalanceOfCaller):
+    # token ids of holders are enumerated with tokenOfOwnerByIndex packed into aggregated calls
+    token_of_owner_by_index_selector = Web3.keccak(text="tokenOfOwnerByIndex(address,uint256)")[:4]
+
+    def get_balances(self, holders: Sequence[ChecksumAddress]) -> BalanceChanges:
+        counts = self._get_amounts(holders)
+        held_token_balances: Dict[str, Dict[int, TokenBalance]] = {holder: {} for holder in counts}
+        for token_balance in TokenBalance.objects.filter(token_instance=self.token, holder__in=counts,
+                                                         token_id__isnull=False) \
+                .only("holder", "token_id", "block_number"):
+            held_token_balances[token_balance.holder][int(token_balance.token_id or 0)] = token_balance
+        current_token_ids: Dict[ChecksumAddress, Set[int]] = {}
+        if self.token.skip_unchanged_enumeration:
+            current_token_ids = {holder: set(held_token_balances[holder]) for holder, count in counts.items()
+                                 if count == len(held_token_balances[holder])}
+            logger.info(f"Skipped enumeration of {len(current_token_ids)} holders with unchanged balances")
+        current_token_ids.update(self._get_token_ids({holder: count for holder, count in counts.items()
+                                                      if holder not in current_token_ids}))
+        self._report_failed_holders(holders, current_token_ids)
+        result = BalanceChanges(self.block_number)
+        for holder, token_ids in current_token_ids.items():
+            for token_id, token_balance in held_token_balances[holder].items():
+                if token_id not in token_ids:
+                    result.removed_pks.append(token_balance.pk)
+                elif token_balance.block_number != self.block_number:
+                    result.confirmed_pks.append(token_balance.pk)
+            result.balances.extend(TokenBalance(token_instance=self.token, holder=holder, token_id=token_id,
+                                                amount=None, block_number=self.block_number)
+                                   for token_id in token_ids.difference(held_token_balances[holder]))
+        logger.info(f"Token {self.token.address}: {len(result.removed_pks)} token ids were moved from "
+                    f"{len(current_token_ids)} holders, {len(result.balances)} were given to them")
+        return result
+
+    def _get_token_ids(self, counts: Dict[ChecksumAddress, int]) -> Dict[ChecksumAddress, Set[int]]:
+        if self.multicall:
+            try:
+                return self._get_aggregated_token_ids(self.multicall, counts)
+            except Exception as e:
+                logger.warning(f"Failed to aggregate token ids on {self.contract.address}, fetch them one by one: {e}")
+        result: Dict[ChecksumAddress, Set[int]] = {}
+        for holder, count in counts.items():
+            try:
+                result[holder] = {self.contract.functions.tokenOfOwnerByIndex(holder, i).call(
+                    block_identifier=self.block_identifier) for i in range(count)}
+            except Exception as e:
+                logger.warning(f"Failed to enumerate token ids of {holder} on {self.contract.address}: {e}")
+        return result
+
+    def _get_aggregated_token_ids(self, multicall: Multicall,
+                                  counts: Dict[ChecksumAddress, int]) -> Dict[ChecksumAddress, Set[int]]:
+        indexes = [(holder, i) for holder, count in counts.items() for i in range(count)]
+        calls = [Call(self.contract.address,
+                      self.token_of_owner_by_index_selector + encode(["address", "uint256"], [holder, i]))
+                 for holder, i in indexes]
+        call_results = multicall.aggregate(calls, self.block_identifier)
+        result: Dict[ChecksumAddress, Set[int]] = {holder: set() for holder in counts}
+        failed_holders: Set[ChecksumAddress] = set()
+        for (holder, _), call_result in zip(indexes, call_results):
+            try:
+                result[holder].add(Multicall.decode_uint256(call_result))
+            except ValueError as e:
+                logger.warning(f"Failed to enumerate token ids of {holder} on {self.contract.address}: {e}")
+                failed_holders.add(holder)
+        # partially enumerated holders are left as they are until the next cycle
+        for holder in failed_holders:
+            del result[holder]
+        logger.info(f"Enumerated {len(indexes)} token ids of {len(counts)} holders on token {self.token.address}")
+        return result
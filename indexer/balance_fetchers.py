@@ -1,15 +1,22 @@
 import abc
-import json
-import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
 from typing import List, Dict, Optional
 
+from django.db import connection
+
 from web3 import Web3
-from indexer_api.models import Token, Indexer
+from indexer_api.models import Token, Indexer, TokenBalance
 from indexer_api.models import TokenType
 from web3.contract import Contract
 from web3.types import ChecksumAddress
-from .balance_callers import AbstractBalanceCaller, ERC20BalanceCaller, ERC721EnumerableBalanceCaller, \
-    ERC721BalanceCaller, NativeBalanceFetcher
+from .contracts import contract_registry
+from .balance_callers import AbstractBalanceCaller, BalanceChanges, ERC20BalanceCaller, ERC721EnumerableBalanceCaller, \
+    ERC721BalanceCaller, NativeBalanceFetcher, ERC1155BalanceCaller
+
+logger = getLogger(__name__)
+
+BALANCES_BATCH_SIZE = 1000
 
 
 class AbstractBalanceFetcher(abc.ABC):
@@ -22,33 +29,52 @@ class AbstractBalanceFetcher(abc.ABC):
         self.token = token
         address = token.address
         if address:
-            abi = self._get_abi(token.type)
-            self.contract = self.w3.eth.contract(address=w3.to_checksum_address(address), abi=abi)
+            self.contract = contract_registry.get_contract(w3, address, self._get_abi_filename(token.type))
         else:
             self.contract = None
         self.indexer = indexer
         self._build_balance_caller()
 
     @abc.abstractmethod
-    def get_balances(self, holders: List[ChecksumAddress]):
+    def get_balances(self, holders: List[ChecksumAddress]) -> List[ChecksumAddress]:
+        # saves balances of holders, returns holders whose balances could not be fetched
         raise NotImplementedError()
 
+    def pin_block(self, block_number: Optional[int]):
+        # balances of all holders are fetched at this block until it is pinned again
+        self.balance_caller.block_number = block_number
+
+    def find_drifted_balances(self, holders: List[ChecksumAddress]) -> List[TokenBalance]:
+        # balances which differ from on-chain ones; nothing is saved, confirmed and removed balances are dropped
+        result: List[TokenBalance] = []
+        batch_size = self.balance_caller.batch_size
+        for start in range(0, len(holders), batch_size):
+            result.extend(self.balance_caller.get_balances(holders[start: start + batch_size]).balances)
+        if failed_holders := self._take_failed_holders():
+            logger.warning(f"Failed to check balances of {len(failed_holders)} holders of {self.token.name}")
+        return result
+
+    def _take_failed_holders(self) -> List[ChecksumAddress]:
+        failed_holders, self.balance_caller.failed_holders = self.balance_caller.failed_holders, set()
+        return sorted(failed_holders)
+
     @staticmethod
-    def _get_abi(token_type: str) -> List[Dict]:
-        abi_filename: str
+    def _get_abi_filename(token_type: str) -> str:
         match token_type:
             case TokenType.erc20:
-                abi_filename = "indexer/abi/ERC20.json"
+                return "ERC20.json"
             case TokenType.erc721:
-                abi_filename = "indexer/abi/ERC721.json"
+                return "ERC721.json"
             case TokenType.erc721enumerable:
-                abi_filename = "indexer/abi/ERC721Enumerable.json"
+                return "ERC721Enumerable.json"
             case TokenType.erc1155:
-                abi_filename = "indexer/abi/ERC1155.json"
+                return "ERC1155.json"
             case _:
                 raise ValueError(f"Unknown token type or token's ABI not provided in `abi` folder: {token_type}")
-        with open(abi_filename) as file:
-            return json.load(file)
+
+    @classmethod
+    def _get_abi(cls, token_type: str) -> List[Dict]:
+        return contract_registry.get_abi(cls._get_abi_filename(token_type)).abi
 
     def _build_balance_caller(self):
         match self.token.type:
@@ -59,9 +85,9 @@ class AbstractBalanceFetcher(abc.ABC):
             case TokenType.erc721enumerable:
                 self.balance_caller = ERC721EnumerableBalanceCaller(self.token, self.contract)
             case TokenType.native:
-                self.balance_caller = NativeBalanceFetcher(self.token)
+                self.balance_caller = NativeBalanceFetcher(self.token, self.w3)
             case TokenType.erc1155:
-                raise NotImplementedError("Balance Fetcher: ERC1155 is not implemented yet")
+                self.balance_caller = ERC1155BalanceCaller(self.token, self.contract)
             case TokenType.erc777:
                 raise NotImplementedError("Balance Fetcher: ERC777 is not implemented yet")
             case _:
@@ -69,10 +95,47 @@ class AbstractBalanceFetcher(abc.ABC):
 
 
 class SimpleBalanceFetcher(AbstractBalanceFetcher):
-    def get_balances(self, holders: List[ChecksumAddress]):
-        for holder in holders:
-            balances = self.balance_caller.get_balance(holder)
-            for balance in balances:
-                balance.tracked_by = self.indexer
-                balance.save()
-                time.sleep(self.indexer.long_sleep_seconds)
+    def get_balances(self, holders: List[ChecksumAddress]) -> List[ChecksumAddress]:
+        batch_size = self.balance_caller.batch_size
+        batches = [holders[start: start + batch_size] for start in range(0, len(holders), batch_size)]
+        if self.indexer.balance_workers <= 1 or len(batches) <= 1:
+            for batch in batches:
+                self._fetch_batch(batch)
+        else:
+            # RPC is the bottleneck, so batches are fetched concurrently within the rate limit of the network
+            with ThreadPoolExecutor(max_workers=self.indexer.balance_workers) as executor:
+                list(executor.map(self._fetch_batch_in_thread, batches))
+        if failed_holders := self._take_failed_holders():
+            logger.warning(f"Failed to fetch balances of {len(failed_holders)} of {len(holders)} holders "
+                           f"of {self.token.name}")
+        return failed_holders
+
+    def _fetch_batch(self, holders: List[ChecksumAddress]):
+        try:
+            self._save_balances(self.balance_caller.get_balances(holders))
+        except Exception as e:
+            logger.warning(f"Failed to fetch balances of {len(holders)} holders of {self.token.name}: {e}")
+            self.balance_caller.failed_holders.update(holders)
+
+    def _fetch_batch_in_thread(self, holders: List[ChecksumAddress]):
+        try:
+            self._fetch_batch(holders)
+        finally:
+            # every thread of the pool opens its own database connection
+            connection.close()
+
+    def _save_balances(self, changes: BalanceChanges):
+        # existing rows were loaded by callers, so they are updated; rows created meanwhile by other indexers are
+        # kept by unique constraint of TokenBalance (ON CONFLICT DO NOTHING)
+        balances = changes.balances
+        for balance in balances:
+            balance.tracked_by = self.indexer
+        TokenBalance.objects.bulk_update([balance for balance in balances if balance.pk],
+                                         ["amount", "tracked_by", "block_number"], batch_size=BALANCES_BATCH_SIZE)
+        TokenBalance.objects.bulk_create([balance for balance in balances if not balance.pk],
+                                         batch_size=BALANCES_BATCH_SIZE, ignore_conflicts=True)
+        if changes.removed_pks:
+            TokenBalance.objects.filter(pk__in=changes.removed_pks).delete()
+        # unchanged balances are moved to the pinned block with one query
+        if changes.block_number is not None and changes.confirmed_pks:
+            TokenBalance.objects.filter(pk__in=changes.confirmed_pks).update(block_number=changes.block_number)
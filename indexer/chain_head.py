@@ -0,0 +1,79 @@
+import threading
+import time
+from logging import getLogger
+from typing import Dict, Optional, Tuple
+
+from django.utils import timezone
+from web3 import Web3
+
+from indexer_api.models import Network, NetworkHead
+
+logger = getLogger(__name__)
+
+# head published by any worker of the network is used by others while it is not older than this
+CHAIN_HEAD_MAX_AGE_SECONDS = 1
+# block time is estimated from timestamps of the head and a block this far below, and is measured again after a while
+BLOCK_TIME_SAMPLE_BLOCKS = 100
+BLOCK_TIME_MAX_AGE_SECONDS = 600
+
+
+class ChainHeadTracker:
+    # one worker of a network polls the head with cheap eth_blockNumber and publishes it to NetworkHead table,
+    # others read it from there. Block time of networks is kept in memory of the process
+    _block_times: Dict[int, Tuple[Optional[float], float]]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._block_times = {}
+        self._lock = threading.Lock()
+
+    def get_latest_block(self, w3: Web3, network: Network) -> int:
+        now = timezone.now()
+        head = NetworkHead.objects.filter(network=network).first()
+        if head and (now - head.updated_at).total_seconds() < CHAIN_HEAD_MAX_AGE_SECONDS:
+            return head.block_number
+        block_number = w3.eth.block_number
+        self.publish(network, block_number)
+        return block_number
+
+    @staticmethod
+    def publish(network: Network, block_number: int):
+        # workers of the network may publish the head concurrently and a lagging node may return an older block,
+        # so the head is only moved forward
+        now = timezone.now()
+        heads = NetworkHead.objects.filter(network=network, block_number__lte=block_number)
+        if not heads.update(block_number=block_number, updated_at=now):
+            NetworkHead.objects.bulk_create([NetworkHead(network=network, block_number=block_number, updated_at=now)],
+                                            ignore_conflicts=True)
+            # the head may be inserted by another worker meanwhile
+            heads.update(block_number=block_number, updated_at=now)
+        logger.debug(f"Head of {network.name} is {block_number}")
+
+    def get_block_time(self, w3: Web3, network: Network) -> Optional[float]:
+        measured = self._block_times.get(network.chain_id)
+        if measured and time.monotonic() - measured[1] < BLOCK_TIME_MAX_AGE_SECONDS:
+            return measured[0]
+        block_time = self._measure_block_time(w3)
+        logger.info(f"Block time of {network.name} is {block_time} seconds")
+        with self._lock:
+            self._block_times[network.chain_id] = (block_time, time.monotonic())
+        return block_time
+
+    @staticmethod
+    def _measure_block_time(w3: Web3) -> Optional[float]:
+        try:
+            latest_block = w3.eth.get_block("latest")
+            if (sample_blocks := min(BLOCK_TIME_SAMPLE_BLOCKS, latest_block["number"])) <= 0:
+                return None
+            sample_block = w3.eth.get_block(latest_block["number"] - sample_blocks)
+            return (latest_block["timestamp"] - sample_block["timestamp"]) / sample_blocks
+        except Exception as e:
+            logger.warning(f"Failed to measure block time: {e}")
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._block_times.clear()
+
+
+chain_head_tracker = ChainHeadTracker()
@@ -0,0 +1,80 @@
+import dataclasses
+import json
+import os
+import threading
+import weakref
+from logging import getLogger
+from typing import Dict, List, Tuple
+
+from eth_utils import event_signature_to_log_topic, function_signature_to_4byte_selector
+from eth_utils.abi import collapse_if_tuple
+from web3 import Web3
+from web3.contract import Contract
+from web3.types import HexBytes
+
+logger = getLogger(__name__)
+
+ABI_DIRECTORY = os.path.join("indexer", "abi")
+
+
+@dataclasses.dataclass(frozen=True)
+class ContractAbi:
+    abi: List[Dict]
+    # topic0 of every event and 4 bytes selector of every function by canonical signature, e.g. balanceOf(address),
+    # since overloaded functions share the name
+    event_topics: Dict[str, HexBytes]
+    function_selectors: Dict[str, HexBytes]
+
+    @staticmethod
+    def from_abi(abi: List[Dict]) -> "ContractAbi":
+        return ContractAbi(
+            abi=abi,
+            event_topics={signature: HexBytes(event_signature_to_log_topic(signature))
+                          for signature in ContractAbi._get_signatures(abi, "event")},
+            function_selectors={signature: HexBytes(function_signature_to_4byte_selector(signature))
+                                for signature in ContractAbi._get_signatures(abi, "function")})
+
+    @staticmethod
+    def _get_signatures(abi: List[Dict], item_type: str) -> List[str]:
+        return [f"{item['name']}({','.join(collapse_if_tuple(argument) for argument in item.get('inputs', []))})"
+                for item in abi if item.get("type") == item_type]
+
+
+class ContractRegistry:
+    # process-wide storage of parsed ABIs and contract objects, so fetchers of many tokens share them
+    # instead of reading ABI files and building contracts every time they are created.
+    # Contracts run calls through the provider and middlewares of their Web3, so they are shared only by fetchers
+    # of the same Web3 instance. Contract keeps its Web3 alive, so id of Web3 is not reused while the entry exists
+    _abis: Dict[str, ContractAbi]
+    _contracts: "weakref.WeakValueDictionary[Tuple[int, str, str], Contract]"
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._abis = {}
+        self._contracts = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def get_abi(self, abi_filename: str) -> ContractAbi:
+        if (contract_abi := self._abis.get(abi_filename)) is None:
+            with open(os.path.join(ABI_DIRECTORY, abi_filename)) as file:
+                contract_abi = ContractAbi.from_abi(json.load(file))
+            with self._lock:
+                contract_abi = self._abis.setdefault(abi_filename, contract_abi)
+        return contract_abi
+
+    def get_contract(self, w3: Web3, address: str, abi_filename: str) -> Contract:
+        key = (id(w3), address.lower(), abi_filename)
+        if (contract := self._contracts.get(key)) is None:
+            contract = w3.eth.contract(address=Web3.to_checksum_address(address),
+                                       abi=self.get_abi(abi_filename).abi)
+            with self._lock:
+                contract = self._contracts.setdefault(key, contract)
+        return contract
+
+    def clear(self):
+        with self._lock:
+            self._abis.clear()
+            self._contracts.clear()
+
+
+contract_registry = ContractRegistry()
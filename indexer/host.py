@@ -0,0 +1,55 @@
+import threading
+import time
+from logging import getLogger
+from typing import List
+
+from django.db import connection
+
+from indexer.indexers import IndexerWorkerFactory
+
+logger = getLogger(__name__)
+
+# failed indexer is restarted after this delay, which doubles with every failure in a row
+HOST_RESTART_MIN_SECONDS = 5
+HOST_RESTART_MAX_SECONDS = 300
+
+
+class IndexerHost:
+    # runs many indexers in one process, so they share Python, Django and web3 startup, ABIs, rate limiters and
+    # Web3 with contracts of their networks. Every indexer has its own thread, its failures restart only itself
+    indexer_names: List[str]
+    stopped: threading.Event
+
+    def __init__(self, indexer_names: List[str]):
+        self.indexer_names = indexer_names
+        self.stopped = threading.Event()
+
+    def run(self):
+        threads = [threading.Thread(target=self.run_indexer, args=(indexer_name,), name=indexer_name, daemon=True)
+                   for indexer_name in self.indexer_names]
+        logger.info(f"Hosting {len(threads)} indexers: {', '.join(self.indexer_names)}")
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run_indexer(self, indexer_name: str):
+        restart_seconds = HOST_RESTART_MIN_SECONDS
+        while not self.stopped.is_set():
+            started_at = time.monotonic()
+            try:
+                worker = IndexerWorkerFactory.build_indexer(indexer_name)
+                # sleeping indexers do not hold database connections
+                worker.release_connection = True
+                worker.cycle(self.stopped)
+            except Exception as e:
+                if time.monotonic() - started_at > HOST_RESTART_MAX_SECONDS:
+                    restart_seconds = HOST_RESTART_MIN_SECONDS
+                logger.exception(f"Indexer {indexer_name} failed, restart it in {restart_seconds} seconds: {e}")
+                self.stopped.wait(restart_seconds)
+                restart_seconds = min(restart_seconds * 2, HOST_RESTART_MAX_SECONDS)
+            finally:
+                connection.close()
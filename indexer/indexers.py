@@ -1,10 +1,16 @@
 import abc
+import dataclasses
+import itertools
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
 from logging import getLogger
 from typing import Dict, List, Optional, Tuple
 
+from requests.exceptions import Timeout
 from web3 import Web3
-from web3.middleware import geth_poa_middleware
+from web3.types import LogReceipt
 
 from indexer.balance_fetchers import AbstractBalanceFetcher, SimpleBalanceFetcher
 from indexer.strategies import (RecipientStrategy,
@@ -14,19 +20,57 @@ from indexer.strategies import (RecipientStrategy,
                                 SpecifiedHoldersStrategy,
                                 AbstractStrategy,
                                 AbstractBalanceStrategy,
-                                TransfersParticipantsStrategy)
+                                TransfersParticipantsStrategy,
+                                TransfersLedgerStrategy)
 from indexer.transfer_fetchers import ReceiptTransferFetcher
-from django.db.models import QuerySet
+from django.db import connection
+from django.db.models import Min, QuerySet
 from indexer_api.models import (
     Network,
     Token,
-    Indexer, IndexerType)
-from indexer_api.models import TokenStrategy, IndexerStrategy
-from .transfer_fetchers import EventTransferFetcher, AbstractTransferFetcher
+    Indexer, IndexerType, IndexedBlockRange, TokenTransfer)
+from indexer_api.models import TokenStrategy, IndexerStrategy, LEDGER_TOKENS
+from .transfer_fetchers import CombinedEventTransferFetcher, AbstractTransferFetcher
 from .transfer_transactions import TransferTransaction
+from .chain_head import chain_head_tracker
+from .live import LogSubscription
+from .utils import to_checksum_address, get_web3
 
 logger = getLogger(__name__)
 
+# every backfill cycle plans this amount of ranges for each worker
+BACKFILL_SHARDS_PER_WORKER = 4
+# amount of fetched ranges waiting to be saved to database and amount of ranges fetched during one cycle
+PIPELINE_QUEUE_SIZE = 2
+PIPELINE_MAX_RANGES = 32
+PIPELINE_STOP_TIMEOUT_SECONDS = 0.1
+# live mode waits for pushed logs this long before it moves last block to the head, and resubscribes after a session
+LIVE_RECEIVE_TIMEOUT_SECONDS = 1
+LIVE_SESSION_SECONDS = 60
+
+# step grows when range is fetched faster than this and has fewer transfers than the limit below
+STEP_GROWTH_MAX_SECONDS = 2
+STEP_GROWTH_MAX_TRANSFERS = 1000
+# parts of error messages which providers use to report a too wide range of eth_getLogs
+PROVIDER_LIMIT_ERROR_MARKERS = ("too many", "more than", "limit exceeded", "response size", "range is too large",
+                                "block range", "timeout", "timed out")
+
+
+@dataclasses.dataclass
+class RangeIndexingResult:
+    success: bool = True
+    error: Optional[Exception] = None
+    transfers_count: int = 0
+    fetching_seconds: float = 0.0
+
+
+@dataclasses.dataclass
+class FetchedRange:
+    from_block: int
+    to_block: int
+    transfers_of_tokens: Dict[Token, List[TransferTransaction]] = dataclasses.field(default_factory=dict)
+    result: RangeIndexingResult = dataclasses.field(default_factory=RangeIndexingResult)
+
 
 class AbstractIndexerWorker(abc.ABC):
     indexer: Indexer
@@ -34,26 +78,44 @@ class AbstractIndexerWorker(abc.ABC):
     w3: Web3
     transfer_fetchers: List[AbstractTransferFetcher]
     strategy: AbstractStrategy
+    # set by hosts of many indexers, so the connection is held only during cycle body
+    release_connection: bool = False
 
     def __init__(self, indexer: Indexer):
         self.indexer = indexer
         self.network = self.indexer.network
-        self.w3 = Web3(Web3.HTTPProvider(self.network.rpc_url))
-        if self.network.need_poa:
-            self.w3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-    def cycle(self):
-        while True:
-            logger.info(f"Starting a cycle sleeping for {self.indexer.short_sleep_seconds} seconds")
-            time.sleep(self.indexer.short_sleep_seconds)
+        self.w3 = get_web3(self.network.rpc_url, self.network.need_poa, self.network.rpc_requests_per_second,
+                           self.network.rpc_burst)
+
+    def cycle(self, stopped: Optional[threading.Event] = None):
+        while not (stopped and stopped.is_set()):
+            sleep_seconds = self.get_cycle_sleep_seconds()
+            logger.info(f"Starting a cycle sleeping for {sleep_seconds} seconds")
+            if stopped:
+                stopped.wait(sleep_seconds)
+            elif sleep_seconds > 0:
+                time.sleep(sleep_seconds)
             self.indexer.refresh_from_db()
             logger.info(f"Updating indexer data from database before start cycle main body")
             self._cycle_body()
+            logger.debug(f"Checksum address cache: {to_checksum_address.cache_info()}")
+            if self.release_connection:
+                connection.close()
 
     @abc.abstractmethod
     def _cycle_body(self):
         raise NotImplementedError()
 
+    def get_cycle_sleep_seconds(self) -> float:
+        return self.indexer.short_sleep_seconds
+
+    def get_latest_block(self) -> Optional[int]:
+        try:
+            return chain_head_tracker.get_latest_block(self.w3, self.network)
+        except Exception as e:
+            logger.warning(f"During fetching last block error occurred: {e}")
+            return None
+
     @abc.abstractmethod
     def build_strategy(self, strategy: str, strategy_params: Dict):
         raise NotImplementedError()
@@ -65,45 +127,276 @@ class AbstractIndexerWorker(abc.ABC):
 
 class TransferIndexerWorker(AbstractIndexerWorker):
     strategy: AbstractTransferStrategy
+    # pacing of the next cycle: whether the last one advanced but did not reach the head, and whether it saw blocks
+    behind_head: bool
+    found_new_blocks: bool
 
     def __init__(self, indexer: Indexer):
         super().__init__(indexer)
-        self.build_fetchers(self.indexer.watched_tokens.all())
+        self.behind_head = False
+        self.found_new_blocks = True
         self.build_strategy(self.indexer.strategy, self.indexer.strategy_params)
+        self.build_fetchers(self.indexer.watched_tokens.all())
+
+    def get_cycle_sleep_seconds(self) -> float:
+        # ranges are fetched back to back while behind the head, then the next block is waited for
+        if self.behind_head:
+            return 0
+        if (block_time := chain_head_tracker.get_block_time(self.w3, self.network)) is not None:
+            return block_time
+        return self.indexer.short_sleep_seconds if self.found_new_blocks else self.indexer.long_sleep_seconds
 
     def _cycle_body(self):
+        self.behind_head = False
         if (latest_block := self.get_latest_block()) is None:
             logger.info(f"Skip cycle since last block fetching failed")
             return
         from_block = self.indexer.last_block
-        to_block = min(from_block + self.network.max_step, latest_block)
-        if from_block == to_block:
-            logger.info(f"No new blocks found, last block is {to_block}")
-            time.sleep(self.indexer.long_sleep_seconds)
+        self.index_up_to(from_block, latest_block)
+        # failed cycles do not advance, so they are paced as usual
+        self.behind_head = from_block < self.indexer.last_block < latest_block
+        self.found_new_blocks = from_block < latest_block
+
+    def index_up_to(self, from_block: int, latest_block: int):
+        if self.indexer.live_mode and latest_block - from_block <= self.get_step() and \
+                (live_fetcher := self.get_live_fetcher()):
+            self.follow_tip(live_fetcher)
+            return
+        if self.indexer.backfill_workers > 1 and \
+                latest_block - from_block > self.get_step() * self.indexer.backfill_workers:
+            self.backfill(from_block, latest_block)
             return
+        if from_block == latest_block:
+            logger.info(f"No new blocks found, last block is {latest_block}")
+            return
+        self.pipeline(from_block, latest_block)
+
+    def pipeline(self, from_block: int, latest_block: int):
+        # ranges are fetched and decoded in a separate thread while the previous ones are saved to database.
+        # Bounded queue stops fetching when database falls behind and last block is increased in the ranges order
+        step = self.get_step()
+        fetched_ranges: Queue[Optional[FetchedRange]] = Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        stopped = threading.Event()
+        fetching_thread = threading.Thread(target=self.fetch_ranges,
+                                           args=(from_block, latest_block, step, fetched_ranges, stopped),
+                                           daemon=True)
+        fetching_thread.start()
+        should_increase_step = True
+        try:
+            while (fetched_range := fetched_ranges.get()) is not None:
+                result = fetched_range.result
+                if result.success:
+                    self.persist_range(fetched_range.transfers_of_tokens, result)
+                if not result.success:
+                    if result.error and self.is_provider_limit_error(result.error):
+                        self.decrease_step(fetched_range.to_block - fetched_range.from_block)
+                    return
+                logger.info(f"Transfers handled successfully. Increase last block")
+                self.increase_last_block(fetched_range.to_block)
+                should_increase_step = should_increase_step and \
+                    fetched_range.to_block - fetched_range.from_block == step and \
+                    result.fetching_seconds < STEP_GROWTH_MAX_SECONDS and \
+                    result.transfers_count < STEP_GROWTH_MAX_TRANSFERS
+            if should_increase_step:
+                self.increase_step()
+        finally:
+            stopped.set()
+            while fetching_thread.is_alive():
+                try:
+                    fetched_ranges.get(timeout=PIPELINE_STOP_TIMEOUT_SECONDS)
+                except Empty:
+                    pass
+
+    def get_live_fetcher(self) -> Optional[CombinedEventTransferFetcher]:
+        if not self.network.ws_url:
+            logger.warning(f"Live mode needs WebSocket URL of network {self.network.name}, poll ranges instead")
+            return None
+        if len(self.transfer_fetchers) != 1 or not isinstance(self.transfer_fetchers[0], CombinedEventTransferFetcher):
+            logger.warning(f"Live mode follows only event-based tokens, poll ranges instead")
+            return None
+        return self.transfer_fetchers[0]
+
+    def follow_tip(self, fetcher: CombinedEventTransferFetcher):
+        # transfers are persisted as soon as node pushes their logs. Session is bounded, so indexer is refreshed
+        # between sessions; after any failure the next cycle repairs the gap with range polling
+        started_at = time.monotonic()
+        try:
+            with LogSubscription(str(self.network.ws_url), fetcher.get_log_filters()) as subscription:
+                if not self.repair_gap():
+                    return
+                while time.monotonic() - started_at < LIVE_SESSION_SECONDS:
+                    logs = subscription.receive(LIVE_RECEIVE_TIMEOUT_SECONDS)
+                    if not self.persist_logs(fetcher, logs, subscription.head_block):
+                        return
+        except Exception as e:
+            logger.warning(f"Live mode stopped, fall back to range polling: {e}")
+
+    def repair_gap(self) -> bool:
+        # logs of blocks imported before the subscription started are not pushed, so they are polled
+        latest_block = self.w3.eth.block_number
+        if latest_block <= self.indexer.last_block:
+            return True
+        result = self.index_range(self.indexer.last_block, latest_block)
+        if result.success:
+            self.increase_last_block(latest_block)
+        return result.success
+
+    def persist_logs(self, fetcher: CombinedEventTransferFetcher, logs: List[LogReceipt],
+                     head_block: Optional[int]) -> bool:
+        # runs of removed and new logs are handled in the pushed order, so a log removed and pushed again is kept
+        for removed, logs_run in itertools.groupby(logs, key=lambda log: bool(log.get("removed"))):
+            transfers_of_tokens = fetcher.decode_logs(list(logs_run))
+            if removed:
+                logger.warning(f"Logs were removed by chain reorganization, delete their transfers")
+                if not self.remove_transfers(transfers_of_tokens):
+                    return False
+                continue
+            result = RangeIndexingResult()
+            self.persist_range(transfers_of_tokens, result)
+            if not result.success:
+                return False
+        # node pushes logs of blocks in order, so blocks below a pushed log and below a head pushed over the same
+        # connection are complete. Head of HTTP node may be ahead of the WebSocket one, so it is not used
+        completed_blocks = [log["blockNumber"] - 1 for log in logs if not log.get("removed")]
+        if head_block is not None:
+            completed_blocks.append(head_block - 1)
+        if completed_blocks and (last_block := max(completed_blocks)) > self.indexer.last_block:
+            self.increase_last_block(last_block)
+        return True
+
+    def remove_transfers(self, transfers_of_tokens: Dict[Token, List[TransferTransaction]]) -> bool:
+        try:
+            for token, transfers in transfers_of_tokens.items():
+                self.strategy.remove(token, transfers)
+            return True
+        except Exception as e:
+            logger.warning(f"During deleting removed transfers error occurred {e}")
+            return False
+
+    def fetch_ranges(self, from_block: int, latest_block: int, step: int,
+                     fetched_ranges: "Queue[Optional[FetchedRange]]", stopped: threading.Event):
+        try:
+            for _ in range(PIPELINE_MAX_RANGES):
+                if stopped.is_set() or from_block >= latest_block:
+                    break
+                to_block = min(from_block + step, latest_block)
+                fetched_range = self.fetch_range(from_block, to_block)
+                fetched_ranges.put(fetched_range)
+                if not fetched_range.result.success:
+                    break
+                from_block = to_block
+        finally:
+            fetched_ranges.put(None)
+            # fetchers may use database, so connection of this thread is closed
+            connection.close()
+
+    def fetch_range(self, from_block: int, to_block: int) -> FetchedRange:
         logger.info(f"Fetching transfers in blocks in the range [{from_block}; {to_block}]")
+        fetched_range = FetchedRange(from_block, to_block)
         for fetching_method in self.transfer_fetchers:
-            transfers, error = self.fetch_transfers(fetching_method, from_block, to_block)
-            if not error:
-                logger.info(f"Fetched {len(transfers)} transfers")
-                if transfers:
-                    if self.handle_transfers(fetching_method, transfers):
-                        logger.info(f"Transfers handled successfully. Increase last block")
-                        self.increase_last_block(to_block)
-                    else:
-                        logger.info(f"Failed to handle transfers. Skip cycle and try again")
-                else:
-                    logger.info(f"No events found. Go to next blocks scope")
-                    self.increase_last_block(to_block)
-            else:
+            started_at = time.monotonic()
+            transfers_of_tokens, error = self.fetch_transfers(fetching_method, from_block, to_block)
+            fetched_range.result.fetching_seconds += time.monotonic() - started_at
+            if error:
                 logger.info(f"Failed to fetch transfers. Skip cycle and try again")
+                fetched_range.result.success = False
+                fetched_range.result.error = error
+                return fetched_range
+            for token, transfers in transfers_of_tokens.items():
+                logger.info(f"Fetched {len(transfers)} transfers of {token.name}")
+                fetched_range.result.transfers_count += len(transfers)
+                fetched_range.transfers_of_tokens.setdefault(token, []).extend(transfers)
+        return fetched_range
 
-    def get_latest_block(self) -> Optional[int]:
+    def persist_range(self, transfers_of_tokens: Dict[Token, List[TransferTransaction]], result: RangeIndexingResult):
+        for token, transfers in transfers_of_tokens.items():
+            if transfers and not self.handle_transfers(token, transfers):
+                logger.info(f"Failed to handle transfers. Skip cycle and try again")
+                result.success = False
+                return
+
+    def index_range(self, from_block: int, to_block: int) -> RangeIndexingResult:
+        fetched_range = self.fetch_range(from_block, to_block)
+        if fetched_range.result.success:
+            self.persist_range(fetched_range.transfers_of_tokens, fetched_range.result)
+        return fetched_range.result
+
+    def backfill(self, from_block: int, latest_block: int):
+        if not (shards := self.plan_shards(from_block, latest_block)):
+            self.advance_last_block()
+            return
+        logger.info(f"Backfilling {len(shards)} ranges in [{shards[0][0]}; {shards[-1][1]}] "
+                    f"with {self.indexer.backfill_workers} workers")
+        with ThreadPoolExecutor(max_workers=self.indexer.backfill_workers) as executor:
+            results = list(executor.map(lambda shard: self.index_shard(*shard), shards))
+        IndexedBlockRange.objects.bulk_create([
+            IndexedBlockRange(indexer=self.indexer, from_block=shard_from_block, to_block=shard_to_block)
+            for (shard_from_block, shard_to_block), result in zip(shards, results) if result.success
+        ])
+        if any(result.error and self.is_provider_limit_error(result.error) for result in results):
+            self.decrease_step(self.get_step())
+        self.advance_last_block()
+
+    def index_shard(self, from_block: int, to_block: int) -> RangeIndexingResult:
         try:
-            return self.w3.eth.get_block("latest")["number"]
-        except Exception as e:
-            logger.warning(f"During fetching last block error occurred: {e}")
-            return None
+            return self.index_range(from_block, to_block)
+        finally:
+            # every thread of the pool opens its own database connection
+            connection.close()
+
+    def plan_shards(self, from_block: int, latest_block: int) -> List[Tuple[int, int]]:
+        step = self.get_step()
+        indexed_ranges = list(self.indexer.indexed_ranges.filter(to_block__gt=from_block).order_by("from_block"))
+        shards: List[Tuple[int, int]] = []
+        # last block of indexer is already indexed
+        cursor = from_block + 1
+        while cursor <= latest_block and len(shards) < self.indexer.backfill_workers * BACKFILL_SHARDS_PER_WORKER:
+            if covering_range := next((indexed_range for indexed_range in indexed_ranges
+                                       if indexed_range.from_block <= cursor <= indexed_range.to_block), None):
+                cursor = covering_range.to_block + 1
+                continue
+            to_block = min(cursor + step - 1, latest_block)
+            if next_range := next((indexed_range for indexed_range in indexed_ranges
+                                   if cursor < indexed_range.from_block <= to_block), None):
+                to_block = next_range.from_block - 1
+            shards.append((cursor, to_block))
+            cursor = to_block + 1
+        return shards
+
+    def advance_last_block(self):
+        # last block moves only through contiguous indexed ranges, so there are no gaps below it
+        last_block = self.indexer.last_block
+        for indexed_range in self.indexer.indexed_ranges.order_by("from_block"):
+            if indexed_range.from_block > last_block + 1:
+                break
+            last_block = max(last_block, indexed_range.to_block)
+        self.indexer.indexed_ranges.filter(to_block__lte=last_block).delete()
+        if last_block != self.indexer.last_block:
+            logger.info(f"Ranges are indexed with no gaps up to block {last_block}. Increase last block")
+            self.increase_last_block(last_block)
+
+    def get_step(self) -> int:
+        return self.indexer.step or self.network.max_step
+
+    def decrease_step(self, failed_step: int):
+        # the next cycle fetches the first half of the failed range
+        self.indexer.step = max(failed_step // 2, 1)
+        self.indexer.save(update_fields=["step"])
+        logger.info(f"Range of {failed_step} blocks is too large for provider. Step decreased to {self.indexer.step}")
+
+    def increase_step(self):
+        if (step := self.get_step()) >= self.network.max_step:
+            return
+        self.indexer.step = min(step * 2, self.network.max_step)
+        self.indexer.save(update_fields=["step"])
+        logger.info(f"Step increased to {self.indexer.step}")
+
+    @staticmethod
+    def is_provider_limit_error(error: Exception) -> bool:
+        if isinstance(error, Timeout):
+            return True
+        message = str(error).lower()
+        return any(marker in message for marker in PROVIDER_LIMIT_ERROR_MARKERS)
 
     def increase_last_block(self, to_block):
         self.indexer.last_block = to_block
@@ -111,31 +404,37 @@ class TransferIndexerWorker(AbstractIndexerWorker):
 
     @staticmethod
     def fetch_transfers(fetching_method: AbstractTransferFetcher, from_block: int, to_block: int) -> \
-            Tuple[List[TransferTransaction], Optional[Exception]]:
+            Tuple[Dict[Token, List[TransferTransaction]], Optional[Exception]]:
         try:
-            return fetching_method.get_transfers(from_block, to_block), None
+            return fetching_method.get_transfers_of_tokens(from_block, to_block), None
         except Exception as e:
             logger.warning(f"During fetching {fetching_method} error occurred {e}")
-            return [], e
+            return {}, e
 
-    def handle_transfers(self, fetching_method: AbstractTransferFetcher, transfers: List[TransferTransaction]) -> bool:
+    def handle_transfers(self, token: Token, transfers: List[TransferTransaction]) -> bool:
         try:
-            self.strategy.start(fetching_method.token, transfers)
+            self.strategy.start(token, transfers)
             return True
         except Exception as e:
-            logger.warning(f"During handling fetched transfers ({fetching_method}) error occurred {e}")
+            logger.warning(f"During handling fetched transfers of {token} error occurred {e}")
             return False
 
     def build_fetchers(self, tokens: QuerySet[Token]):
         self.transfer_fetchers = []
+        event_based_tokens: List[Token] = []
         for token in tokens:
             match token.strategy:
                 case TokenStrategy.event_based_transfer.value:
-                    self.transfer_fetchers.append(EventTransferFetcher(self.w3, token))
+                    event_based_tokens.append(token)
                 case TokenStrategy.receipt_based_transfer.value:
                     self.transfer_fetchers.append(ReceiptTransferFetcher(self.w3, token))
                 case _:
                     raise ValueError(f"Not implemented {token.strategy}")
+        if event_based_tokens:
+            # all event-based tokens are fetched with one eth_getLogs request per range
+            self.transfer_fetchers.append(CombinedEventTransferFetcher(self.w3, event_based_tokens,
+                                                                       self.strategy.get_sender_filter(),
+                                                                       self.strategy.get_recipient_filter()))
 
     def build_strategy(self, strategy: str, strategy_params: Dict):
         match strategy:
@@ -152,6 +451,7 @@ class TransferIndexerWorker(AbstractIndexerWorker):
 class BalanceIndexerWorker(AbstractIndexerWorker):
     strategy: AbstractBalanceStrategy
     balance_fetchers: List[AbstractBalanceFetcher]
+    ledger_tokens: List[Token]
 
     def __init__(self, indexer: Indexer):
         super().__init__(indexer)
@@ -163,17 +463,74 @@ class BalanceIndexerWorker(AbstractIndexerWorker):
             case IndexerStrategy.specified_holders.value:
                 self.strategy = SpecifiedHoldersStrategy(strategy_params)
             case IndexerStrategy.transfers_participants.value:
-                self.strategy = TransfersParticipantsStrategy(strategy_params)
+                self.strategy = TransfersParticipantsStrategy(self.indexer)
+            case IndexerStrategy.transfers_ledger.value:
+                self.strategy = TransfersLedgerStrategy(self.indexer)
 
     def build_fetchers(self, tokens: QuerySet[Token]):
         self.balance_fetchers = []
+        self.ledger_tokens = []
+        if isinstance(self.strategy, TransfersLedgerStrategy):
+            self.build_ledger_fetchers(tokens)
+            return
         for token in tokens:
             self.balance_fetchers.append(SimpleBalanceFetcher(self.w3, token, self.indexer))
 
+    def build_ledger_fetchers(self, tokens: QuerySet[Token]):
+        # ledger works with amounts, fetchers are used for spot checks only
+        self.ledger_tokens = [token for token in tokens if token.type in LEDGER_TOKENS]
+        if skipped_tokens := [token.name for token in tokens if token.type not in LEDGER_TOKENS]:
+            logger.warning(f"Ledger does not handle tokens {', '.join(skipped_tokens)}: only ERC20 and ERC1155 "
+                           f"balances are computed from transfers")
+        Indexer.validate_ledger_setup(self.indexer.pk, self.indexer.type, self.indexer.strategy, self.ledger_tokens)
+        # transfers indexed before log index was stored are duplicated by re-indexing, so they give wrong balances
+        if TokenTransfer.objects.filter(token_instance__in=self.ledger_tokens, log_index__isnull=True).exists():
+            raise ValueError("Ledger needs transfers indexed with log index. Delete transfers of its tokens and "
+                             "re-index them from the deployment block")
+        for token in self.ledger_tokens:
+            self.balance_fetchers.append(SimpleBalanceFetcher(self.w3, token, self.indexer))
+
     def _cycle_body(self):
+        if isinstance(self.strategy, TransfersLedgerStrategy):
+            self.ledger_cycle_body(self.strategy)
+            return
+        self.strategy.begin_cycle([balance_fetcher.token for balance_fetcher in self.balance_fetchers])
+        # balances of the whole cycle are fetched at one block
+        self.pin_block(self.get_latest_block())
         for balance_fetcher in self.balance_fetchers:
             holders = self.strategy.start(balance_fetcher.token)
-            balance_fetcher.get_balances(holders)
+            # strategy gives holders whose balances were not fetched again on the next cycles
+            self.strategy.retry(balance_fetcher.token, balance_fetcher.get_balances(holders))
+        self.strategy.end_cycle()
+
+    def ledger_cycle_body(self, strategy: TransfersLedgerStrategy):
+        applied = strategy.apply_transfers(self.ledger_tokens)
+        logger.info(f"Ledger applied {applied} new transfers")
+        holders_of_fetchers = [(balance_fetcher, holders) for balance_fetcher in self.balance_fetchers
+                               if (holders := strategy.start(balance_fetcher.token))]
+        if not holders_of_fetchers:
+            return
+        self.pin_block(self.get_ledger_block())
+        for balance_fetcher, holders in holders_of_fetchers:
+            for balance in balance_fetcher.find_drifted_balances(holders):
+                logger.warning(f"Ledger balance of {balance.holder} on {balance_fetcher.token.name} drifted "
+                               f"from on-chain {balance.amount}")
+
+    def pin_block(self, block_number: Optional[int]):
+        if block_number is None:
+            logger.warning(f"Failed to pin a block, balances are fetched at the latest one")
+        for balance_fetcher in self.balance_fetchers:
+            balance_fetcher.pin_block(block_number)
+
+    def get_ledger_block(self) -> Optional[int]:
+        # on-chain balances are compared with the ledger at the block which transfers are indexed up to
+        latest_block = self.get_latest_block()
+        indexed_block = Indexer.objects.filter(type=IndexerType.transfer_indexer, network=self.network,
+                                               watched_tokens__in=self.ledger_tokens) \
+            .aggregate(indexed_block=Min("last_block"))["indexed_block"]
+        if latest_block is None or indexed_block is None:
+            return latest_block
+        return min(latest_block, indexed_block)
 
 
 class IndexerWorkerFactory:
@@ -0,0 +1,67 @@
+import json
+from logging import getLogger
+from typing import Any, Dict, List, Optional, Sequence, cast
+
+from requests import HTTPError
+from web3 import Web3, HTTPProvider
+from web3._utils.request import make_post_request
+from eth_typing import URI
+
+from .utils import RateLimiter
+
+logger = getLogger(__name__)
+
+# statuses which providers answer with when they do not accept JSON-RPC batch arrays
+BATCH_REJECTION_STATUSES = (400, 405, 413, 415)
+
+
+class BatchRequestsNotSupported(Exception):
+    pass
+
+
+class JsonRpcBatchCaller:
+    # sends JSON-RPC batch arrays over the same HTTP session as the HTTPProvider of w3
+    w3: Web3
+    batch_size: int
+    rate_limiter: Optional[RateLimiter]
+
+    def __init__(self, w3: Web3, batch_size: int, rate_limiter: Optional[RateLimiter] = None):
+        self.w3 = w3
+        self.batch_size = max(batch_size, 1)
+        self.rate_limiter = rate_limiter
+
+    def call(self, method: str, params_list: Sequence[Sequence[Any]]) -> List[Any]:
+        result: List[Any] = []
+        for start in range(0, len(params_list), self.batch_size):
+            result.extend(self._call_batch(method, params_list[start: start + self.batch_size]))
+        return result
+
+    def _call_batch(self, method: str, params_list: Sequence[Sequence[Any]]) -> List[Any]:
+        provider = self.w3.provider
+        if not isinstance(provider, HTTPProvider):
+            raise BatchRequestsNotSupported(f"Batch requests are available only with HTTP provider, got {provider}")
+        request = [{"jsonrpc": "2.0", "id": request_id, "method": method, "params": list(params)}
+                   for request_id, params in enumerate(params_list)]
+        # batches bypass middlewares of w3, every request of a batch counts towards the limit
+        if self.rate_limiter:
+            self.rate_limiter.acquire(len(request))
+        try:
+            raw_response = make_post_request(cast(URI, provider.endpoint_uri), json.dumps(request).encode(),
+                                             **provider.get_request_kwargs())
+        except HTTPError as e:
+            if e.response is not None and e.response.status_code in BATCH_REJECTION_STATUSES:
+                raise BatchRequestsNotSupported(f"Provider rejected batch request: {e}")
+            raise
+        response = json.loads(raw_response)
+        if not isinstance(response, list) or len(response) != len(request):
+            raise BatchRequestsNotSupported(f"Provider answered batch request with non-batch response: {response}")
+        return self._get_results(method, response)
+
+    @staticmethod
+    def _get_results(method: str, response: List[Dict]) -> List[Any]:
+        result: List[Any] = [None] * len(response)
+        for item in response:
+            if error := item.get("error"):
+                raise ValueError(f"Batch request {method} failed: {error}")
+            result[item["id"]] = item.get("result")
+        return result
@@ -0,0 +1,82 @@
+import json
+from logging import getLogger
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+from web3._utils.method_formatters import log_entry_formatter
+from web3.types import FilterParams, LogReceipt
+from websockets.sync.client import connect, ClientConnection
+
+logger = getLogger(__name__)
+
+LIVE_CONNECT_TIMEOUT_SECONDS = 10
+
+
+class LogSubscription:
+    # eth_subscribe("logs") over WebSocket: node pushes logs matching the filters as soon as blocks are imported.
+    # Heads are subscribed on the same connection, so blocks whose logs were pushed are known from the node itself
+    ws_url: str
+    filters: Sequence[FilterParams]
+    connection: Optional[ClientConnection]
+    subscription_ids: Set[str]
+    heads_subscription_id: Optional[str]
+    pending_logs: List[LogReceipt]
+    head_block: Optional[int]
+
+    def __init__(self, ws_url: str, filters: Sequence[FilterParams]):
+        self.ws_url = ws_url
+        self.filters = filters
+        self.connection = None
+        self.subscription_ids = set()
+        self.heads_subscription_id = None
+        self.pending_logs = []
+        self.head_block = None
+
+    def __enter__(self) -> "LogSubscription":
+        self.connection = connect(self.ws_url, open_timeout=LIVE_CONNECT_TIMEOUT_SECONDS)
+        for request_id, log_filter in enumerate(self.filters):
+            self.connection.send(json.dumps({"jsonrpc": "2.0", "id": request_id, "method": "eth_subscribe",
+                                             "params": ["logs", log_filter]}))
+        heads_request_id = len(self.filters)
+        self.connection.send(json.dumps({"jsonrpc": "2.0", "id": heads_request_id, "method": "eth_subscribe",
+                                         "params": ["newHeads"]}))
+        # logs may be pushed before all subscriptions are confirmed
+        while len(self.subscription_ids) <= len(self.filters):
+            message = json.loads(self.connection.recv(LIVE_CONNECT_TIMEOUT_SECONDS))
+            if "id" not in message:
+                self._handle_notification(message)
+                continue
+            if error := message.get("error"):
+                raise ValueError(f"Failed to subscribe to logs: {error}")
+            self.subscription_ids.add(message["result"])
+            if message["id"] == heads_request_id:
+                self.heads_subscription_id = message["result"]
+        logger.info(f"Subscribed to logs with {len(self.filters)} filters")
+        return self
+
+    def __exit__(self, *args):
+        if self.connection:
+            self.connection.close()
+
+    def receive(self, timeout: float) -> List[LogReceipt]:
+        # logs pushed within timeout; raises ConnectionClosed when node drops connection
+        if not self.connection:
+            raise ValueError("Subscription is not started")
+        try:
+            self._handle_notification(json.loads(self.connection.recv(timeout)))
+            # the rest of already arrived logs is taken without waiting
+            while True:
+                self._handle_notification(json.loads(self.connection.recv(0)))
+        except TimeoutError:
+            pass
+        result, self.pending_logs = self.pending_logs, []
+        return result
+
+    def _handle_notification(self, message: Dict[str, Any]):
+        # the connection carries only subscriptions of this object
+        if message.get("method") != "eth_subscription":
+            return
+        params = message["params"]
+        if params["subscription"] == self.heads_subscription_id:
+            self.head_block = max(self.head_block or 0, int(params["result"]["number"], 16))
+        else:
+            self.pending_logs.append(log_entry_formatter(params["result"]))
@@ -0,0 +1,116 @@
+import dataclasses
+import threading
+from logging import getLogger
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from eth_abi import decode, encode
+from web3 import Web3
+from web3.types import BlockIdentifier, ChecksumAddress, HexBytes
+
+from .contracts import contract_registry
+
+logger = getLogger(__name__)
+
+MULTICALL_BATCH_SIZE = 500
+# results of calls are kept for this amount of the latest (chain, block) pairs
+CALL_CACHE_BLOCKS = 8
+
+
+@dataclasses.dataclass
+class Call:
+    target: ChecksumAddress
+    call_data: bytes
+    allow_failure: bool = True
+
+
+@dataclasses.dataclass
+class CallResult:
+    success: bool
+    return_data: bytes
+
+
+class BlockCallCache:
+    # results of calls pinned to a block never change, so indexers of the same process answer identical calls of a
+    # snapshot block from here; only the latest blocks are kept
+    _results: Dict[Tuple[int, int], Dict[Tuple[str, bytes], CallResult]]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def get(self, chain_id: int, block_number: int, call: Call) -> Optional[CallResult]:
+        if (block_results := self._results.get((chain_id, block_number))) is None:
+            return None
+        return block_results.get((call.target.lower(), call.call_data))
+
+    def put(self, chain_id: int, block_number: int, calls: Sequence[Call], results: Sequence[CallResult]):
+        with self._lock:
+            if (block_results := self._results.get((chain_id, block_number))) is None:
+                block_results = self._results[(chain_id, block_number)] = {}
+                # the oldest pinned blocks are dropped
+                for key in list(self._results)[:-CALL_CACHE_BLOCKS]:
+                    del self._results[key]
+            for call, result in zip(calls, results):
+                block_results[(call.target.lower(), call.call_data)] = result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+call_cache = BlockCallCache()
+
+
+class Multicall:
+    # packs many contract calls into one aggregate3 eth_call
+    w3: Web3
+    chain_id: int
+    address: ChecksumAddress
+    batch_size: int
+    selector: HexBytes
+
+    def __init__(self, w3: Web3, chain_id: int, address: str, batch_size: int = MULTICALL_BATCH_SIZE):
+        self.w3 = w3
+        self.chain_id = chain_id
+        self.address = Web3.to_checksum_address(address)
+        self.batch_size = max(batch_size, 1)
+        self.selector = contract_registry.get_abi("Multicall3.json").function_selectors["aggregate3((address,bool,bytes)[])"]
+
+    def aggregate(self, calls: Sequence[Call], block_identifier: BlockIdentifier = "latest") -> List[CallResult]:
+        if not isinstance(block_identifier, int):
+            return self._aggregate(calls, block_identifier)
+        # only calls which were not made at the pinned block yet are sent
+        cached_results = [call_cache.get(self.chain_id, block_identifier, call) for call in calls]
+        missed_calls = [call for call, call_result in zip(calls, cached_results) if call_result is None]
+        missed_results = self._aggregate(missed_calls, block_identifier) if missed_calls else []
+        call_cache.put(self.chain_id, block_identifier, missed_calls, missed_results)
+        logger.debug(f"{len(calls) - len(missed_calls)} of {len(calls)} calls at block {block_identifier} are cached")
+        missed_results_iterator = iter(missed_results)
+        return [call_result or next(missed_results_iterator) for call_result in cached_results]
+
+    def _aggregate(self, calls: Sequence[Call], block_identifier: BlockIdentifier) -> List[CallResult]:
+        result: List[CallResult] = []
+        for start in range(0, len(calls), self.batch_size):
+            result.extend(self._aggregate_batch(calls[start: start + self.batch_size], block_identifier))
+        return result
+
+    def _aggregate_batch(self, calls: Sequence[Call], block_identifier: BlockIdentifier) -> List[CallResult]:
+        data = self.selector + encode(["(address,bool,bytes)[]"],
+                                      [[(call.target, call.allow_failure, call.call_data) for call in calls]])
+        raw_result = self.w3.eth.call({"to": self.address, "data": HexBytes(data)}, block_identifier)
+        results: Sequence[Tuple[bool, bytes]] = decode(["(bool,bytes)[]"], raw_result)[0]
+        if len(results) != len(calls):
+            raise ValueError(f"Multicall {self.address} returned {len(results)} results for {len(calls)} calls")
+        return [CallResult(success=success, return_data=return_data) for success, return_data in results]
+
+    @staticmethod
+    def encode_address_call(selector: bytes, address: str) -> bytes:
+        # calldata of a function with the only address argument like balanceOf(address)
+        return selector + bytes(12) + bytes.fromhex(address[-40:])
+
+    @staticmethod
+    def decode_uint256(result: CallResult) -> int:
+        if not result.success or len(result.return_data) < 32:
+            raise ValueError(f"Call failed or returned no uint256: {result}")
+        return int.from_bytes(result.return_data[:32], byteorder="big")
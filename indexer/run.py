@@ -9,12 +9,20 @@ sys.path.append(django_dir)
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 django.setup()
 
-INDEXER_NAME = os.environ["INDEXER_NAME"]
+INDEXER_NAME = os.environ.get("INDEXER_NAME")
+# comma separated names of indexers run in one process
+INDEXER_NAMES = os.environ.get("INDEXER_NAMES")
 
 from indexer.indexers import IndexerWorkerFactory
+from indexer.host import IndexerHost
 
 
 def main():
+    if INDEXER_NAMES:
+        IndexerHost([indexer_name.strip() for indexer_name in INDEXER_NAMES.split(",") if indexer_name.strip()]).run()
+        return
+    if not INDEXER_NAME:
+        raise ValueError("Provide INDEXER_NAME or INDEXER_NAMES env")
     IndexerWorkerFactory.build_indexer(INDEXER_NAME).cycle()
 
 
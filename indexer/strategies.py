@@ -1,16 +1,63 @@
 import abc
+import random
+import time
 from abc import ABC
+from collections import defaultdict
 from logging import getLogger
-from typing import List, Dict
+from typing import Collection, List, Dict, Optional, Sequence, Set, Tuple
 
+from django.db import connection, transaction
+from django.db.models import Q
 from web3.types import ChecksumAddress
-from web3 import Web3
 
-from indexer_api.models import Token, TokenTransfer, Indexer, TokenType
+from indexer_api.models import Token, TokenTransfer, TokenBalance, Indexer, IndexerType, IndexerStrategy
 from .transfer_transactions import TransferTransaction
+from .utils import to_checksum_address
 
 logger = getLogger(__name__)
 
+TRANSFERS_BATCH_SIZE = 1000
+LEDGER_BATCH_SIZE = 10000
+# holders whose balances failed to be fetched are given again this many cycles
+HOLDER_RETRY_LIMIT = 5
+# transfer fields which ledger deltas are computed from
+LEDGER_TRANSFER_FIELDS = ("id", "token_instance_id", "sender", "recipient", "token_id", "amount")
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+
+class CommittedTransfersWatermark:
+    # transfer ids are taken from a sequence on insert, but concurrent transactions (backfill shards, pipeline,
+    # other indexers) commit them out of order, so lower ids may still be in flight when a higher one is visible.
+    # Max id seen in a snapshot is safe once every transaction running at that snapshot has finished
+    safe_transfer_id: int
+    pending: Optional[Tuple[int, int]]
+
+    def __init__(self, safe_transfer_id: int):
+        self.safe_transfer_id = safe_transfer_id
+        self.pending = None
+
+    def get_safe_transfer_id(self) -> int:
+        with connection.cursor() as cursor:
+            # in-flight list of snapshot leaves out the own transaction, unlike its xmin
+            cursor.execute(f"SELECT (SELECT MIN(xip::text::bigint) "
+                           f"FROM pg_snapshot_xip(pg_current_snapshot()) AS xip), "
+                           f"pg_snapshot_xmax(pg_current_snapshot())::text::bigint, MAX(id) "
+                           f"FROM {TokenTransfer._meta.db_table}")
+            oldest_in_flight, xmax, max_transfer_id = cursor.fetchone()
+        xmin = oldest_in_flight or xmax
+        if self.pending and self.pending[0] <= xmin:
+            self.safe_transfer_id = max(self.safe_transfer_id, self.pending[1])
+            self.pending = None
+        if max_transfer_id is None or max_transfer_id <= self.safe_transfer_id:
+            return self.safe_transfer_id
+        if xmin == xmax:
+            # no transaction is in flight
+            self.safe_transfer_id = max_transfer_id
+        elif not self.pending:
+            # the oldest observation is kept, so it settles even if writers never stop
+            self.pending = (xmax, max_transfer_id)
+        return self.safe_transfer_id
+
 
 class AbstractStrategy(abc.ABC):
     strategy_params: Dict
@@ -30,77 +77,97 @@ class AbstractTransferStrategy(AbstractStrategy, abc.ABC):
     def start(self, token: Token, transfer_transactions: List[TransferTransaction]):
         pass
 
-    def _save_transfer_to_database(self, token: Token, transfer_transaction: TransferTransaction):
-        token_transfer = transfer_transaction.to_token_transfer_model()
-        match token.type:
-            case TokenType.erc1155:
-                self.__save_erc1155_transfer_to_database(token, token_transfer)
-            case _:
-                self.__save_other_transfer_to_database(token, token_transfer)
-
-    def __save_erc1155_transfer_to_database(self, token: Token, token_transfer: TokenTransfer):
-        if TokenTransfer.objects.filter(tx_hash=token_transfer.tx_hash, token_id=token_transfer.token_id).exists():
-            logger.info(f"ERC1155 Transfer skipped: tx with hash {token_transfer.tx_hash} on token "
-                        f"{token.name} with id {token_transfer.token_id} "
-                        f"(chain id: {token.network.chain_id}) already indexed")
-        else:
-            token_transfer.token_instance = token
-            token_transfer.fetched_by = self.indexer
-            token_transfer.save()
+    # participants filters are pushed down to fetchers, so irrelevant transfers are not requested from node
+    def get_sender_filter(self) -> Optional[str]:
+        return None
+
+    def get_recipient_filter(self) -> Optional[str]:
+        return None
 
-    def __save_other_transfer_to_database(self, token: Token, token_transfer: TokenTransfer):
-        if TokenTransfer.objects.filter(tx_hash=token_transfer.tx_hash).exists():
-            logger.info(f"Transfer skipped: tx with hash {token_transfer.tx_hash} on token "
-                        f"{token.name} (chain id: {token.network.chain_id}) already indexed")
-        else:
+    def _save_transfers_to_database(self, token: Token, transfer_transactions: List[TransferTransaction]):
+        # already indexed transfers are skipped by unique constraint of TokenTransfer (ON CONFLICT DO NOTHING)
+        token_transfers: List[TokenTransfer] = []
+        for transfer_transaction in transfer_transactions:
+            token_transfer = transfer_transaction.to_token_transfer_model()
             token_transfer.token_instance = token
             token_transfer.fetched_by = self.indexer
-            token_transfer.save()
+            token_transfers.append(token_transfer)
+        TokenTransfer.objects.bulk_create(token_transfers, batch_size=TRANSFERS_BATCH_SIZE, ignore_conflicts=True)
+        logger.info(f"Saved {len(token_transfers)} transfers of {token.name} (chain id: {token.network.chain_id}), "
+                    f"already indexed ones are skipped")
+
+    def remove(self, token: Token, transfer_transactions: List[TransferTransaction]):
+        # transfers of logs removed by chain reorganization are found by their position, whatever strategy saved them
+        if not transfer_transactions:
+            return
+        positions = Q()
+        for transfer_transaction in transfer_transactions:
+            positions |= Q(tx_hash=transfer_transaction.tx_hash, log_index=transfer_transaction.log_index)
+        removed_transfers = TokenTransfer.objects.filter(positions, token_instance=token)
+        with transaction.atomic():
+            # ledgers which already applied the transfers are locked, so they do not apply them meanwhile
+            for ledger in Indexer.objects.select_for_update().order_by("pk").filter(
+                    type=IndexerType.balance_indexer, strategy=IndexerStrategy.transfers_ledger, watched_tokens=token):
+                if applied_transfers := list(removed_transfers.filter(id__lte=ledger.last_transfer_id)
+                                             .values_list(*LEDGER_TRANSFER_FIELDS)):
+                    TransfersLedgerStrategy(ledger).revert_transfers(applied_transfers)
+            deleted, _ = removed_transfers.delete()
+        logger.info(f"Deleted {deleted} transfers of {token.name} removed by chain reorganization")
 
 
 class RecipientStrategy(AbstractTransferStrategy):
 
+    def get_recipient_filter(self) -> Optional[str]:
+        return self.strategy_params.get("recipient")
+
     def start(self, token: Token, transfer_transactions: List[TransferTransaction]):
         if not (recipient := self.strategy_params.get("recipient")):
             raise ValueError("Strategy has no recipient provided. Please add recipient address to the strategy dict")
-        transfers_found = 0
-        for transfer_transaction in transfer_transactions:
-            if transfer_transaction.recipient.lower() == recipient.lower():
-                self._save_transfer_to_database(token, transfer_transaction)
-                transfers_found += 1
-        logger.info(f"Found {transfers_found} transfers of {token.name} with recipient {recipient}")
-        logger.info(f"Saved transfers to database")
+        recipient = recipient.lower()
+        transfers_found = [transfer_transaction for transfer_transaction in transfer_transactions
+                           if transfer_transaction.recipient.lower() == recipient]
+        logger.info(f"Found {len(transfers_found)} transfers of {token.name} with recipient {recipient}")
+        self._save_transfers_to_database(token, transfers_found)
 
 
 class SenderStrategy(AbstractTransferStrategy):
 
+    def get_sender_filter(self) -> Optional[str]:
+        return self.strategy_params.get("sender")
+
     def start(self, token: Token, transfer_transactions: List[TransferTransaction]):
         if not (sender := self.strategy_params.get("sender")):
             raise ValueError("Strategy has no sender provided. Please add sender address to the strategy dict")
-        transfers_found = 0
-        for transfer_transaction in transfer_transactions:
-            if transfer_transaction.sender.lower() == sender.lower():
-                self._save_transfer_to_database(token, transfer_transaction)
-                transfers_found += 1
-        logger.info(f"Found {transfers_found} transfers of {token.name} with sender {sender}")
-        logger.info(f"Saved transfers to database")
+        sender = sender.lower()
+        transfers_found = [transfer_transaction for transfer_transaction in transfer_transactions
+                           if transfer_transaction.sender.lower() == sender]
+        logger.info(f"Found {len(transfers_found)} transfers of {token.name} with sender {sender}")
+        self._save_transfers_to_database(token, transfers_found)
 
 
 class TokenScanStrategy(AbstractTransferStrategy):
 
     def start(self, token: Token, transfer_transactions: List[TransferTransaction]):
         logger.info(f"Found {len(transfer_transactions)} transfers of {token.name}")
-        for transfer_transaction in transfer_transactions:
-            self._save_transfer_to_database(token, transfer_transaction)
-        logger.info(f"Saved transfers to database")
+        self._save_transfers_to_database(token, transfer_transactions)
 
 
 class AbstractBalanceStrategy(AbstractStrategy, ABC):
 
+    def begin_cycle(self, tokens: Sequence[Token]):
+        pass
+
     @abc.abstractmethod
     def start(self, token: Token) -> List[ChecksumAddress]:
         raise NotImplementedError()
 
+    def retry(self, token: Token, holders: List[ChecksumAddress]):
+        # holders whose balances were not fetched in this cycle
+        pass
+
+    def end_cycle(self):
+        pass
+
 
 class SpecifiedHoldersStrategy(AbstractBalanceStrategy):
     def start(self, token: Token):
@@ -111,13 +178,176 @@ class SpecifiedHoldersStrategy(AbstractBalanceStrategy):
 
 
 class TransfersParticipantsStrategy(AbstractBalanceStrategy):
+    # returns participants of transfers indexed since the last cycle using transfer id cursor of indexer,
+    # all participants ever seen are returned only by a full sweep once in `full_sweep_seconds` if it is set.
+    # Holders whose balances failed are saved on indexer with the cursor and given again by the next cycles,
+    # so they do not hold the cursor
+    indexer: Indexer
+    high_water_transfer_id: int
+    full_sweep: bool
+    last_full_sweep_at: Optional[float]
+    watermark: CommittedTransfersWatermark
+
+    def __init__(self, indexer: Indexer):
+        super().__init__(indexer.strategy_params or {})
+        self.indexer = indexer
+        self.high_water_transfer_id = indexer.last_transfer_id
+        self.full_sweep = False
+        self.last_full_sweep_at = None
+        self.watermark = CommittedTransfersWatermark(indexer.last_transfer_id)
+
+    def begin_cycle(self, tokens: Sequence[Token]):
+        # transfers which may be committed later with lower ids are left to the next cycles
+        self.high_water_transfer_id = self.watermark.get_safe_transfer_id()
+        self.full_sweep = self._is_full_sweep_due()
+
+    def _is_full_sweep_due(self) -> bool:
+        if not (full_sweep_seconds := self.strategy_params.get("full_sweep_seconds")):
+            return False
+        return self.last_full_sweep_at is None or time.monotonic() - self.last_full_sweep_at >= full_sweep_seconds
+
+    def _get_retry_holders(self, token: Token) -> Dict[str, int]:
+        # attempts made for every holder to retry, by token pk (JSON keys are strings)
+        return self.indexer.retry_holders.setdefault(str(token.pk), {})
 
     def start(self, token: Token) -> List[ChecksumAddress]:
-        transfer_participant_pair = TokenTransfer.objects.filter(token_instance=token).values("sender",
-                                                                                              "recipient").distinct()
+        transfers = TokenTransfer.objects.filter(token_instance=token, id__lte=self.high_water_transfer_id)
+        if not self.full_sweep:
+            transfers = transfers.filter(id__gt=self.indexer.last_transfer_id)
         result = set()
-        for pair in transfer_participant_pair:
+        for pair in transfers.values("sender", "recipient").distinct():
             result.add(pair["sender"])
             result.add(pair["recipient"])
-        logger.info(f"Found {len(result)} token transfer participants. Find their balances")
-        return list(map(lambda address: Web3.to_checksum_address(address), result))
+        logger.info(f"Found {len(result)} token transfer participants "
+                    f"{'in full sweep' if self.full_sweep else 'since the last cycle'}. Find their balances")
+        retry_holders = self._get_retry_holders(token)
+        if retry_holders:
+            logger.info(f"Retry balances of {len(retry_holders)} holders of {token.name}")
+        return list(set(map(to_checksum_address, result)) | set(map(to_checksum_address, retry_holders)))
+
+    def retry(self, token: Token, holders: List[ChecksumAddress]):
+        retry_holders = self._get_retry_holders(token)
+        failed_holders = set(holders)
+        # holders fetched successfully are not retried anymore
+        for holder in retry_holders.keys() - failed_holders:
+            del retry_holders[holder]
+        for holder in failed_holders:
+            retry_holders[holder] = retry_holders.get(holder, 0) + 1
+        # without full sweeps nothing else refreshes holders, so they are retried until their balances are fetched
+        if not self.strategy_params.get("full_sweep_seconds"):
+            return
+        if exhausted_holders := [holder for holder, attempts in retry_holders.items()
+                                 if attempts > HOLDER_RETRY_LIMIT]:
+            logger.warning(f"Balances of {len(exhausted_holders)} holders of {token.name} failed "
+                           f"{HOLDER_RETRY_LIMIT} retries, they are left to the next full sweep")
+            for holder in exhausted_holders:
+                del retry_holders[holder]
+
+    def end_cycle(self):
+        # cursor moves after every token is handled, failed holders are retried apart from it
+        if self.full_sweep:
+            self.last_full_sweep_at = time.monotonic()
+        self.indexer.last_transfer_id = self.high_water_transfer_id
+        self.indexer.retry_holders = {token_pk: holders for token_pk, holders in self.indexer.retry_holders.items()
+                                      if holders}
+        self.indexer.save(update_fields=["last_transfer_id", "retry_holders"])
+
+
+class TransfersLedgerStrategy(AbstractBalanceStrategy):
+    # balances are computed from indexed transfers: every new transfer is applied as signed deltas of its participants
+    # starting from the transfer id high-water mark of indexer, so no RPC requests are needed
+    indexer: Indexer
+    touched_holders: Dict[int, Set[str]]
+    watermark: CommittedTransfersWatermark
+
+    def __init__(self, indexer: Indexer):
+        super().__init__(indexer.strategy_params or {})
+        self.indexer = indexer
+        self.touched_holders = defaultdict(set)
+        self.watermark = CommittedTransfersWatermark(indexer.last_transfer_id)
+
+    def start(self, token: Token) -> List[ChecksumAddress]:
+        # holders of the last applied transfers whose balances are compared with on-chain ones to catch drift
+        holders = list(self.touched_holders.pop(token.pk, set()))
+        spot_check_holders = min(self.strategy_params.get("spot_check_holders", 0), len(holders))
+        return list(map(to_checksum_address, random.sample(holders, spot_check_holders)))
+
+    def apply_transfers(self, tokens: Sequence[Token]) -> int:
+        applied = 0
+        # transfers which may be committed later with lower ids are not applied yet, the mark never passes them
+        safe_transfer_id = self.watermark.get_safe_transfer_id()
+        while True:
+            with transaction.atomic():
+                # transfers removed by chain reorganization are deleted under the same lock, so a batch never
+                # applies a transfer deleted after it was read
+                list(Indexer.objects.select_for_update().filter(pk=self.indexer.pk).values_list("pk"))
+                transfers = list(TokenTransfer.objects
+                                 .filter(token_instance__in=tokens, id__gt=self.indexer.last_transfer_id,
+                                         id__lte=safe_transfer_id)
+                                 .order_by("id")
+                                 .values_list(*LEDGER_TRANSFER_FIELDS)
+                                 [:LEDGER_BATCH_SIZE])
+                if not transfers:
+                    return applied
+                if not self.indexer.last_transfer_id:
+                    # ledger computes balances from the first transfer, so balances fetched before it owned the
+                    # tokens are not a base for its deltas
+                    TokenBalance.objects.filter(token_instance__in=tokens).delete()
+                self._apply_deltas(self._get_deltas(transfers))
+                self.indexer.last_transfer_id = transfers[-1][0]
+                self.indexer.save(update_fields=["last_transfer_id"])
+            applied += len(transfers)
+            logger.info(f"Applied {len(transfers)} transfers to balances, last transfer id is "
+                        f"{self.indexer.last_transfer_id}")
+
+    def revert_transfers(self, transfers: Sequence[Tuple]):
+        # transfers already applied to balances are subtracted from them before they are deleted
+        deltas = self._get_deltas(transfers)
+        self._apply_deltas({key: -delta for key, delta in deltas.items()})
+        logger.info(f"Reverted {len(transfers)} transfers from balances of ledger {self.indexer.name}")
+
+    def _get_deltas(self, transfers: Sequence[Tuple]) -> Dict[Tuple[int, str, Optional[int]], int]:
+        deltas: Dict[Tuple[int, str, Optional[int]], int] = defaultdict(int)
+        for _, token_pk, sender, recipient, token_id, amount in transfers:
+            token_id = int(token_id) if token_id is not None else None
+            amount = int(amount or 0)
+            # mints and burns change balance of the other participant only
+            if sender != ZERO_ADDRESS:
+                deltas[(token_pk, sender, token_id)] -= amount
+                self.touched_holders[token_pk].add(sender)
+            if recipient != ZERO_ADDRESS:
+                deltas[(token_pk, recipient, token_id)] += amount
+                self.touched_holders[token_pk].add(recipient)
+        return deltas
+
+    def _apply_deltas(self, deltas: Dict[Tuple[int, str, Optional[int]], int]):
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        balances_by_key = self._select_balances(deltas.keys())
+        if missing_keys := deltas.keys() - balances_by_key.keys():
+            # a lingering process of the same indexer may insert the same rows meanwhile, so missing rows are
+            # created empty (ON CONFLICT DO NOTHING) and selected under lock together with the concurrent ones
+            TokenBalance.objects.bulk_create([TokenBalance(token_instance_id=token_pk, holder=holder, token_id=token_id,
+                                                           amount=0, tracked_by=self.indexer)
+                                              for token_pk, holder, token_id in missing_keys],
+                                             batch_size=TRANSFERS_BATCH_SIZE, ignore_conflicts=True)
+            balances_by_key.update(self._select_balances(missing_keys))
+        balances_to_update: List[TokenBalance] = []
+        for key, delta in deltas.items():
+            balance = balances_by_key[key]
+            balance.amount = (balance.amount or 0) + delta
+            balance.tracked_by = self.indexer
+            # amounts computed from transfers are not fetched at a block
+            balance.block_number = None
+            balances_to_update.append(balance)
+        TokenBalance.objects.bulk_update(balances_to_update, ["amount", "tracked_by", "block_number"],
+                                         batch_size=TRANSFERS_BATCH_SIZE)
+
+    @staticmethod
+    def _select_balances(keys: Collection[Tuple[int, str, Optional[int]]]) \
+            -> Dict[Tuple[int, str, Optional[int]], TokenBalance]:
+        token_balances = TokenBalance.objects.select_for_update().filter(
+            token_instance_id__in={token_pk for token_pk, _, _ in keys},
+            holder__in={holder for _, holder, _ in keys})
+        return {(balance.token_instance_id, balance.holder,
+                 int(balance.token_id) if balance.token_id is not None else None): balance
+                for balance in token_balances}
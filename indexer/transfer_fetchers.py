@@ -1,13 +1,15 @@
 import abc
-import json
 from logging import getLogger
-from typing import List, Callable, Type, Dict, Sequence, cast
+from typing import Any, List, Type, Dict, Optional, Sequence, Set, cast
 
 from web3 import Web3
 from web3.contract import Contract
-from web3.contract.contract import ContractEvent
-from web3.types import TxData, HexStr, TxReceipt
+from web3.exceptions import MethodUnavailable
+from web3.types import FilterParams, TxData, HexStr, HexBytes, LogReceipt, RPCEndpoint
 
+from indexer.contracts import contract_registry
+from indexer.json_rpc import JsonRpcBatchCaller, BatchRequestsNotSupported
+from indexer.utils import to_checksum_address, get_rate_limiter
 from indexer.transfer_transactions import (TransferTransaction,
                                            FungibleTransferTransaction,
                                            NonFungibleTransferTransaction,
@@ -30,48 +32,43 @@ class AbstractTransferFetcher(abc.ABC):
     def get_transfers(self, from_block: int, to_block: int) -> List[TransferTransaction]:
         pass
 
+    def get_transfers_of_tokens(self, from_block: int, to_block: int) -> Dict[Token, List[TransferTransaction]]:
+        return {self.token: self.get_transfers(from_block, to_block)}
+
 
 class EventTransferFetcher(AbstractTransferFetcher):
     contract: Contract
-    events: List[ContractEvent]
-    get_events_function: Callable[[int, int], List[TransferTransaction]]
     token_action_type: Type[TransferTransaction]
     network_type: str
+    # when set, only transfers of these participants are requested from node
+    sender: Optional[str]
+    recipient: Optional[str]
 
-    def __init__(self, w3: Web3, token: Token):
+    def __init__(self, w3: Web3, token: Token, sender: Optional[str] = None, recipient: Optional[str] = None):
         super().__init__(w3, token)
-        abi = self._get_abi(token.type)
+        self.sender = sender
+        self.recipient = recipient
         address = token.address
         if not address:
             raise ValueError(f"Cannot fetch events on native token. Use Receipt strategy instead")
-        self.contract = self.w3.eth.contract(address=w3.to_checksum_address(address), abi=abi)
-        self.events = list(map(lambda event_name: cast(ContractEvent, self.contract.events[event_name]), self._get_event_names(token.type)))
+        self.contract = contract_registry.get_contract(w3, address, self._get_abi_filename(token.type))
         self.network_type = token.network.type
         self.token_action_type = self._get_transfer_transaction_type(token.type)
 
     @staticmethod
-    def _get_abi(token_type: str) -> List[Dict]:
+    def _get_abi_filename(token_type: str) -> str:
         if token_type == TokenType.erc20:
-            with open("indexer/abi/ERC20.json") as file:
-                return json.load(file)
+            return "ERC20.json"
         # there is the same ABI for erc721 and erc721enumerable since both have the same Transfer event signature
         if token_type in (TokenType.erc721, TokenType.erc721enumerable):
-            with open("indexer/abi/ERC721.json") as file:
-                return json.load(file)
+            return "ERC721.json"
         if token_type == TokenType.erc1155:
-            with open("indexer/abi/ERC1155.json") as file:
-                return json.load(file)
+            return "ERC1155.json"
         raise ValueError(f"Unknown token type or token's ABI not provided in `abi` folder: {token_type}")
 
-    @staticmethod
-    def _get_event_names(token_type: str) -> List[str]:
-        if token_type == TokenType.erc20:
-            return ["Transfer"]
-        if token_type in [TokenType.erc721, TokenType.erc721enumerable]:
-            return ["Transfer"]
-        if token_type == TokenType.erc1155:
-            return ["TransferSingle", "TransferBatch"]
-        raise ValueError(f"Unknown token type or type not implemented {token_type}")
+    @classmethod
+    def _get_abi(cls, token_type: str) -> List[Dict]:
+        return contract_registry.get_abi(cls._get_abi_filename(token_type)).abi
 
     @staticmethod
     def _get_transfer_transaction_type(token_type: str) -> Type[TransferTransaction]:
@@ -86,56 +83,201 @@ class EventTransferFetcher(AbstractTransferFetcher):
 
     def get_transfers(self, from_block: int, to_block: int) -> List[TransferTransaction]:
         match self.network_type:
-            case NetworkType.filterable:
-                return self._get_events_with_standard_filter(from_block, to_block)
-            case NetworkType.no_filters:
+            # stateless eth_getLogs does not install filters on node and skips slow web3 events processing
+            case NetworkType.filterable | NetworkType.no_filters:
                 return self._get_events_with_raw_filter(from_block, to_block)
             case _:
                 raise NotImplementedError(f"Network filtering type {self.network_type} not implemented yet")
 
-    def _get_events_with_standard_filter(self, from_block: int, to_block: int) -> List[TransferTransaction]:
-        result = []
-        for event in self.events:
-            entries = event.create_filter(fromBlock=from_block, toBlock=to_block).get_all_entries()
-            for entry in entries:
-                token_actions = self.token_action_type.from_event_entry(entry)
-                result.extend(token_actions)
-        return result
-
     def _get_events_with_raw_filter(self, from_block: int, to_block: int) -> List[TransferTransaction]:
         events = self.contract.w3.eth.get_logs(
-            {'fromBlock': from_block, 'toBlock': to_block, 'address': self.contract.address})
-        result = []
-        for event in events:
-            result.extend(self.token_action_type.from_raw_log(event))
-        return result
+            {'fromBlock': from_block, 'toBlock': to_block, 'address': self.contract.address,
+             'topics': self.token_action_type.get_topics_filter(self.sender, self.recipient)})
+        return self.token_action_type.from_raw_logs(events)
 
     def __str__(self):
         return f"Events of tokens {self.token.address} ({self.token.type}) " \
                f"on network {self.token.network.name} ({self.token.network.chain_id})"
 
 
+class CombinedEventTransferFetcher(AbstractTransferFetcher):
+    # fetches events of all watched tokens with one eth_getLogs request and routes logs to decoders by address
+    fetchers: Dict[str, EventTransferFetcher]
+    sender: Optional[str]
+    recipient: Optional[str]
+
+    def __init__(self, w3: Web3, tokens: Sequence[Token], sender: Optional[str] = None,
+                 recipient: Optional[str] = None):
+        if not tokens:
+            raise ValueError("Combined event fetcher needs at least one token")
+        super().__init__(w3, tokens[0])
+        self.sender = sender
+        self.recipient = recipient
+        self.fetchers = {}
+        for token in tokens:
+            fetcher = EventTransferFetcher(w3, token, sender, recipient)
+            self.fetchers[fetcher.contract.address.lower()] = fetcher
+
+    def get_transfers(self, from_block: int, to_block: int) -> List[TransferTransaction]:
+        result: List[TransferTransaction] = []
+        for transfers in self.get_transfers_of_tokens(from_block, to_block).values():
+            result.extend(transfers)
+        return result
+
+    def get_transfers_of_tokens(self, from_block: int, to_block: int) -> Dict[Token, List[TransferTransaction]]:
+        events: List[LogReceipt] = []
+        for log_filter in self.get_log_filters():
+            log_filter["fromBlock"] = from_block
+            log_filter["toBlock"] = to_block
+            events.extend(self.w3.eth.get_logs(log_filter))
+        return self.decode_logs(events)
+
+    def get_log_filters(self) -> List[FilterParams]:
+        # address and topics of every eth_getLogs request or logs subscription, block range is up to a caller
+        return [{"address": [fetcher.contract.address for fetcher in fetchers],
+                 "topics": self._get_topics_filter(fetchers)}
+                for fetchers in self._group_fetchers_by_topics_layout()]
+
+    def decode_logs(self, events: Sequence[LogReceipt]) -> Dict[Token, List[TransferTransaction]]:
+        result: Dict[Token, List[TransferTransaction]] = {fetcher.token: [] for fetcher in self.fetchers.values()}
+        events_of_fetchers: Dict[str, List[LogReceipt]] = {}
+        for event in events:
+            events_of_fetchers.setdefault(event["address"].lower(), []).append(event)
+        for address, fetcher_events in events_of_fetchers.items():
+            if not (fetcher := self.fetchers.get(address)):
+                continue
+            result[fetcher.token].extend(fetcher.token_action_type.from_raw_logs(fetcher_events))
+        return result
+
+    def _group_fetchers_by_topics_layout(self) -> List[List[EventTransferFetcher]]:
+        # participants are indexed at different topics by different events, so they cannot share one filter
+        if not self.sender and not self.recipient:
+            return [list(self.fetchers.values())]
+        groups: Dict[int, List[EventTransferFetcher]] = {}
+        for fetcher in self.fetchers.values():
+            groups.setdefault(fetcher.token_action_type.sender_topic_index, []).append(fetcher)
+        return list(groups.values())
+
+    def _get_topics_filter(self, fetchers: List[EventTransferFetcher]) -> List[Any]:
+        topics: Set[HexBytes] = set()
+        for fetcher in fetchers:
+            topics.update(fetcher.token_action_type.event_topics)
+        topics_filter = fetchers[0].token_action_type.get_topics_filter(self.sender, self.recipient)
+        topics_filter[0] = sorted(map(Web3.to_hex, topics))
+        return topics_filter
+
+    def __str__(self):
+        return f"Events of tokens {', '.join(self.fetchers)} on network {self.token.network.name} " \
+               f"({self.token.network.chain_id})"
+
+
 class ReceiptTransferFetcher(AbstractTransferFetcher):
+    batch_caller: JsonRpcBatchCaller
+    batch_requests_supported: bool
+
+    def __init__(self, w3: Web3, token: Token):
+        super().__init__(w3, token)
+        network = token.network
+        self.batch_caller = JsonRpcBatchCaller(w3, network.rpc_batch_size,
+                                               get_rate_limiter(network.rpc_url, network.rpc_requests_per_second,
+                                                                network.rpc_burst))
+        self.batch_requests_supported = token.network.rpc_batch_size > 1
+
     def get_transfers(self, from_block: int, to_block: int) -> List[TransferTransaction]:
+        if self.batch_requests_supported:
+            try:
+                return self._get_transfers_with_batches(from_block, to_block)
+            except BatchRequestsNotSupported as e:
+                logger.warning(f"Batch requests are not supported, fall back to sequential requests: {e}")
+                self.batch_requests_supported = False
+        return self._get_transfers_sequentially(from_block, to_block)
+
+    def _get_transfers_with_batches(self, from_block: int, to_block: int) -> List[TransferTransaction]:
+        blocks = self.batch_caller.call("eth_getBlockByNumber",
+                                        [[hex(block_number), True] for block_number in range(from_block, to_block + 1)])
+        # only transactions with value transfer native currency, so receipts of others are not requested
+        transactions_of_blocks: Dict[int, List[Dict]] = {}
+        for block in blocks:
+            if transactions := [transaction for transaction in block["transactions"] if int(transaction["value"], 16)]:
+                transactions_of_blocks[int(block["number"], 16)] = transactions
+        transactions = [transaction for transactions in transactions_of_blocks.values() for transaction in transactions]
+        logger.info(f"Taking receipts of {len(transactions)} transactions of blocks [{from_block}; {to_block}]")
+        receipts: List[Dict] = []
+        if self._is_block_receipts_supported():
+            for block_receipts in self.batch_caller.call("eth_getBlockReceipts",
+                                                         [[hex(block_number)] for block_number in transactions_of_blocks]):
+                receipts.extend(block_receipts)
+        else:
+            receipts = self.batch_caller.call("eth_getTransactionReceipt",
+                                              [[transaction["hash"]] for transaction in transactions])
+        receipts_by_hashes = {HexBytes(receipt["transactionHash"]): receipt for receipt in receipts if receipt}
+        token_actions: List[TransferTransaction] = []
+        for transaction in transactions:
+            if receipt := receipts_by_hashes.get(HexBytes(transaction["hash"])):
+                if transfer := self._to_native_transfer(HexStr(transaction["hash"]), int(transaction["value"], 16),
+                                                        receipt):
+                    token_actions.append(transfer)
+        return token_actions
+
+    def _get_transfers_sequentially(self, from_block: int, to_block: int) -> List[TransferTransaction]:
         token_actions: List[TransferTransaction] = []
+        block_receipts_supported = self._is_block_receipts_supported()
         for block_number in range(from_block, to_block + 1):
             block = self.w3.eth.get_block(block_number, full_transactions=True)
+            transactions = [transaction for transaction in cast(Sequence[TxData], block["transactions"])
+                            if transaction["value"] != 0]
+            if not transactions:
+                logger.info(f"Block {block_number} has no transactions transferring native")
+                continue
             logger.info(f"Taking receipts of block {block_number}")
-            transactions = cast(Sequence[TxData], block["transactions"])
+            receipts_by_hashes: Dict[HexBytes, Any] = {}
+            if block_receipts_supported:
+                for receipt in self.w3.manager.request_blocking(RPCEndpoint("eth_getBlockReceipts"),
+                                                                [hex(block_number)]):
+                    receipts_by_hashes[HexBytes(receipt["transactionHash"])] = receipt
             for transaction in transactions:
                 try:
-                    receipt: TxReceipt = self.w3.eth.get_transaction_receipt(transaction_hash=transaction["hash"])
-                    if receipt["status"] != 0 and transaction["value"] != 0:
-                        token_actions.append(
-                            NativeCurrencyTransferTransaction(sender=receipt["from"], recipient=receipt["to"],
-                                                              amount=transaction["value"],
-                                                              tx_hash=HexStr(transaction["hash"].hex())))
+                    receipt = receipts_by_hashes.get(transaction["hash"]) or \
+                              self.w3.eth.get_transaction_receipt(transaction_hash=transaction["hash"])
+                    if transfer := self._to_native_transfer(HexStr(transaction["hash"].hex()), transaction["value"],
+                                                            receipt):
+                        token_actions.append(transfer)
                         logger.info(f"Transaction {transaction['hash'].hex()} is added to list")
                     else:
-                        logger.info(f"Transaction {transaction['hash'].hex()} is either failed or transfers no native")
+                        logger.info(f"Transaction {transaction['hash'].hex()} is failed")
                 except Exception as e:
                     logger.info(f"Skip transaction {transaction['hash'].hex()} of block {block_number}: {e}")
         return token_actions
 
+    @staticmethod
+    def _to_native_transfer(tx_hash: HexStr, value: int, receipt: Any) -> Optional[TransferTransaction]:
+        # receipts are either formatted by web3 or raw ones, i.e. with hex status and lowercase addresses
+        status = receipt["status"]
+        if (int(status, 16) if isinstance(status, str) else status) == 0:
+            return None
+        recipient = receipt["to"]
+        return NativeCurrencyTransferTransaction(sender=to_checksum_address(receipt["from"]),
+                                                 # receipt of contract creation has no recipient
+                                                 recipient=to_checksum_address(recipient) if recipient else recipient,
+                                                 amount=value,
+                                                 tx_hash=tx_hash)
+
+    def _is_block_receipts_supported(self) -> bool:
+        network = self.token.network
+        if network.block_receipts_supported is None:
+            network.refresh_from_db(fields=["block_receipts_supported"])
+        if network.block_receipts_supported is None:
+            network.block_receipts_supported = self._probe_block_receipts()
+            network.save(update_fields=["block_receipts_supported"])
+            logger.info(f"Network {network} supports eth_getBlockReceipts: {network.block_receipts_supported}")
+        return network.block_receipts_supported
+
+    def _probe_block_receipts(self) -> bool:
+        try:
+            return isinstance(self.w3.manager.request_blocking(RPCEndpoint("eth_getBlockReceipts"), ["latest"]), list)
+        except (ValueError, MethodUnavailable) as e:
+            logger.info(f"Probe of eth_getBlockReceipts failed: {e}")
+            return False
+
     def __str__(self):
         return f"Receipts of native currency on network {self.token.network.name} ({self.token.network.chain_id})"
@@ -1,13 +1,12 @@
 import abc
 import dataclasses
 from logging import getLogger
-from typing import Dict, List, Tuple, Sequence
+from typing import Any, ClassVar, Dict, List, Optional, Tuple, Sequence
 
 from web3 import Web3
 from web3.types import ChecksumAddress, HexStr, HexBytes, LogReceipt
 
 from indexer_api.models import TokenTransfer
-from web3.datastructures import AttributeDict
 from .utils import AbiDecoder
 
 logger = getLogger(__name__)
@@ -18,15 +17,31 @@ class TransferTransaction(abc.ABC):
     sender: ChecksumAddress
     recipient: ChecksumAddress
     tx_hash: HexStr
+    # position of the log in a block; together with tx_hash and token_id identifies a transfer
+    log_index: Optional[int] = dataclasses.field(default=None, kw_only=True)
 
-    @staticmethod
-    @abc.abstractmethod
-    def from_event_entry(event_entry: AttributeDict) -> List["TransferTransaction"]:
-        raise NotImplementedError()
+    # topic0 hashes of events decoded by from_raw_logs
+    event_topics: ClassVar[Tuple[HexBytes, ...]] = ()
+    # index of topic with indexed sender of event, the next topic is recipient
+    sender_topic_index: ClassVar[int] = 1
+
+    @classmethod
+    def get_topics_filter(cls, sender: Optional[str] = None, recipient: Optional[str] = None) -> List[Any]:
+        topics: List[Any] = [[Web3.to_hex(topic) for topic in cls.event_topics]]
+        if sender or recipient:
+            topics.extend([None] * (cls.sender_topic_index - 1))
+            topics.append(AbiDecoder.address_to_bytes32(sender) if sender else None)
+        if recipient:
+            topics.append(AbiDecoder.address_to_bytes32(recipient))
+        return topics
 
     @classmethod
-    @abc.abstractmethod
     def from_raw_log(cls, event: LogReceipt) -> List["TransferTransaction"]:
+        return cls.from_raw_logs([event])
+
+    @classmethod
+    @abc.abstractmethod
+    def from_raw_logs(cls, events: Sequence[LogReceipt]) -> List["TransferTransaction"]:
         raise NotImplementedError()
 
     @abc.abstractmethod
@@ -45,22 +60,20 @@ class NativeCurrencyTransferTransaction(TransferTransaction):
         token_transfer.recipient = self.recipient
         token_transfer.token_id = None
         token_transfer.tx_hash = self.tx_hash
+        token_transfer.log_index = self.log_index
         return token_transfer
 
     amount: int
 
-    @staticmethod
-    def from_event_entry(event_entry: AttributeDict) -> List["TransferTransaction"]:
-        raise NotImplementedError("It is impossible to handle native currency transfer, use receipt-based way")
-
     @classmethod
-    def from_raw_log(cls, event: LogReceipt) -> List["TransferTransaction"]:
+    def from_raw_logs(cls, events: Sequence[LogReceipt]) -> List["TransferTransaction"]:
         raise NotImplementedError("It is impossible to handle native currency transfer, use receipt-based way")
 
 
 @dataclasses.dataclass
 class FungibleTransferTransaction(TransferTransaction):
     event_hash = Web3.keccak(text="Transfer(address,address,uint256)")
+    event_topics: ClassVar[Tuple[HexBytes, ...]] = (event_hash,)
     amount: int
 
     def to_token_transfer_model(self) -> TokenTransfer:
@@ -70,40 +83,35 @@ class FungibleTransferTransaction(TransferTransaction):
         model_instance.recipient = self.recipient
         model_instance.token_id = None
         model_instance.tx_hash = self.tx_hash
+        model_instance.log_index = self.log_index
         return model_instance
 
     @classmethod
-    def from_raw_log(cls, event: LogReceipt) -> List["TransferTransaction"]:
-        if len(event["topics"]) not in (3, 4):
-            return []
-        if event["topics"][0] != cls.event_hash:
-            return []
-        data = HexBytes(event["data"])
-        sender = AbiDecoder.bytes32_to_address(event["topics"][1])
-        recipient = AbiDecoder.bytes32_to_address(event["topics"][2])
-        tx_hash = HexStr(event["transactionHash"].hex())
-        if len(event["topics"]) == 4:
-            amount = AbiDecoder.bytes32_to_uint256(event["topics"][3])
-        else:
-            if len(data) < 32:
-                return []
-            amount = AbiDecoder.bytes32_to_uint256(data)
-        return [
-            FungibleTransferTransaction(
-                sender=sender,
-                recipient=recipient,
-                tx_hash=tx_hash,
-                amount=amount
-            )
-        ]
-
-    @staticmethod
-    def from_event_entry(event_entry: AttributeDict) -> List["TransferTransaction"]:
-        return [FungibleTransferTransaction(
-            sender=event_entry["args"]["from"],
-            recipient=event_entry["args"]["to"],
-            tx_hash=event_entry["transactionHash"].hex(),
-            amount=event_entry["args"]["value"])]
+    def from_raw_logs(cls, events: Sequence[LogReceipt]) -> List["TransferTransaction"]:
+        # compares topics with precomputed bytes and reads data through memoryview
+        result: List[TransferTransaction] = []
+        event_hash = bytes(cls.event_hash)
+        for event in events:
+            topics = event["topics"]
+            if not topics or topics[0] != event_hash:
+                continue
+            match len(topics):
+                case 4:
+                    amount = AbiDecoder.bytes32_to_int(topics[3])
+                case 3:
+                    data = AbiDecoder.to_memoryview(event["data"])
+                    if len(data) < 32:
+                        continue
+                    amount = AbiDecoder.bytes32_to_int(data)
+                case _:
+                    continue
+            result.append(FungibleTransferTransaction(
+                sender=AbiDecoder.bytes32_to_address(topics[1]),
+                recipient=AbiDecoder.bytes32_to_address(topics[2]),
+                tx_hash=AbiDecoder.bytes_to_hex(event["transactionHash"]),
+                amount=amount,
+                log_index=event.get("logIndex")))
+        return result
 
     def __str__(self):
         return f"Tokens {self.amount} sent {self.sender} -> {self.recipient}"
@@ -112,6 +120,7 @@ class FungibleTransferTransaction(TransferTransaction):
 @dataclasses.dataclass
 class NonFungibleTransferTransaction(TransferTransaction):
     event_hash = Web3.keccak(text="Transfer(address,address,uint256)")
+    event_topics: ClassVar[Tuple[HexBytes, ...]] = (event_hash,)
     token_id: int
 
     def to_token_transfer_model(self) -> TokenTransfer:
@@ -121,34 +130,34 @@ class NonFungibleTransferTransaction(TransferTransaction):
         model_instance.recipient = self.recipient
         model_instance.token_id = self.token_id
         model_instance.tx_hash = self.tx_hash
+        model_instance.log_index = self.log_index
         return model_instance
 
     @classmethod
-    def from_raw_log(cls, event: LogReceipt) -> List["TransferTransaction"]:
-        if len(event["topics"]) not in (3, 4):
-            return []
-        if event["topics"][0] != cls.event_hash:
-            return []
-        if len(event["topics"]) == 4:
-            token_id = AbiDecoder.bytes32_to_uint256(event["topics"][3])
-        else:
-            data = HexBytes(event["data"])
-            if len(data) < 32:
-                return []
-            token_id = AbiDecoder.bytes32_to_uint256(data)
-        return [NonFungibleTransferTransaction(
-            sender=AbiDecoder.bytes32_to_address(event["topics"][1]),
-            recipient=AbiDecoder.bytes32_to_address(event["topics"][2]),
-            tx_hash=HexStr(event["transactionHash"].hex()),
-            token_id=token_id)]
-
-    @staticmethod
-    def from_event_entry(event_entry: AttributeDict) -> List["TransferTransaction"]:
-        return [NonFungibleTransferTransaction(
-            sender=event_entry["args"]["from"],
-            recipient=event_entry["args"]["to"],
-            tx_hash=event_entry["transactionHash"].hex(),
-            token_id=event_entry["args"]["tokenId"])]
+    def from_raw_logs(cls, events: Sequence[LogReceipt]) -> List["TransferTransaction"]:
+        result: List[TransferTransaction] = []
+        event_hash = bytes(cls.event_hash)
+        for event in events:
+            topics = event["topics"]
+            if not topics or topics[0] != event_hash:
+                continue
+            match len(topics):
+                case 4:
+                    token_id = AbiDecoder.bytes32_to_int(topics[3])
+                case 3:
+                    data = AbiDecoder.to_memoryview(event["data"])
+                    if len(data) < 32:
+                        continue
+                    token_id = AbiDecoder.bytes32_to_int(data)
+                case _:
+                    continue
+            result.append(NonFungibleTransferTransaction(
+                sender=AbiDecoder.bytes32_to_address(topics[1]),
+                recipient=AbiDecoder.bytes32_to_address(topics[2]),
+                tx_hash=AbiDecoder.bytes_to_hex(event["transactionHash"]),
+                token_id=token_id,
+                log_index=event.get("logIndex")))
+        return result
 
     def __str__(self):
         return f"Token {self.token_id} sent {self.sender} -> {self.recipient}"
@@ -160,9 +169,9 @@ class ERC1155TransferTransaction(FungibleTransferTransaction, NonFungibleTransfe
 
     event_hash_single = Web3.keccak(text="TransferSingle(address,address,address,uint256,uint256)")
     event_hash_batch = Web3.keccak(text="TransferBatch(address,address,address,uint256[],uint256[])")
-
-    event_name_single = "TransferSingle"
-    event_name_batch = "TransferBatch"
+    event_topics: ClassVar[Tuple[HexBytes, ...]] = (event_hash_single, event_hash_batch)
+    # operator is the first indexed argument of ERC1155 transfer events
+    sender_topic_index: ClassVar[int] = 2
 
     def to_token_transfer_model(self) -> TokenTransfer:
         model_instance = TokenTransfer()
@@ -172,107 +181,55 @@ class ERC1155TransferTransaction(FungibleTransferTransaction, NonFungibleTransfe
         model_instance.recipient = self.recipient
         model_instance.token_id = self.token_id
         model_instance.tx_hash = self.tx_hash
+        model_instance.log_index = self.log_index
         return model_instance
 
     @classmethod
-    def from_raw_log(cls, event: LogReceipt) -> List["TransferTransaction"]:
-        if len(event["topics"]) < 4:
-            return []
-        data = HexBytes(event["data"])
-        operator = AbiDecoder.bytes32_to_address(event["topics"][1])
-        sender = AbiDecoder.bytes32_to_address(event["topics"][2])
-        recipient = AbiDecoder.bytes32_to_address(event["topics"][3])
-        if event["topics"][0] == cls.event_hash_single:
-            return cls._parse_single_transfer(event, data, operator, sender, recipient)
-        elif event["topics"][0] == cls.event_hash_batch:
-            return cls._parse_batch_transfer(event, data, operator, sender, recipient)
-        else:
-            return []
-
-    def __str__(self):
-        return f"Tokens {self.amount} of ID {self.token_id} sent {self.sender} -> {self.recipient}"
-
-    @classmethod
-    def from_event_entry(cls, event_entry: AttributeDict) -> List["TransferTransaction"]:
+    def from_raw_logs(cls, events: Sequence[LogReceipt]) -> List["TransferTransaction"]:
         result: List[TransferTransaction] = []
-        if event_entry["event"] == cls.event_name_batch:
-            ids: List[int] = list(map(int, event_entry["args"]["ids"]))
-            values: List[int] = list(map(int, event_entry["args"]["values"]))
-            if len(ids) != len(values):
-                return []
-            for (i, token_id) in enumerate(ids):
-                value = values[i]
-                result.append(
-                    ERC1155TransferTransaction(
-                        operator=event_entry["args"]["operator"],
-                        sender=event_entry["args"]["from"],
-                        recipient=event_entry["args"]["to"],
-                        tx_hash=event_entry["transactionHash"].hex(),
-                        token_id=token_id,
-                        amount=value))
-        elif event_entry["event"] == cls.event_name_single:
-            result.append(ERC1155TransferTransaction(
-                operator=event_entry["args"]["operator"],
-                sender=event_entry["args"]["from"],
-                recipient=event_entry["args"]["to"],
-                tx_hash=event_entry["transactionHash"].hex(),
-                token_id=event_entry["args"]["id"],
-                amount=event_entry["args"]["value"]))
+        event_hash_single = bytes(cls.event_hash_single)
+        event_hash_batch = bytes(cls.event_hash_batch)
+        for event in events:
+            topics = event["topics"]
+            if len(topics) < 4:
+                continue
+            token_ids: Sequence[int]
+            amounts: Sequence[int]
+            if topics[0] == event_hash_single:
+                if len(topics) == 6:
+                    token_ids, amounts = (AbiDecoder.bytes32_to_int(topics[4]),), (AbiDecoder.bytes32_to_int(topics[5]),)
+                else:
+                    data = AbiDecoder.to_memoryview(event["data"])
+                    if len(data) < 64:
+                        continue
+                    token_ids, amounts = (AbiDecoder.bytes32_to_int(data[:32]),), (AbiDecoder.bytes32_to_int(data[32:]),)
+            elif topics[0] == event_hash_batch:
+                data = AbiDecoder.to_memoryview(event["data"])
+                if len(data) < 64:
+                    continue
+                # arrays are read from slices of the same buffer
+                token_ids = AbiDecoder.bytes_to_int_array(data, AbiDecoder.bytes32_to_int(data[:32]))
+                amounts = AbiDecoder.bytes_to_int_array(data, AbiDecoder.bytes32_to_int(data[32:64]))
+                if len(token_ids) != len(amounts):
+                    logger.warning(f"Bad event on transaction {AbiDecoder.bytes_to_hex(event['transactionHash'])}")
+                    continue
+            else:
+                continue
+            operator = AbiDecoder.bytes32_to_address(topics[1])
+            sender = AbiDecoder.bytes32_to_address(topics[2])
+            recipient = AbiDecoder.bytes32_to_address(topics[3])
+            tx_hash = AbiDecoder.bytes_to_hex(event["transactionHash"])
+            log_index = event.get("logIndex")
+            for token_id, amount in zip(token_ids, amounts):
+                result.append(ERC1155TransferTransaction(
+                    operator=operator,
+                    sender=sender,
+                    recipient=recipient,
+                    tx_hash=tx_hash,
+                    token_id=token_id,
+                    amount=amount,
+                    log_index=log_index))
         return result
 
-    @classmethod
-    def _parse_token_info_from_data(cls, data: HexBytes) -> Tuple[int, int]:
-        return AbiDecoder.bytes32_to_uint256(data[:32]), AbiDecoder.bytes32_to_uint256(data[32:])
-
-    @classmethod
-    def _parse_token_info_from_topics(cls, topics: Sequence[HexBytes]) -> Tuple[int, int]:
-        return AbiDecoder.bytes32_to_uint256(topics[4]), AbiDecoder.bytes32_to_uint256(topics[5])
-
-    @classmethod
-    def _parse_single_transfer(cls,
-                               event: LogReceipt,
-                               data: HexBytes,
-                               operator: ChecksumAddress,
-                               sender: ChecksumAddress,
-                               recipient: ChecksumAddress) -> List["TransferTransaction"]:
-        if len(event["topics"]) == 6:
-            token_id, amount = cls._parse_token_info_from_topics(event["topics"])
-        else:
-            if len(data) < 64:
-                return []
-            token_id, amount = cls._parse_token_info_from_data(data)
-        return [ERC1155TransferTransaction(
-            operator=operator,
-            sender=sender,
-            recipient=recipient,
-            tx_hash=HexStr(event["transactionHash"].hex()),
-            token_id=token_id,
-            amount=amount)]
-
-    @classmethod
-    def _parse_batch_transfer(cls,
-                              event: LogReceipt,
-                              data: HexBytes,
-                              operator: ChecksumAddress,
-                              sender: ChecksumAddress,
-                              recipient: ChecksumAddress) -> List[TransferTransaction]:
-        result: List[TransferTransaction] = []
-        if len(data) < 64:
-            return result
-        ids_location = AbiDecoder.bytes32_to_uint256(data[:32])
-        amounts_location = AbiDecoder.bytes32_to_uint256(data[32:64])
-        ids = AbiDecoder.bytes_to_int_array(data, ids_location)
-        amounts = AbiDecoder.bytes_to_int_array(data, amounts_location)
-        if len(ids) != len(amounts):
-            logger.warning(f"Bad event on transaction {event['transactionHash'].hex()}")
-            return result
-        for (i, token_id) in enumerate(ids):
-            amount = amounts[i]
-            result.append(ERC1155TransferTransaction(
-                operator=operator,
-                sender=sender,
-                recipient=recipient,
-                token_id=token_id,
-                amount=amount,
-                tx_hash=HexStr(event["transactionHash"].hex())))
-        return result
+    def __str__(self):
+        return f"Tokens {self.amount} of ID {self.token_id} sent {self.sender} -> {self.recipient}"
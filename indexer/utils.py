@@ -1,23 +1,39 @@
 import logging
-from typing import List, Literal
-from web3.types import HexBytes, ChecksumAddress
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Union
+from web3.middleware import geth_poa_middleware
+from web3.types import HexBytes, HexStr, ChecksumAddress, Middleware, RPCEndpoint, RPCResponse
 from web3 import Web3
 
 from logging import getLogger
 
 logger = getLogger(__name__)
 
+# the same hot addresses (routers, exchanges) take part in most transfers
+CHECKSUM_ADDRESS_CACHE_SIZE = 100_000
+
+
+@lru_cache(maxsize=CHECKSUM_ADDRESS_CACHE_SIZE)
+def to_checksum_address(address: Union[str, bytes]) -> ChecksumAddress:
+    # bounded LRU cache, so keccak of an address is computed once while it stays hot; hits and misses are counted
+    # by cache_info(). 32 bytes ABI slots are accepted as is to skip slicing of topics
+    if len(address) == AbiDecoder.slot_size:
+        address = address[12:]
+    return Web3.to_checksum_address(address)
+
 
 class AbiDecoder:
     slot_size = 32
     byteorder: Literal["big", "little"] = "big"
 
     @classmethod
-    def bytes32_to_int(cls, value: bytes) -> int:
+    def bytes32_to_int(cls, value: Union[bytes, memoryview]) -> int:
         return int.from_bytes(value, byteorder=cls.byteorder)
 
     @classmethod
-    def bytes_to_int_array(cls, data: bytes, array_location: int) -> List[int]:
+    def bytes_to_int_array(cls, data: Union[bytes, memoryview], array_location: int) -> List[int]:
         values: List[int] = []
         length = cls.bytes32_to_int(data[array_location: array_location + cls.slot_size])
         if not length:
@@ -28,9 +44,93 @@ class AbiDecoder:
         return values
 
     @classmethod
-    def bytes32_to_address(cls, value: HexBytes) -> ChecksumAddress:
-        return Web3.to_checksum_address(value.hex()[26:])
+    def bytes32_to_address(cls, value: bytes) -> ChecksumAddress:
+        return to_checksum_address(value)
+
+    @classmethod
+    def bytes_to_hex(cls, value: bytes) -> HexStr:
+        # bytes.hex skips the HexBytes override
+        return HexStr("0x" + bytes.hex(value))
+
+    @classmethod
+    def to_memoryview(cls, value: Union[bytes, str]) -> memoryview:
+        if isinstance(value, str):
+            return memoryview(bytes.fromhex(value[2:] if value.startswith("0x") else value))
+        return memoryview(value)
 
     @classmethod
     def bytes32_to_uint256(cls, value: HexBytes) -> int:
         return int.from_bytes(value, byteorder="big")
+
+    @classmethod
+    def address_to_bytes32(cls, address: str) -> HexStr:
+        return HexStr("0x" + address[2:].lower().rjust(cls.slot_size * 2, "0"))
+
+
+class RateLimiter:
+    # token bucket: up to `burst` requests are sent at once, then they are spaced to `requests_per_second`.
+    # A request above the bucket reserves its slot, so concurrent callers are served in order
+    requests_per_second: float
+    burst: int
+    tokens: float
+    updated_at: float
+    lock: threading.Lock
+
+    def __init__(self, requests_per_second: float, burst: int = 1):
+        self.requests_per_second = requests_per_second
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated_at = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, requests: int = 1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + max(now - self.updated_at, 0) * self.requests_per_second)
+            self.updated_at = now
+            self.tokens -= requests
+            wait_seconds = -self.tokens / self.requests_per_second
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+
+_rate_limiters: Dict[Tuple[str, float, int], RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(rpc_url: str, requests_per_second: Optional[float], burst: int = 1) -> Optional[RateLimiter]:
+    # the limit is a quota of RPC provider, so every worker and fetcher of the process using the RPC shares it
+    if not requests_per_second:
+        return None
+    with _rate_limiters_lock:
+        return _rate_limiters.setdefault((rpc_url, requests_per_second, burst),
+                                         RateLimiter(requests_per_second, burst))
+
+
+def build_rate_limit_middleware(rate_limiter: RateLimiter) -> Middleware:
+    def rate_limit_middleware(make_request: Callable[[RPCEndpoint, Any], RPCResponse],
+                              w3: Web3) -> Callable[[RPCEndpoint, Any], RPCResponse]:
+        def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+            rate_limiter.acquire()
+            return make_request(method, params)
+        return middleware
+    return rate_limit_middleware
+
+
+_web3s: Dict[Tuple[str, bool, Optional[float], int], Web3] = {}
+_web3s_lock = threading.Lock()
+
+
+def get_web3(rpc_url: str, need_poa: bool, requests_per_second: Optional[float], burst: int = 1) -> Web3:
+    # workers of the same network in the process share Web3, so they share contracts of contract registry too.
+    # HTTPProvider keeps a requests session per thread, so workers of different threads may call it concurrently
+    key = (rpc_url, need_poa, requests_per_second, burst)
+    with _web3s_lock:
+        if (w3 := _web3s.get(key)) is None:
+            w3 = Web3(Web3.HTTPProvider(rpc_url))
+            if need_poa:
+                w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+            if rate_limiter := get_rate_limiter(rpc_url, requests_per_second, burst):
+                w3.middleware_onion.add(build_rate_limit_middleware(rate_limiter), "rate_limit")
+            _web3s[key] = w3
+        return w3
@@ -1,8 +1,9 @@
 import os
-from typing import Type, Optional, List, cast, Sequence, Union
+from typing import Type, Optional, List, cast, Sequence, Union, Dict
 
 from django.contrib import admin, messages
 from django.contrib.admin import register
+from django.core.exceptions import ValidationError
 from django.db.models import QuerySet
 from django.forms import ModelForm
 from django.utils.html import format_html
@@ -35,8 +36,15 @@ client_keeper = ClientKeeper()
 
 
 def get_envs_for_indexer(indexer: str) -> List[str]:
+    return [f"INDEXER_NAME={indexer}"] + get_envs()
+
+
+def get_envs_for_host(indexers: List[str]) -> List[str]:
+    return [f"INDEXER_NAMES={','.join(indexers)}"] + get_envs()
+
+
+def get_envs() -> List[str]:
     return [
-        f"INDEXER_NAME={indexer}",
         f"SECRET_KEY={os.environ['SECRET_KEY']}",
         f"HOSTNAME={os.environ['HOSTNAME']}",
         f"POSTGRES_DB={os.environ['POSTGRES_DB']}",
@@ -52,16 +60,46 @@ class NetworkAdmin(admin.ModelAdmin):
     list_display = ("name", "chain_id", "rpc_url", "max_step", "type")
 
 
+def get_container_name(indexer: Indexer) -> str:
+    return indexer.host_container or indexer.name
+
+
+def get_containers(queryset: QuerySet[Indexer]) -> Dict[str, List[Indexer]]:
+    # selecting any indexer of a host container selects the whole container
+    containers: Dict[str, List[Indexer]] = {}
+    for indexer in queryset.order_by("name"):
+        if (container_name := get_container_name(indexer)) in containers:
+            continue
+        if indexer.host_container:
+            containers[container_name] = list(Indexer.objects.filter(host_container=indexer.host_container)
+                                              .order_by("name"))
+        else:
+            containers[container_name] = [indexer]
+    return containers
+
+
+def run_container(container_name: str, indexers: List[Indexer]):
+    if indexers[0].host_container:
+        environment = get_envs_for_host([indexer.name for indexer in indexers])
+    else:
+        environment = get_envs_for_indexer(indexers[0].name)
+    client_keeper.get_instance().containers.run("django_evm_indexer",
+                                                detach=True,
+                                                name=container_name,
+                                                command="python indexer/run.py",
+                                                network="django_indexer_default",
+                                                environment=environment)
+
+
 @admin.action(description="Create containers")
 def create_containers(model_admin: admin.ModelAdmin, request, queryset: QuerySet[Indexer]):
     for indexer in queryset:
+        if indexer.host_container:
+            model_admin.message_user(request, f"Indexer {indexer.name} already runs in container "
+                                              f"{indexer.host_container}", messages.ERROR)
+            continue
         try:
-            client_keeper.get_instance().containers.run("django_evm_indexer",
-                                                        detach=True,
-                                                        name=indexer.name,
-                                                        command="python indexer/run.py",
-                                                        network="django_indexer_default",
-                                                        environment=get_envs_for_indexer(indexer.name))
+            run_container(indexer.name, [indexer])
             model_admin.message_user(request, f"Successfully created container for {indexer.name}", messages.SUCCESS)
             indexer.status = IndexerStatus.on
             indexer.save()
@@ -70,39 +108,57 @@ def create_containers(model_admin: admin.ModelAdmin, request, queryset: QuerySet
                                      messages.ERROR)
 
 
+@admin.action(description="Create one host container")
+def create_host_container(model_admin: admin.ModelAdmin, request, queryset: QuerySet[Indexer]):
+    # all selected indexers run in one process, so they share its startup, memory and connections
+    indexers = list(queryset.order_by("name"))
+    if not indexers:
+        return
+    if hosted_indexers := [indexer.name for indexer in indexers if indexer.host_container]:
+        model_admin.message_user(request, f"Indexers {', '.join(hosted_indexers)} already run in host containers",
+                                 messages.ERROR)
+        return
+    container_name = f"{indexers[0].name}-host"
+    for indexer in indexers:
+        indexer.host_container = container_name
+    try:
+        run_container(container_name, indexers)
+        model_admin.message_user(request, f"Successfully created container {container_name} for "
+                                          f"{len(indexers)} indexers", messages.SUCCESS)
+        queryset.update(status=IndexerStatus.on, host_container=container_name)
+    except Exception as e:
+        model_admin.message_user(request, f"During creation of container {container_name} error occurred {e}",
+                                 messages.ERROR)
+
+
 @admin.action(description="Restart containers")
 def restart_containers(model_admin: admin.ModelAdmin, request, queryset: QuerySet[Indexer]):
-    for indexer in queryset:
+    for container_name, indexers in get_containers(queryset).items():
         try:
-            container = client_keeper.get_instance().containers.get(indexer.name)
+            container = client_keeper.get_instance().containers.get(container_name)
             container.remove(force=True)
-            client_keeper.get_instance().containers.run("django_evm_indexer",
-                                                        detach=True,
-                                                        name=indexer.name,
-                                                        command="python indexer/run.py",
-                                                        network="django_indexer_default",
-                                                        environment=get_envs_for_indexer(indexer.name))
-            model_admin.message_user(request, f"Successfully restarted container for {indexer.name} indexer",
-                                     messages.SUCCESS)
-            indexer.status = IndexerStatus.on
-            indexer.save()
+            run_container(container_name, indexers)
+            model_admin.message_user(request, f"Successfully restarted container {container_name} for "
+                                              f"{', '.join(indexer.name for indexer in indexers)}", messages.SUCCESS)
+            Indexer.objects.filter(pk__in=[indexer.pk for indexer in indexers]).update(status=IndexerStatus.on)
         except Exception as e:
-            model_admin.message_user(request, f"During restarting of container for {indexer.name}error occurred: {e}",
+            model_admin.message_user(request, f"During restarting of container {container_name} error occurred: {e}",
                                      messages.ERROR)
 
 
 @admin.action(description="Remove containers")
 def remove_containers(model_admin: admin.ModelAdmin, request, queryset: QuerySet[Indexer]):
-    for indexer in queryset:
+    for container_name, indexers in get_containers(queryset).items():
         try:
-            container = client_keeper.get_instance().containers.get(indexer.name)
+            container = client_keeper.get_instance().containers.get(container_name)
             container.remove(force=True)
-            model_admin.message_user(request, f"Successfully removed container for {indexer.name} indexer",
-                                     messages.SUCCESS)
-            indexer.status = IndexerStatus.off
-            indexer.save()
+            model_admin.message_user(request, f"Successfully removed container {container_name} for "
+                                              f"{', '.join(indexer.name for indexer in indexers)}", messages.SUCCESS)
+            # indexers of a removed host may be started again in any containers
+            Indexer.objects.filter(pk__in=[indexer.pk for indexer in indexers]).update(status=IndexerStatus.off,
+                                                                                        host_container="")
         except Exception as e:
-            model_admin.message_user(request, f"During removing container for {indexer.name} error occurred: {e}",
+            model_admin.message_user(request, f"During removing container {container_name} error occurred: {e}",
                                      messages.ERROR)
 
 
@@ -114,12 +170,21 @@ class EditIndexerForm(ModelForm):
         }
         fields = '__all__'
 
+    def clean(self):
+        cleaned_data = super().clean()
+        try:
+            Indexer.validate_ledger_setup(self.instance.pk, cleaned_data.get("type"), cleaned_data.get("strategy"),
+                                          cleaned_data.get("watched_tokens") or [])
+        except ValidationError as e:
+            self.add_error(None, e)
+        return cleaned_data
+
 
 @register(Indexer)
 class IndexerAdmin(admin.ModelAdmin):
-    actions = [create_containers, restart_containers, remove_containers]
+    actions = [create_containers, create_host_container, restart_containers, remove_containers]
 
-    readonly_fields = ('logs', "status")
+    readonly_fields = ('logs', "status", "host_container")
     list_display = ("name", "status", "type", "network", "last_block", "strategy",)
     form = EditIndexerForm
 
@@ -128,7 +193,7 @@ class IndexerAdmin(admin.ModelAdmin):
     @admin.display(description="Logs")
     def logs(self, instance: Indexer) -> str:
         try:
-            container = client_keeper.get_instance().containers.get(instance.name)
+            container = client_keeper.get_instance().containers.get(get_container_name(instance))
             log_entries = str(container.logs(tail=100).decode('utf-8')).replace("\n", "</code><br><code>")
             return format_html("<code>{}</code>", mark_safe(log_entries))
         except Exception as e:
@@ -1,4 +1,4 @@
-from typing import Dict, Union, List
+from typing import Dict, Union, List, Optional
 
 from django.db.models import QuerySet
 
@@ -41,6 +41,12 @@ class Balances:
             result[token_id] = amount
         return result
 
+    @staticmethod
+    def get_block_number(balances: QuerySet) -> Optional[int]:
+        # the oldest block which balances of the token were fetched at
+        block_numbers = [balance["block_number"] for balance in balances if balance["block_number"] is not None]
+        return min(block_numbers) if block_numbers else None
+
     @staticmethod
     def get_balances(holder: str, verbose: bool = False) -> Dict:
         networks = Network.objects.all()
@@ -53,7 +59,8 @@ class Balances:
             tokens = Token.objects.filter(network=network).all()
             for token in tokens:
                 balances = TokenBalance.objects.filter(token_instance=token, holder__iexact=holder).values("token_id",
-                                                                                                           "amount")
+                                                                                                           "amount",
+                                                                                                           "block_number")
                 token_type = token.type
                 value: Union[str, List[str], Dict[str, str]]
                 match token_type:
@@ -70,7 +77,8 @@ class Balances:
 
                 result[network_identifier][token.address] = {
                     "token_type": token_type,
-                    "balance": value
+                    "balance": value,
+                    "block_number": Balances.get_block_number(balances)
                 }
                 if verbose:
                     result[network_identifier][token.address]["token_name"] = token.name
@@ -1,7 +1,7 @@
 import dataclasses
 from typing import Dict
 
-from indexer_api.models import Indexer, IndexerStatus, TokenTransfer, IndexerType, TokenBalance
+from indexer_api.models import Indexer, IndexerStatus, TokenTransfer, IndexerType, TokenBalance, NetworkHead
 
 
 @dataclasses.dataclass
@@ -12,6 +12,7 @@ class IndexerMetrics:
     transfers_fetched_total: int
     transfers_fetched: Dict
     balances_tracked: Dict
+    transfer_indexers_lag: Dict
 
     def __init__(self):
         self.indexers_on = Indexer.objects.filter(status=IndexerStatus.on).count()
@@ -21,10 +22,15 @@ class IndexerMetrics:
         self.transfers_fetched_total = TokenTransfer.objects.all().count()
         self.transfers_fetched = {}
         self.balances_tracked = {}
+        self.transfer_indexers_lag = {}
+        # heads are published by indexers, so lag is known for networks with running ones
+        heads = {head.network_id: head.block_number for head in NetworkHead.objects.all()}
         for indexer in indexers:
             match indexer.type:
                 case IndexerType.transfer_indexer:
                     self.transfers_fetched[indexer.name] = TokenTransfer.objects.filter(fetched_by=indexer).count()
+                    if (head := heads.get(indexer.network_id)) is not None:
+                        self.transfer_indexers_lag[indexer.name] = max(head - indexer.last_block, 0)
                 case IndexerType.balance_indexer:
                     self.balances_tracked[indexer.name] = TokenBalance.objects.filter(tracked_by=indexer).count()
 
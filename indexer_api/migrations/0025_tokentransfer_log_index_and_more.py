@@ -0,0 +1,24 @@
+# Generated by Django 4.2.1 on 2026-10-16 20:37
+
+import decimal
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0024_alter_tokentransfer_tx_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tokentransfer',
+            name='log_index',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='tokentransfer',
+            constraint=models.UniqueConstraint(models.F('token_instance'), models.F('tx_hash'), django.db.models.functions.comparison.Coalesce('log_index', models.Value(-1)), django.db.models.functions.comparison.Coalesce('token_id', models.Value(decimal.Decimal('-1'))), name='unique_token_transfer'),
+        ),
+    ]
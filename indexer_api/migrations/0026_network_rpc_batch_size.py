@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-16 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0025_tokentransfer_log_index_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='network',
+            name='rpc_batch_size',
+            field=models.PositiveIntegerField(default=100, help_text='Max amount of requests in one JSON-RPC batch. Set 1 to make requests one by one'),
+        ),
+    ]
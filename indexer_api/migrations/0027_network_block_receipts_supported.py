@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-16 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0026_network_rpc_batch_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='network',
+            name='block_receipts_supported',
+            field=models.BooleanField(blank=True, default=None, help_text='Whether RPC supports eth_getBlockReceipts. Leave empty to detect it automatically', null=True),
+        ),
+    ]
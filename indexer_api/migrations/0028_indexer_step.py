@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-16 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0027_network_block_receipts_supported'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexer',
+            name='step',
+            field=models.PositiveBigIntegerField(blank=True, help_text="Blocks step learned by transfer indexer from RPC responses. Network's max step is used when empty", null=True),
+        ),
+    ]
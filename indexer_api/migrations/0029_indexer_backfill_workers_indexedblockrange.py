@@ -0,0 +1,31 @@
+# Generated by Django 4.2.1 on 2026-10-16 20:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0028_indexer_step'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexer',
+            name='backfill_workers',
+            field=models.PositiveIntegerField(default=1, help_text='Amount of block ranges fetched concurrently while transfer indexer is far behind the chain. Set 1 to fetch ranges one by one'),
+        ),
+        migrations.CreateModel(
+            name='IndexedBlockRange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_block', models.PositiveBigIntegerField()),
+                ('to_block', models.PositiveBigIntegerField()),
+                ('indexer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='indexed_ranges', to='indexer_api.indexer')),
+            ],
+            options={
+                'verbose_name': 'Indexed block range',
+            },
+        ),
+    ]
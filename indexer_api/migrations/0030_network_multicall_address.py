@@ -0,0 +1,19 @@
+# Generated by Django 4.2.1 on 2026-10-16 20:53
+
+from django.db import migrations, models
+import indexer_api.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0029_indexer_backfill_workers_indexedblockrange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='network',
+            name='multicall_address',
+            field=models.CharField(blank=True, default='0xcA11bde05977b3631167028862bE2a173976CA11', help_text='Multicall3 contract used to aggregate balance calls. Leave empty if it is not deployed on the network', max_length=42, validators=[indexer_api.validators.validate_ethereum_address]),
+        ),
+    ]
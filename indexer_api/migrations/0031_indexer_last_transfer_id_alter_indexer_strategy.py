@@ -0,0 +1,23 @@
+# Generated by Django 4.2.1 on 2026-10-16 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0030_network_multicall_address'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexer',
+            name='last_transfer_id',
+            field=models.PositiveBigIntegerField(default=0, help_text='Balance indexer has handled token transfers up to this id'),
+        ),
+        migrations.AlterField(
+            model_name='indexer',
+            name='strategy',
+            field=models.CharField(choices=[('recipient', 'Recipient'), ('sender', 'Sender'), ('token_scan', 'Scan transfers (all transfers are saved)'), ('tokenomics', 'Tokenomics parameters'), ('specified_holders', 'Specified holders'), ('transfers_participants', 'Transfer participants'), ('transfers_ledger', 'Transfers ledger (balances are computed from indexed transfers)')], max_length=255),
+        ),
+    ]
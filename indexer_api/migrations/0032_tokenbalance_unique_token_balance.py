@@ -0,0 +1,32 @@
+# Generated by Django 4.2.1 on 2026-10-16 20:58
+
+import decimal
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+def delete_duplicated_balances(apps, schema_editor):
+    # the latest written balance of a holder is kept
+    TokenBalance = apps.get_model("indexer_api", "TokenBalance")
+    duplicates = (TokenBalance.objects
+                  .values("token_instance", "holder", "token_id")
+                  .annotate(count=models.Count("id"), last_id=models.Max("id"))
+                  .filter(count__gt=1))
+    for duplicate in duplicates:
+        TokenBalance.objects.filter(token_instance=duplicate["token_instance"], holder=duplicate["holder"],
+                                    token_id=duplicate["token_id"]).exclude(id=duplicate["last_id"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0031_indexer_last_transfer_id_alter_indexer_strategy'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicated_balances, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='tokenbalance',
+            constraint=models.UniqueConstraint(models.F('token_instance'), models.F('holder'), django.db.models.functions.comparison.Coalesce('token_id', models.Value(decimal.Decimal('-1'))), name='unique_token_balance'),
+        ),
+    ]
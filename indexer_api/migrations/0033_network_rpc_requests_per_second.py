@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-16 20:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0032_tokenbalance_unique_token_balance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='network',
+            name='rpc_requests_per_second',
+            field=models.PositiveIntegerField(blank=True, help_text='Max amount of RPC requests per second made by an indexer. Leave empty for no limit', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-16 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0033_network_rpc_requests_per_second'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='token',
+            name='skip_unchanged_enumeration',
+            field=models.BooleanField(default=False, help_text='For NFT ERC721Enumerable: do not enumerate token ids of a holder when its balance equals the amount of known token ids'),
+        ),
+    ]
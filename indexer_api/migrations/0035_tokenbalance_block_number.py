@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-16 21:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0034_token_skip_unchanged_enumeration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tokenbalance',
+            name='block_number',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
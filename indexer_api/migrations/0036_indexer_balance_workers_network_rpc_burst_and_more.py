@@ -0,0 +1,28 @@
+# Generated by Django 4.2.1 on 2026-10-16 21:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0035_tokenbalance_block_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexer',
+            name='balance_workers',
+            field=models.PositiveIntegerField(default=1, help_text='Amount of holders batches fetched concurrently by balance indexer. Set 1 to fetch them one by one'),
+        ),
+        migrations.AddField(
+            model_name='network',
+            name='rpc_burst',
+            field=models.PositiveIntegerField(default=1, help_text='Amount of RPC requests which may be sent at once before requests per second limit applies'),
+        ),
+        migrations.AlterField(
+            model_name='network',
+            name='rpc_requests_per_second',
+            field=models.PositiveIntegerField(blank=True, help_text='Max amount of RPC requests per second shared by indexers of one process. Leave empty for no limit', null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.1 on 2026-10-16 21:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0036_indexer_balance_workers_network_rpc_burst_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NetworkHead',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block_number', models.PositiveBigIntegerField()),
+                ('updated_at', models.DateTimeField()),
+                ('network', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='head', to='indexer_api.network')),
+            ],
+            options={
+                'verbose_name': 'Network head',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.1 on 2026-10-16 21:10
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0037_networkhead'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexer',
+            name='live_mode',
+            field=models.BooleanField(default=False, help_text='Transfer indexer at the chain tip subscribes to logs of watched tokens with WebSocket URL of network instead of polling ranges'),
+        ),
+        migrations.AddField(
+            model_name='network',
+            name='ws_url',
+            field=models.CharField(blank=True, default='', help_text='WebSocket URL of RPC used by transfer indexers in live mode. Leave empty if RPC has no WebSocket endpoint', max_length=2550, validators=[django.core.validators.URLValidator(schemes=('ws', 'wss'))]),
+        ),
+    ]
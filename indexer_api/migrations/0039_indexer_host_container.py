@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-16 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0038_indexer_live_mode_network_ws_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexer',
+            name='host_container',
+            field=models.CharField(blank=True, default='', help_text='Container hosting this indexer together with others. Empty when indexer runs in its own container', max_length=255),
+        ),
+    ]
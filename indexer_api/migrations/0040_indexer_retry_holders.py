@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-16 22:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer_api', '0039_indexer_host_container'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexer',
+            name='retry_holders',
+            field=models.JSONField(blank=True, default=dict, help_text='Holders whose balances failed to be fetched by transfers participants strategy with the amount of attempts, by token'),
+        ),
+    ]
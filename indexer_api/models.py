@@ -1,7 +1,9 @@
 import math
-from typing import Optional
+from decimal import Decimal
+from typing import Iterable, Optional
 
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.core.validators import RegexValidator, URLValidator
 from django.core.exceptions import ValidationError
 from indexer_api.validators import validate_explorer_url, is_ethereum_address_valid, validate_ethereum_address
@@ -13,6 +15,9 @@ ETHEREUM_TX_HASH_LENGTH = 66
 TX_HASH_LENGTH = 66
 STRING_LENGTH = 255
 DEFAULT_STEP = 1000
+DEFAULT_RPC_BATCH_SIZE = 100
+# Multicall3 is deployed to the same address on most networks
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
 DEFAULT_LAST_BLOCK = 0
 
 
@@ -33,10 +38,12 @@ class IndexerStrategy(models.TextChoices):
     tokenomics = ("tokenomics", "Tokenomics parameters")
     specified_holders = ("specified_holders", "Specified holders")
     transfers_participants = ("transfers_participants", "Transfer participants")
+    transfers_ledger = ("transfers_ledger", "Transfers ledger (balances are computed from indexed transfers)")
 
 
 TRANSFER_INDEXER_STRATEGIES = (IndexerStrategy.recipient, IndexerStrategy.sender, IndexerStrategy.token_scan,)
-BALANCE_INDEXER_STRATEGIES = (IndexerStrategy.specified_holders, IndexerStrategy.transfers_participants,)
+BALANCE_INDEXER_STRATEGIES = (IndexerStrategy.specified_holders, IndexerStrategy.transfers_participants,
+                              IndexerStrategy.transfers_ledger,)
 
 
 class TokenType(models.TextChoices):
@@ -61,6 +68,8 @@ class IndexerStatus(models.TextChoices):
 FUNGIBLE_TOKENS = [TokenType.native, TokenType.erc20, TokenType.erc777]
 NON_FUNGIBLE_TOKENS = [TokenType.erc721, TokenType.erc721enumerable]
 ERC1155_TOKENS = [TokenType.erc1155]
+# tokens whose balances can be computed from transfer amounts; no fetcher indexes transfers of ERC777
+LEDGER_TOKENS = [TokenType.erc20, TokenType.erc1155]
 
 
 class Network(models.Model):
@@ -72,6 +81,26 @@ class Network(models.Model):
     max_step = models.PositiveBigIntegerField(default=DEFAULT_STEP)
     type = models.CharField(max_length=STRING_LENGTH, choices=NetworkType.choices)
     need_poa = models.BooleanField(default=False)
+    ws_url = models.CharField(max_length=STRING_LENGTH * 10, default="", blank=True,
+                              validators=[URLValidator(schemes=("ws", "wss"))],
+                              help_text="WebSocket URL of RPC used by transfer indexers in live mode. "
+                                        "Leave empty if RPC has no WebSocket endpoint")
+    rpc_batch_size = models.PositiveIntegerField(default=DEFAULT_RPC_BATCH_SIZE,
+                                                 help_text="Max amount of requests in one JSON-RPC batch. "
+                                                           "Set 1 to make requests one by one")
+    block_receipts_supported = models.BooleanField(null=True, blank=True, default=None,
+                                                   help_text="Whether RPC supports eth_getBlockReceipts. "
+                                                             "Leave empty to detect it automatically")
+    rpc_requests_per_second = models.PositiveIntegerField(null=True, blank=True,
+                                                          help_text="Max amount of RPC requests per second shared by "
+                                                                    "indexers of one process. Leave empty for no limit")
+    rpc_burst = models.PositiveIntegerField(default=1,
+                                            help_text="Amount of RPC requests which may be sent at once before "
+                                                      "requests per second limit applies")
+    multicall_address = models.CharField(max_length=ETHEREUM_ADDRESS_LENGTH, default=MULTICALL3_ADDRESS, blank=True,
+                                         validators=[validate_ethereum_address],
+                                         help_text="Multicall3 contract used to aggregate balance calls. "
+                                                   "Leave empty if it is not deployed on the network")
     # possibly can store some token in it
     explorer_url = models.CharField(max_length=STRING_LENGTH * 10, default="", blank=True,
                                     validators=[URLValidator(schemes=("http", "https")), validate_explorer_url],
@@ -81,12 +110,28 @@ class Network(models.Model):
         return f"{self.name} ({self.chain_id})"
 
 
+class NetworkHead(models.Model):
+    # the latest block of network published by head tracker, so workers and API do not poll RPC for it
+    network = models.OneToOneField(Network, related_name="head", on_delete=models.CASCADE)
+    block_number = models.PositiveBigIntegerField()
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.block_number} on {self.network.name}"
+
+    class Meta:
+        verbose_name = "Network head"
+
+
 class Indexer(models.Model):
     name = models.CharField(max_length=STRING_LENGTH, unique=True, validators=[
         RegexValidator(regex="^[a-z]{1}[a-z0-9-]+$",
                        message="Name should be a valid Docker container name in format my-indexer-name")],
                             help_text="Name should be a valid container identifier. Example: <code>polygon-mainnet-usdt-tracker</code>")  # must be unique since is used as identifier
     last_block = models.PositiveBigIntegerField(default=DEFAULT_LAST_BLOCK)
+    step = models.PositiveBigIntegerField(null=True, blank=True,
+                                          help_text="Blocks step learned by transfer indexer from RPC responses. "
+                                                    "Network's max step is used when empty")
     network = models.ForeignKey(Network, related_name="indexers", on_delete=models.CASCADE)
     watched_tokens = models.ManyToManyField("Token", related_name="indexers")
     strategy = models.CharField(max_length=STRING_LENGTH, choices=IndexerStrategy.choices)
@@ -99,7 +144,26 @@ class Indexer(models.Model):
 
     status = models.CharField(max_length=STRING_LENGTH, choices=IndexerStatus.choices, default=IndexerStatus.off,
                               help_text="You can change status using Admin Actions on Indexers admin panel")
+    host_container = models.CharField(max_length=STRING_LENGTH, blank=True, default="",
+                                      help_text="Container hosting this indexer together with others. "
+                                                "Empty when indexer runs in its own container")
     type = models.CharField(max_length=STRING_LENGTH, choices=IndexerType.choices, default=IndexerType.transfer_indexer)
+    backfill_workers = models.PositiveIntegerField(default=1,
+                                                   help_text="Amount of block ranges fetched concurrently while "
+                                                             "transfer indexer is far behind the chain. "
+                                                             "Set 1 to fetch ranges one by one")
+    balance_workers = models.PositiveIntegerField(default=1,
+                                                  help_text="Amount of holders batches fetched concurrently by "
+                                                            "balance indexer. Set 1 to fetch them one by one")
+    live_mode = models.BooleanField(default=False,
+                                    help_text="Transfer indexer at the chain tip subscribes to logs of watched tokens "
+                                              "with WebSocket URL of network instead of polling ranges")
+    last_transfer_id = models.PositiveBigIntegerField(default=0,
+                                                      help_text="Balance indexer has handled token transfers "
+                                                                "up to this id")
+    retry_holders = models.JSONField(default=dict, blank=True,
+                                     help_text="Holders whose balances failed to be fetched by transfers participants "
+                                               "strategy with the amount of attempts, by token")
 
     def full_clean(self, exclude=None, validate_unique=True, validate_constraints=True):
         super().full_clean(exclude, validate_unique, validate_constraints)
@@ -115,6 +179,10 @@ class Indexer(models.Model):
                 self.validate_recipient_strategy_params(self.strategy_params)
             case IndexerStrategy.specified_holders:
                 self.validate_specified_holders_strategy_params(self.strategy_params)
+            case IndexerStrategy.transfers_participants:
+                self.validate_transfers_participants_strategy_params(self.strategy_params)
+            case IndexerStrategy.transfers_ledger:
+                self.validate_transfers_ledger_strategy_params(self.strategy_params)
 
     @staticmethod
     def validate_transfer_indexer_strategy(strategy: str):
@@ -158,6 +226,55 @@ class Indexer(models.Model):
                 raise ValidationError(
                     f"Bad specified holders strategy: specified holder {holder} is not an ethereum address")
 
+    @staticmethod
+    def validate_transfers_participants_strategy_params(strategy_params: dict):
+        full_sweep_seconds = (strategy_params or {}).get("full_sweep_seconds")
+        if full_sweep_seconds is not None and (type(full_sweep_seconds) != int or full_sweep_seconds <= 0):
+            raise ValidationError("Bad transfers participants strategy: full_sweep_seconds must be a positive integer")
+
+    @staticmethod
+    def validate_ledger_setup(pk: Optional[int], indexer_type: str, strategy: str, tokens: Iterable["Token"]):
+        # watched tokens are set after the indexer is saved, so callers pass the tokens being set.
+        # Ledger adds deltas onto balances of its tokens, so no other balance indexer may write them,
+        # and ledger needs every transfer of its tokens, which only token scan indexers save
+        if indexer_type != IndexerType.balance_indexer:
+            return
+        balance_indexers = Indexer.objects.filter(type=IndexerType.balance_indexer).exclude(pk=pk)
+        for token in tokens:
+            if token.type not in LEDGER_TOKENS:
+                continue
+            if strategy != IndexerStrategy.transfers_ledger:
+                if balance_indexers.filter(strategy=IndexerStrategy.transfers_ledger, watched_tokens=token).exists():
+                    raise ValidationError(f"Balances of {token.name} are computed by a transfers ledger indexer, "
+                                          f"so other balance indexers cannot watch it")
+                continue
+            if balance_indexers.filter(watched_tokens=token).exists():
+                raise ValidationError(f"Bad transfers ledger strategy: balances of {token.name} are written by "
+                                      f"another balance indexer")
+            if not Indexer.objects.filter(type=IndexerType.transfer_indexer, strategy=IndexerStrategy.token_scan,
+                                          watched_tokens=token).exists():
+                raise ValidationError(f"Bad transfers ledger strategy: transfers of {token.name} are not indexed by "
+                                      f"a transfer indexer with token scan strategy")
+
+    @staticmethod
+    def validate_transfers_ledger_strategy_params(strategy_params: dict):
+        spot_check_holders = (strategy_params or {}).get("spot_check_holders", 0)
+        if type(spot_check_holders) != int or spot_check_holders < 0:
+            raise ValidationError("Bad transfers ledger strategy: spot_check_holders must be a non-negative integer")
+
+
+class IndexedBlockRange(models.Model):
+    # blocks range fetched by parallel backfill above the last block of indexer
+    indexer = models.ForeignKey(Indexer, related_name="indexed_ranges", on_delete=models.CASCADE)
+    from_block = models.PositiveBigIntegerField()
+    to_block = models.PositiveBigIntegerField()
+
+    def __str__(self):
+        return f"[{self.from_block}; {self.to_block}] of {self.indexer.name}"
+
+    class Meta:
+        verbose_name = "Indexed block range"
+
 
 class Token(models.Model):
     # not unique: possibly on several chains there can be tokens with the same address
@@ -176,6 +293,11 @@ class Token(models.Model):
                                       "When balances are indexed, NFT ERC721Enumerable is a better option than ERC721 since it allows to see exact owned token ids. <br>"
                                       "Note: make sure contract implements <code>ERC721Enumerable</code> before marking token as NFT ERC721Enumerable")
 
+    skip_unchanged_enumeration = models.BooleanField(default=False,
+                                                     help_text="For NFT ERC721Enumerable: do not enumerate token ids "
+                                                               "of a holder when its balance equals the amount of "
+                                                               "known token ids")
+
     total_supply = models.DecimalField(max_digits=INT256_MAX_DIGITS, decimal_places=INT256_DECIMAL_PLACES,
                                        default=0)
     volume = models.DecimalField(max_digits=INT256_MAX_DIGITS, decimal_places=INT256_DECIMAL_PLACES, default=0)
@@ -228,12 +350,19 @@ class TokenBalance(models.Model):
 
     tracked_by = models.ForeignKey(Indexer, related_name="tracked_balances", on_delete=models.SET_NULL, null=True,
                                    blank=True)
+    # block which the balance was fetched at
+    block_number = models.PositiveBigIntegerField(null=True, blank=True)
 
     def __str__(self):
         return f"Balance of {self.holder} on {self.token_instance.address}"
 
     class Meta:
         verbose_name = "Balance"
+        constraints = [
+            # fungible balances have no token_id, nulls are replaced since Postgres treats them as distinct values
+            models.UniqueConstraint("token_instance", "holder", Coalesce("token_id", models.Value(Decimal(-1))),
+                                    name="unique_token_balance"),
+        ]
 
 
 class TokenTransfer(models.Model):
@@ -242,6 +371,7 @@ class TokenTransfer(models.Model):
     sender = models.CharField(max_length=ETHEREUM_ADDRESS_LENGTH, validators=[validate_ethereum_address])
     recipient = models.CharField(max_length=ETHEREUM_ADDRESS_LENGTH, validators=[validate_ethereum_address])
     tx_hash = models.CharField(max_length=ETHEREUM_TX_HASH_LENGTH)
+    log_index = models.PositiveIntegerField(null=True, blank=True)
     token_id = models.DecimalField(max_digits=INT256_MAX_DIGITS, decimal_places=INT256_DECIMAL_PLACES, null=True,
                                    blank=True)
     amount = models.DecimalField(max_digits=INT256_MAX_DIGITS, decimal_places=INT256_DECIMAL_PLACES, null=True,
@@ -252,6 +382,11 @@ class TokenTransfer(models.Model):
 
     class Meta:
         verbose_name = "Transfer"
+        constraints = [
+            # nulls are replaced since Postgres treats them as distinct values in unique indices
+            models.UniqueConstraint("token_instance", "tx_hash", Coalesce("log_index", models.Value(-1)),
+                                    Coalesce("token_id", models.Value(Decimal(-1))), name="unique_token_transfer"),
+        ]
 
     def __str__(self):
         return f"{self.token_instance.name} transfer {self.shorten_sender()} → {self.shorten_recipient()} ({self.shorten_tx_hash()})"
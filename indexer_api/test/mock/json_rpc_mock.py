@@ -0,0 +1,38 @@
+import json
+from typing import Any, Callable, Dict, List
+
+
+class JsonRpcNodeMock:
+    # stands in for make_post_request: answers JSON-RPC requests and batches with registered method handlers
+    handlers: Dict[str, Callable[..., Any]]
+    batches_supported: bool
+    http_requests: List[Any]
+
+    def __init__(self, handlers: Dict[str, Callable[..., Any]], batches_supported: bool = True):
+        self.handlers = handlers
+        self.batches_supported = batches_supported
+        self.http_requests = []
+
+    def __call__(self, endpoint_uri: str, data: bytes, *args, **kwargs) -> bytes:
+        request = json.loads(data)
+        self.http_requests.append(request)
+        if isinstance(request, list):
+            if not self.batches_supported:
+                return json.dumps({"jsonrpc": "2.0", "id": None,
+                                   "error": {"code": -32600, "message": "batch requests are not supported"}}).encode()
+            return json.dumps([self._answer(item) for item in request]).encode()
+        return json.dumps(self._answer(request)).encode()
+
+    def _answer(self, request: Dict) -> Dict:
+        if not (handler := self.handlers.get(request["method"])):
+            return {"jsonrpc": "2.0", "id": request["id"],
+                    "error": {"code": -32601, "message": f"method {request['method']} does not exist"}}
+        return {"jsonrpc": "2.0", "id": request["id"], "result": handler(*request["params"])}
+
+    def requests_of_method(self, method: str) -> List[Dict]:
+        result = []
+        for request in self.http_requests:
+            for item in (request if isinstance(request, list) else [request]):
+                if item["method"] == method:
+                    result.append(item)
+        return result
@@ -1,11 +1,19 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, cast
+from unittest.mock import patch
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from eth_abi import decode, encode
+from web3 import Web3
+from web3.types import ChecksumAddress
 from indexer.balance_fetchers import AbstractBalanceFetcher, SimpleBalanceFetcher
 from indexer.balance_callers import ERC20BalanceCaller, ERC721BalanceCaller, ERC721EnumerableBalanceCaller, \
-    NativeBalanceFetcher
+    NativeBalanceFetcher, ERC1155BalanceCaller
 from indexer_api.models import TokenType, Token, Network, NetworkType, TokenStrategy, Indexer, IndexerStrategy, \
-    IndexerStatus, IndexerType
+    IndexerStatus, IndexerType, TokenBalance, TokenTransfer
+from indexer.multicall import call_cache
+from indexer_api.test.mock.json_rpc_mock import JsonRpcNodeMock
 from web3.auto import w3
 
 
@@ -77,6 +85,14 @@ class BalanceFetcherCallerDispatchTestCase(TestCase):
         caller = fetcher.balance_caller
         self.assertEqual(type(caller), ERC721EnumerableBalanceCaller)
 
+    def test_should_give_erc1155_caller(self):
+        token = Token.objects.create(address="0x77FeF7746ba17FC58C8Fd6ceD26b5e248110CD69", name="Items",
+                                     strategy=TokenStrategy.event_based_transfer, network=self.network,
+                                     type=TokenType.erc1155)
+        fetcher = SimpleBalanceFetcher(w3, token, self.indexer)
+        caller = fetcher.balance_caller
+        self.assertEqual(type(caller), ERC1155BalanceCaller)
+
     def test_should_give_native_caller(self):
         token = Token.objects.create(address=None, name="DAI",
                                      strategy=TokenStrategy.receipt_based_transfer, network=self.network,
@@ -84,3 +100,388 @@ class BalanceFetcherCallerDispatchTestCase(TestCase):
         fetcher = SimpleBalanceFetcher(w3, token, self.indexer)
         caller = fetcher.balance_caller
         self.assertEqual(type(caller), NativeBalanceFetcher)
+
+
+class AggregatedBalanceCallerTestCase(TestCase):
+    network: Network
+    token: Token
+    indexer: Indexer
+    balances: Dict[str, Optional[int]]
+    node: JsonRpcNodeMock
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1, name="Ethereum", rpc_url="http://localhost:8545",
+                                              max_step=1000, type=NetworkType.no_filters, need_poa=False)
+        self.token = Token.objects.create(address="0x77FeF7746ba17FC58C8Fd6ceD26b5e248110CD69", name="DAI",
+                                          strategy=TokenStrategy.event_based_transfer, network=self.network,
+                                          type=TokenType.erc20)
+        self.indexer = Indexer.objects.create(name="test-indexer", last_block=123, network=self.network,
+                                              strategy=IndexerStrategy.specified_holders,
+                                              short_sleep_seconds=0,
+                                              long_sleep_seconds=0, strategy_params={},
+                                              status=IndexerStatus.on,
+                                              type=IndexerType.balance_indexer)
+        # None stands for a reverted call
+        self.balances = {
+            "0xe4630F2Ea04466103138cA8C6EC1F448ced6fA93": 100,
+            "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938": 0,
+            "0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1": 7,
+            "0x64EE10d587051c1114a058F30eD26cBB5AbB914A": None,
+        }
+        TokenBalance.objects.create(token_instance=self.token, holder="0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1",
+                                    amount=7)
+        self.node = JsonRpcNodeMock({"eth_call": self._eth_call, "eth_chainId": lambda: "0x1"})
+        call_cache.clear()
+
+    def _eth_call(self, transaction: Dict, block_identifier: str) -> str:
+        self.assertEqual(self.network.multicall_address.lower(), transaction["to"].lower())
+        calls = decode(["(address,bool,bytes)[]"], bytes.fromhex(transaction["data"][10:]))[0]
+        results = []
+        for target, allow_failure, call_data in calls:
+            self.assertEqual(str(self.token.address).lower(), target.lower())
+            balance = self.balances[Web3.to_checksum_address(call_data[-20:])]
+            results.append((balance is not None, encode(["uint256"], [balance]) if balance is not None else b""))
+        return "0x" + encode(["(bool,bytes)[]"], [results]).hex()
+
+    def test_should_fetch_balances_with_one_aggregated_call(self):
+        fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+        with patch("web3.providers.rpc.make_post_request", self.node):
+            fetcher.get_balances(cast(List[ChecksumAddress], list(self.balances)))
+
+        self.assertEqual(1, len(self.node.requests_of_method("eth_call")))
+        saved_balances = {balance.holder: balance.amount for balance in TokenBalance.objects.all()}
+        self.assertEqual({"0xe4630F2Ea04466103138cA8C6EC1F448ced6fA93": 100,
+                          "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938": 0,
+                          "0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1": 7}, saved_balances)
+
+    def test_should_call_holders_one_by_one_without_multicall(self):
+        self.network.multicall_address = ""
+        self.network.save()
+        self.token.refresh_from_db()
+        self.balances = {holder: balance for holder, balance in self.balances.items() if balance is not None}
+        self.node.handlers["eth_call"] = lambda transaction, block_identifier: "0x" + encode(
+            ["uint256"], [self.balances[Web3.to_checksum_address(transaction["data"][-40:])]]).hex()
+        fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+        self.assertEqual(1, fetcher.balance_caller.batch_size)
+        with patch("web3.providers.rpc.make_post_request", self.node):
+            fetcher.get_balances(cast(List[ChecksumAddress], list(self.balances)))
+
+        self.assertEqual(len(self.balances), len(self.node.requests_of_method("eth_call")))
+        saved_balances = {balance.holder: balance.amount for balance in TokenBalance.objects.all()}
+        self.assertEqual(self.balances, saved_balances)
+
+    def test_should_update_changed_and_create_new_balances_only(self):
+        fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+        unchanged_balance = TokenBalance.objects.get(holder="0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1")
+        changed_balance = TokenBalance.objects.create(token_instance=self.token,
+                                                      holder="0xe4630F2Ea04466103138cA8C6EC1F448ced6fA93", amount=1)
+        with patch("web3.providers.rpc.make_post_request", self.node), self.assertNumQueries(3):
+            # one query reads existing balances, one updates changed balances and one inserts new ones
+            fetcher.get_balances(cast(List[ChecksumAddress], list(self.balances)))
+
+        changed_balance.refresh_from_db()
+        self.assertEqual(100, changed_balance.amount)
+        self.assertEqual(self.indexer, changed_balance.tracked_by)
+        unchanged_balance.refresh_from_db()
+        self.assertEqual(None, unchanged_balance.tracked_by)
+        self.assertEqual(1, TokenBalance.objects.filter(holder="0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938").count())
+
+    def test_should_fetch_balances_at_pinned_block(self):
+        fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+        fetcher.pin_block(150)
+        with patch("web3.providers.rpc.make_post_request", self.node):
+            fetcher.get_balances(cast(List[ChecksumAddress], list(self.balances)))
+
+        self.assertEqual(hex(150), self.node.requests_of_method("eth_call")[0]["params"][1])
+        # unchanged balance is moved to the pinned block too
+        self.assertEqual({150}, set(TokenBalance.objects.values_list("block_number", flat=True)))
+
+    def test_should_answer_identical_calls_at_pinned_block_from_cache(self):
+        another_indexer = Indexer.objects.create(name="another-indexer", last_block=123, network=self.network,
+                                                 strategy=IndexerStrategy.specified_holders,
+                                                 short_sleep_seconds=0,
+                                                 long_sleep_seconds=0, strategy_params={},
+                                                 status=IndexerStatus.on,
+                                                 type=IndexerType.balance_indexer)
+        holders = cast(List[ChecksumAddress], list(self.balances))
+        with patch("web3.providers.rpc.make_post_request", self.node):
+            for indexer in (self.indexer, another_indexer):
+                fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, indexer)
+                fetcher.pin_block(150)
+                fetcher.get_balances(holders)
+            fetcher.pin_block(151)
+            fetcher.get_balances(holders)
+
+        self.assertEqual([hex(150), hex(151)],
+                         [request["params"][1] for request in self.node.requests_of_method("eth_call")])
+
+
+class ERC1155BalanceCallerTestCase(TestCase):
+    network: Network
+    token: Token
+    indexer: Indexer
+    balances: Dict[Tuple[str, int], int]
+    node: JsonRpcNodeMock
+    alice = "0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1"
+    bob = "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938"
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1, name="Ethereum", rpc_url="http://localhost:8545",
+                                              max_step=1000, type=NetworkType.no_filters, need_poa=False)
+        self.token = Token.objects.create(address="0x9363bFCe94B1A51e0Bd1cc2B17B9D67D7AD29953", name="Items",
+                                          strategy=TokenStrategy.event_based_transfer, network=self.network,
+                                          type=TokenType.erc1155)
+        self.indexer = Indexer.objects.create(name="test-indexer", last_block=123, network=self.network,
+                                              strategy=IndexerStrategy.transfers_participants,
+                                              short_sleep_seconds=0,
+                                              long_sleep_seconds=0, strategy_params={},
+                                              status=IndexerStatus.on,
+                                              type=IndexerType.balance_indexer)
+        carol = "0x41Cc6CE1CEeb68c9c297e04F97aB786915B0Dc9f"
+        for sender, recipient, token_id in ((self.bob, self.alice, 1), (self.alice, self.bob, 1),
+                                            (carol, self.alice, 2)):
+            TokenTransfer.objects.create(token_instance=self.token, sender=sender, recipient=recipient, amount=1,
+                                         token_id=token_id, tx_hash=f"0x{TokenTransfer.objects.count():064x}")
+        self.balances = {(self.alice, 1): 4, (self.bob, 1): 0, (self.alice, 2): 9, (self.bob, 2): 3}
+        TokenBalance.objects.create(token_instance=self.token, holder=self.alice, token_id=1, amount=1)
+        self.node = JsonRpcNodeMock({"eth_call": self._eth_call, "eth_chainId": lambda: "0x1"})
+
+    def _eth_call(self, transaction: Dict, block_identifier: str) -> str:
+        accounts, ids = decode(["address[]", "uint256[]"], bytes.fromhex(transaction["data"][10:]))
+        amounts = [self.balances[(Web3.to_checksum_address(account), token_id)] for account, token_id in zip(accounts, ids)]
+        return "0x" + encode(["uint256[]"], [amounts]).hex()
+
+    def test_should_fetch_balances_of_seen_pairs_with_batch_calls(self):
+        fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+        with patch("web3.providers.rpc.make_post_request", self.node), \
+                patch("indexer.balance_callers.BALANCE_OF_BATCH_SIZE", 2):
+            fetcher.get_balances(cast(List[ChecksumAddress], [self.alice, self.bob]))
+
+        # 3 pairs seen in transfers are fetched with 2 calls, bob has never held token 2
+        self.assertEqual(2, len(self.node.requests_of_method("eth_call")))
+        saved_balances = {(balance.holder, int(balance.token_id or 0)): balance.amount
+                          for balance in TokenBalance.objects.all()}
+        # bob has emptied token 1, so no row is created for it
+        self.assertEqual({(self.alice, 1): 4, (self.alice, 2): 9}, saved_balances)
+
+    def test_should_update_emptied_balance_of_existing_row(self):
+        self.balances[(self.alice, 1)] = 0
+        fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+        with patch("web3.providers.rpc.make_post_request", self.node):
+            fetcher.get_balances(cast(List[ChecksumAddress], [self.alice, self.bob]))
+
+        saved_balances = {(balance.holder, int(balance.token_id or 0)): balance.amount
+                          for balance in TokenBalance.objects.all()}
+        self.assertEqual({(self.alice, 1): 0, (self.alice, 2): 9}, saved_balances)
+
+
+class ERC721EnumerableBalanceCallerTestCase(TestCase):
+    network: Network
+    token: Token
+    indexer: Indexer
+    owned_token_ids: Dict[str, List[int]]
+    node: JsonRpcNodeMock
+    alice = "0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1"
+    bob = "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938"
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1, name="Ethereum", rpc_url="http://localhost:8545",
+                                              max_step=1000, type=NetworkType.no_filters, need_poa=False)
+        self.token = Token.objects.create(address="0x9363bFCe94B1A51e0Bd1cc2B17B9D67D7AD29953", name="NFT",
+                                          strategy=TokenStrategy.event_based_transfer, network=self.network,
+                                          type=TokenType.erc721enumerable)
+        self.indexer = Indexer.objects.create(name="test-indexer", last_block=123, network=self.network,
+                                              strategy=IndexerStrategy.specified_holders,
+                                              short_sleep_seconds=0,
+                                              long_sleep_seconds=0, strategy_params={},
+                                              status=IndexerStatus.on,
+                                              type=IndexerType.balance_indexer)
+        self.owned_token_ids = {self.alice: [1, 5, 7], self.bob: [2]}
+        for token_id in (1, 3):
+            TokenBalance.objects.create(token_instance=self.token, holder=self.alice, token_id=token_id)
+        TokenBalance.objects.create(token_instance=self.token, holder=self.bob, token_id=4)
+        self.node = JsonRpcNodeMock({"eth_call": self._eth_call, "eth_chainId": lambda: "0x1"})
+
+    def _eth_call(self, transaction: Dict, block_identifier: str) -> str:
+        calls = decode(["(address,bool,bytes)[]"], bytes.fromhex(transaction["data"][10:]))[0]
+        results = []
+        for target, allow_failure, call_data in calls:
+            if call_data[:4] == Web3.keccak(text="balanceOf(address)")[:4]:
+                holder = Web3.to_checksum_address(call_data[-20:])
+                results.append((True, encode(["uint256"], [len(self.owned_token_ids[holder])])))
+            else:
+                holder, index = decode(["address", "uint256"], call_data[4:])
+                token_id = self.owned_token_ids[Web3.to_checksum_address(holder)][index]
+                results.append((True, encode(["uint256"], [token_id])))
+        return "0x" + encode(["(bool,bytes)[]"], [results]).hex()
+
+    def _get_saved_token_ids(self) -> Dict[str, List[int]]:
+        result: Dict[str, List[int]] = {}
+        for balance in TokenBalance.objects.order_by("token_id"):
+            result.setdefault(balance.holder, []).append(int(balance.token_id or 0))
+        return result
+
+    def test_should_enumerate_token_ids_with_aggregated_calls(self):
+        fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+        with patch("web3.providers.rpc.make_post_request", self.node), self.assertNumQueries(3):
+            # one query reads held token ids, one deletes moved ones and one inserts given ones
+            fetcher.get_balances(cast(List[ChecksumAddress], [self.alice, self.bob]))
+
+        # one call fetches balances and one enumerates all token ids
+        self.assertEqual(2, len(self.node.requests_of_method("eth_call")))
+        self.assertEqual(self.owned_token_ids, self._get_saved_token_ids())
+
+    def test_should_skip_enumeration_of_unchanged_balances(self):
+        self.token.skip_unchanged_enumeration = True
+        self.token.save()
+        self.owned_token_ids[self.bob] = [4]
+        fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+        with patch("web3.providers.rpc.make_post_request", self.node):
+            fetcher.get_balances(cast(List[ChecksumAddress], [self.alice, self.bob]))
+
+        tokens_of_owner_calls = 0
+        for request in self.node.requests_of_method("eth_call"):
+            for _, _, call_data in decode(["(address,bool,bytes)[]"], bytes.fromhex(request["params"][0]["data"][10:]))[0]:
+                if call_data[:4] != Web3.keccak(text="balanceOf(address)")[:4]:
+                    tokens_of_owner_calls += 1
+        # only alice, whose balance differs from 2 known token ids, is enumerated
+        self.assertEqual(3, tokens_of_owner_calls)
+        self.assertEqual(self.owned_token_ids, self._get_saved_token_ids())
+
+    def test_should_enumerate_token_ids_one_by_one_without_multicall(self):
+        self.network.multicall_address = ""
+        self.network.save()
+        self.token.refresh_from_db()
+
+        def eth_call(transaction: Dict, block_identifier: str) -> str:
+            data = bytes.fromhex(transaction["data"][2:])
+            if data[:4] == Web3.keccak(text="balanceOf(address)")[:4]:
+                return "0x" + encode(["uint256"], [len(self.owned_token_ids[Web3.to_checksum_address(data[-20:])])]).hex()
+            holder, index = decode(["address", "uint256"], data[4:])
+            return "0x" + encode(["uint256"], [self.owned_token_ids[Web3.to_checksum_address(holder)][index]]).hex()
+
+        self.node.handlers["eth_call"] = eth_call
+        fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+        with patch("web3.providers.rpc.make_post_request", self.node):
+            fetcher.get_balances(cast(List[ChecksumAddress], [self.alice, self.bob]))
+
+        self.assertEqual(2 + 4, len(self.node.requests_of_method("eth_call")))
+        self.assertEqual(self.owned_token_ids, self._get_saved_token_ids())
+
+
+class NativeBalanceFetcherTestCase(TestCase):
+    network: Network
+    token: Token
+    indexer: Indexer
+    balances: Dict[str, int]
+    node: JsonRpcNodeMock
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1, name="Ethereum", rpc_url="http://localhost:8545",
+                                              max_step=1000, type=NetworkType.no_filters, need_poa=False,
+                                              rpc_batch_size=2)
+        self.token = Token.objects.create(address=None, name="ETH",
+                                          strategy=TokenStrategy.receipt_based_transfer, network=self.network,
+                                          type=TokenType.native)
+        self.indexer = Indexer.objects.create(name="test-indexer", last_block=123, network=self.network,
+                                              strategy=IndexerStrategy.specified_holders,
+                                              short_sleep_seconds=0,
+                                              long_sleep_seconds=0, strategy_params={},
+                                              status=IndexerStatus.on,
+                                              type=IndexerType.balance_indexer)
+        self.balances = {
+            "0xe4630F2Ea04466103138cA8C6EC1F448ced6fA93": 10 ** 18,
+            "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938": 0,
+            "0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1": 7,
+        }
+        self.node = JsonRpcNodeMock({
+            "eth_getBalance": lambda holder, block_identifier: hex(self.balances[Web3.to_checksum_address(holder)])
+        })
+
+    def _get_balances(self, block_number: Optional[int] = None):
+        fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+        fetcher.pin_block(block_number)
+        with patch("indexer.json_rpc.make_post_request", self.node), \
+                patch("web3.providers.rpc.make_post_request", self.node):
+            fetcher.get_balances(cast(List[ChecksumAddress], list(self.balances)))
+
+    def test_should_fetch_balances_with_batches_at_pinned_block(self):
+        self._get_balances(block_number=150)
+
+        # 3 holders with batches of 2 requests
+        self.assertEqual([2, 1], [len(request) for request in self.node.http_requests])
+        self.assertEqual({hex(150)}, {request["params"][1] for request in self.node.requests_of_method("eth_getBalance")})
+        saved_balances = {balance.holder: balance.amount for balance in TokenBalance.objects.all()}
+        self.assertEqual(self.balances, saved_balances)
+
+    def test_should_fall_back_to_sequential_requests_when_batches_rejected(self):
+        self.node.batches_supported = False
+        self._get_balances()
+
+        # the first batch is rejected, then every holder is requested one by one
+        self.assertEqual(1 + 3, len(self.node.http_requests))
+        saved_balances = {balance.holder: balance.amount for balance in TokenBalance.objects.all()}
+        self.assertEqual(self.balances, saved_balances)
+
+
+class ConcurrentBalanceFetcherTestCase(TransactionTestCase):
+    network: Network
+    token: Token
+    indexer: Indexer
+    balances: Dict[str, int]
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1, name="Ethereum", rpc_url="http://localhost:8545",
+                                              max_step=1000, type=NetworkType.no_filters, need_poa=False,
+                                              multicall_address="")
+        self.token = Token.objects.create(address="0x77FeF7746ba17FC58C8Fd6ceD26b5e248110CD69", name="DAI",
+                                          strategy=TokenStrategy.event_based_transfer, network=self.network,
+                                          type=TokenType.erc20)
+        self.indexer = Indexer.objects.create(name="test-indexer", last_block=123, network=self.network,
+                                              strategy=IndexerStrategy.specified_holders,
+                                              short_sleep_seconds=0,
+                                              long_sleep_seconds=0, strategy_params={},
+                                              status=IndexerStatus.on,
+                                              type=IndexerType.balance_indexer,
+                                              balance_workers=3)
+        self.balances = {
+            "0xe4630F2Ea04466103138cA8C6EC1F448ced6fA93": 100,
+            "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938": 0,
+            "0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1": 7,
+            "0x64EE10d587051c1114a058F30eD26cBB5AbB914A": 5,
+        }
+
+    def test_should_fetch_batches_concurrently(self):
+        node = JsonRpcNodeMock({
+            "eth_chainId": lambda: "0x1",
+            "eth_call": lambda transaction, block_identifier: "0x" + encode(
+                ["uint256"], [self.balances[Web3.to_checksum_address(transaction["data"][-40:])]]).hex()
+        })
+        fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+        with patch("web3.providers.rpc.make_post_request", node), \
+                patch("indexer.balance_fetchers.ThreadPoolExecutor", wraps=ThreadPoolExecutor) as executor:
+            fetcher.get_balances(cast(List[ChecksumAddress], list(self.balances)))
+
+        executor.assert_called_once_with(max_workers=3)
+        saved_balances = {balance.holder: balance.amount for balance in TokenBalance.objects.all()}
+        self.assertEqual(self.balances, saved_balances)
+
+    def test_should_report_failed_holders_the_same_way_serially_and_concurrently(self):
+        failing_holder = "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938"
+
+        def balance_of(transaction: Dict, block_identifier: str) -> str:
+            holder = Web3.to_checksum_address(transaction["data"][-40:])
+            if holder == failing_holder:
+                raise ConnectionError("Node is down")
+            return "0x" + encode(["uint256"], [self.balances[holder]]).hex()
+
+        node = JsonRpcNodeMock({"eth_chainId": lambda: "0x1", "eth_call": balance_of})
+        holders = cast(List[ChecksumAddress], list(self.balances))
+        for balance_workers in (1, 3):
+            self.indexer.balance_workers = balance_workers
+            fetcher = SimpleBalanceFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token, self.indexer)
+            with patch("web3.providers.rpc.make_post_request", node):
+                self.assertEqual([failing_holder], fetcher.get_balances(holders))
+                # failed batches are reported as a whole
+                with patch.object(fetcher, "_save_balances", side_effect=ValueError("Database is down")):
+                    self.assertEqual(sorted(holders), fetcher.get_balances(holders))
@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+from unittest.mock import patch
+from web3 import Web3
+
+from indexer.chain_head import chain_head_tracker
+from indexer_api.metrics import IndexerMetrics
+from indexer_api.models import Network, NetworkType, NetworkHead, Indexer, IndexerStrategy, IndexerStatus, \
+    IndexerType
+from indexer_api.test.mock.json_rpc_mock import JsonRpcNodeMock
+
+
+class ChainHeadTrackerTestCase(TestCase):
+    network: Network
+    node: JsonRpcNodeMock
+    head: int
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1, name="Ethereum", rpc_url="http://localhost:8545",
+                                              max_step=1000, type=NetworkType.filterable, need_poa=False)
+        self.head = 100
+        self.node = JsonRpcNodeMock({"eth_blockNumber": lambda: hex(self.head)})
+
+    def _get_latest_block(self) -> int:
+        with patch("web3.providers.rpc.make_post_request", self.node):
+            return chain_head_tracker.get_latest_block(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.network)
+
+    def test_should_publish_head_polled_with_block_number(self):
+        self.assertEqual(100, self._get_latest_block())
+        self.head = 101
+        # another worker of the network reads the fresh head from the table
+        self.assertEqual(100, self._get_latest_block())
+
+        self.assertEqual(1, len(self.node.http_requests))
+        self.assertEqual(100, NetworkHead.objects.get(network=self.network).block_number)
+
+    def test_should_poll_head_again_when_published_one_is_stale(self):
+        self._get_latest_block()
+        NetworkHead.objects.filter(network=self.network).update(updated_at=timezone.now() - timedelta(minutes=1))
+        self.head = 101
+
+        self.assertEqual(101, self._get_latest_block())
+        self.assertEqual(2, len(self.node.requests_of_method("eth_blockNumber")))
+        self.assertEqual(101, NetworkHead.objects.get(network=self.network).block_number)
+
+    def test_should_not_move_published_head_backwards(self):
+        self._get_latest_block()
+        NetworkHead.objects.filter(network=self.network).update(updated_at=timezone.now() - timedelta(minutes=1))
+        # a lagging node of another worker returns an older head
+        self.head = 99
+
+        self.assertEqual(99, self._get_latest_block())
+        self.assertEqual(100, NetworkHead.objects.get(network=self.network).block_number)
+
+    def test_should_estimate_block_time_from_block_timestamps(self):
+        self.node.handlers["eth_getBlockByNumber"] = lambda block_identifier, full_transactions: {
+            "number": hex(1000) if block_identifier == "latest" else block_identifier,
+            "timestamp": hex(12 * (1000 if block_identifier == "latest" else int(block_identifier, 16)))}
+        chain_head_tracker.clear()
+        with patch("web3.providers.rpc.make_post_request", self.node):
+            w3 = Web3(Web3.HTTPProvider(self.network.rpc_url))
+            self.assertEqual(12.0, chain_head_tracker.get_block_time(w3, self.network))
+            self.assertEqual(12.0, chain_head_tracker.get_block_time(w3, self.network))
+
+        # the latest block and the sample one are requested once while estimate is fresh
+        self.assertEqual(["latest", hex(900)],
+                         [request["params"][0] for request in self.node.requests_of_method("eth_getBlockByNumber")])
+
+    def test_should_give_lag_of_transfer_indexers(self):
+        Indexer.objects.create(name="test-indexer", last_block=60, network=self.network,
+                               strategy=IndexerStrategy.token_scan, short_sleep_seconds=0, long_sleep_seconds=0,
+                               strategy_params={}, status=IndexerStatus.on, type=IndexerType.transfer_indexer)
+        self._get_latest_block()
+
+        self.assertEqual({"test-indexer": 40}, IndexerMetrics().transfer_indexers_lag)
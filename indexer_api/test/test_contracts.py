@@ -0,0 +1,89 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+from web3 import Web3
+from web3.types import HexBytes
+
+from indexer.balance_fetchers import SimpleBalanceFetcher
+from indexer.contracts import ContractRegistry
+from indexer.transfer_fetchers import EventTransferFetcher
+from indexer.transfer_transactions import ERC1155TransferTransaction, FungibleTransferTransaction
+from indexer_api.models import Network, NetworkType, Token, TokenStrategy, TokenType, Indexer, IndexerStrategy, \
+    IndexerStatus, IndexerType
+
+
+class ContractRegistryTestCase(TestCase):
+    network: Network
+    token: Token
+    registry: ContractRegistry
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1,
+                                              name="Ethereum mainnet",
+                                              rpc_url="https://ethereum.org",
+                                              max_step=1000,
+                                              type=NetworkType.no_filters,
+                                              need_poa=False)
+        self.token = Token.objects.create(address="0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3",
+                                          name="DAI",
+                                          network=self.network,
+                                          strategy=TokenStrategy.event_based_transfer,
+                                          type=TokenType.erc20)
+        self.registry = ContractRegistry()
+
+    def test_should_parse_abi_once(self):
+        with patch("builtins.open", wraps=open) as opened:
+            first = self.registry.get_abi("ERC20.json")
+            second = self.registry.get_abi("ERC20.json")
+        self.assertIs(first, second)
+        self.assertEqual(1, opened.call_count)
+
+    def test_should_precompute_event_topics_and_function_selectors(self):
+        erc20_abi = self.registry.get_abi("ERC20.json")
+        self.assertEqual(FungibleTransferTransaction.event_hash,
+                         erc20_abi.event_topics["Transfer(address,address,uint256)"])
+        self.assertEqual(HexBytes("0x70a08231"), erc20_abi.function_selectors["balanceOf(address)"])
+        erc1155_abi = self.registry.get_abi("ERC1155.json")
+        self.assertEqual(ERC1155TransferTransaction.event_hash_batch,
+                         erc1155_abi.event_topics["TransferBatch(address,address,address,uint256[],uint256[])"])
+
+    def test_should_keep_selectors_of_overloaded_functions(self):
+        erc721_abi = self.registry.get_abi("ERC721.json")
+        self.assertEqual(HexBytes("0x42842e0e"),
+                         erc721_abi.function_selectors["safeTransferFrom(address,address,uint256)"])
+        self.assertEqual(HexBytes("0xb88d4fde"),
+                         erc721_abi.function_selectors["safeTransferFrom(address,address,uint256,bytes)"])
+        multicall_abi = self.registry.get_abi("Multicall3.json")
+        self.assertEqual(HexBytes("0x82ad56cb"), multicall_abi.function_selectors["aggregate3((address,bool,bytes)[])"])
+
+    def test_should_share_contract_of_same_web3_address_and_abi(self):
+        w3 = Web3(Web3.HTTPProvider(self.network.rpc_url))
+        address = "0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3"
+        contract = self.registry.get_contract(w3, address.lower(), "ERC20.json")
+        self.assertIs(contract, self.registry.get_contract(w3, address, "ERC20.json"))
+        self.assertIsNot(contract, self.registry.get_contract(w3, address, "ERC721.json"))
+
+    def test_should_bind_contract_to_web3_of_caller(self):
+        # every worker has own Web3 with its middlewares, so contracts of the same address are not shared
+        first_w3 = Web3(Web3.HTTPProvider(self.network.rpc_url))
+        second_w3 = Web3(Web3.HTTPProvider(self.network.rpc_url))
+        address = "0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3"
+        first_contract = self.registry.get_contract(first_w3, address, "ERC20.json")
+        second_contract = self.registry.get_contract(second_w3, address, "ERC20.json")
+        self.assertIs(first_w3, first_contract.w3)
+        self.assertIs(second_w3, second_contract.w3)
+
+    def test_should_share_contracts_between_fetchers(self):
+        indexer = Indexer.objects.create(name="test",
+                                         last_block=0,
+                                         network=self.network,
+                                         strategy=IndexerStrategy.specified_holders,
+                                         short_sleep_seconds=0,
+                                         long_sleep_seconds=0,
+                                         strategy_params={},
+                                         status=IndexerStatus.on,
+                                         type=IndexerType.balance_indexer)
+        w3 = Web3(Web3.HTTPProvider(self.network.rpc_url))
+        event_fetcher = EventTransferFetcher(w3, self.token)
+        self.assertIs(event_fetcher.contract, EventTransferFetcher(w3, self.token).contract)
+        self.assertIs(event_fetcher.contract, SimpleBalanceFetcher(w3, self.token, indexer).contract)
@@ -0,0 +1,43 @@
+import threading
+from typing import Dict, List
+from unittest.mock import Mock, patch
+
+from django.test import TestCase
+
+from indexer.host import IndexerHost
+
+
+class IndexerHostTestCase(TestCase):
+    host: IndexerHost
+    cycles: Dict[str, int]
+    built_indexers: List[str]
+
+    def setUp(self) -> None:
+        self.host = IndexerHost(["failing-indexer", "healthy-indexer"])
+        self.cycles = {"failing-indexer": 0, "healthy-indexer": 0}
+        self.built_indexers = []
+
+    def _build_indexer(self, indexer_name: str) -> Mock:
+        self.built_indexers.append(indexer_name)
+        worker = Mock()
+        worker.cycle.side_effect = lambda stopped: self._cycle(indexer_name, stopped)
+        return worker
+
+    def _cycle(self, indexer_name: str, stopped: threading.Event):
+        # cycle of a worker returns only when the host is stopped
+        self.cycles[indexer_name] += 1
+        if indexer_name == "failing-indexer":
+            if self.cycles[indexer_name] < 3:
+                raise ValueError("RPC is down")
+            self.host.stop()
+        stopped.wait()
+
+    def test_should_restart_failed_indexer_only(self):
+        with patch("indexer.host.IndexerWorkerFactory.build_indexer", side_effect=self._build_indexer), \
+                patch("indexer.host.HOST_RESTART_MIN_SECONDS", 0), \
+                patch("indexer.host.connection"):
+            self.host.run()
+
+        # healthy indexer keeps cycling while the failing one is rebuilt after every failure
+        self.assertEqual(3, self.built_indexers.count("failing-indexer"))
+        self.assertEqual(1, self.built_indexers.count("healthy-indexer"))
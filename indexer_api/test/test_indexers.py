@@ -0,0 +1,645 @@
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+from unittest.mock import Mock, patch
+
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from web3 import Web3
+from web3._utils.method_formatters import log_entry_formatter
+from web3.types import HexStr
+
+from indexer.indexers import TransferIndexerWorker, BalanceIndexerWorker, PIPELINE_MAX_RANGES, PIPELINE_QUEUE_SIZE
+from indexer.strategies import TokenScanStrategy, TransfersLedgerStrategy
+from indexer.transfer_transactions import FungibleTransferTransaction
+from indexer_api.models import Network, NetworkType, Indexer, IndexerStrategy, IndexerStatus, IndexerType, \
+    IndexedBlockRange, Token, TokenStrategy, TokenType, TokenTransfer, TokenBalance
+from indexer_api.test.mock.json_rpc_mock import JsonRpcNodeMock
+
+
+class TransferIndexerWorkerStepTestCase(TestCase):
+    network: Network
+    indexer: Indexer
+    worker: TransferIndexerWorker
+    fetcher: Mock
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1,
+                                              name="Ethereum mainnet",
+                                              rpc_url="https://ethereum.org",
+                                              max_step=1000,
+                                              type=NetworkType.no_filters,
+                                              need_poa=False)
+        self.indexer = Indexer.objects.create(name="test",
+                                              last_block=100,
+                                              network=self.network,
+                                              strategy=IndexerStrategy.token_scan,
+                                              short_sleep_seconds=0,
+                                              long_sleep_seconds=0,
+                                              strategy_params={},
+                                              status=IndexerStatus.on,
+                                              type=IndexerType.transfer_indexer)
+        self.worker = TransferIndexerWorker(self.indexer)
+        self.fetcher = Mock()
+        self.worker.transfer_fetchers = [self.fetcher]
+
+    def _cycle(self, latest_block: int = 1_000_000):
+        with patch.object(self.worker, "get_latest_block", return_value=latest_block):
+            self.worker._cycle_body()
+        self.indexer.refresh_from_db()
+
+    def test_should_bisect_range_when_provider_reports_too_many_results(self):
+        self.fetcher.get_transfers_of_tokens.side_effect = ValueError(
+            {"code": -32005, "message": "query returned more than 10000 results"})
+
+        self._cycle()
+        self.assertEqual(500, self.indexer.step)
+        self.assertEqual(100, self.indexer.last_block)
+        self.assertEqual((100, 1100), self.fetcher.get_transfers_of_tokens.call_args.args)
+
+        self._cycle()
+        self.assertEqual(250, self.indexer.step)
+        self.assertEqual((100, 600), self.fetcher.get_transfers_of_tokens.call_args.args)
+
+    def test_should_not_change_step_on_other_errors(self):
+        self.fetcher.get_transfers_of_tokens.side_effect = ValueError("execution reverted")
+
+        self._cycle()
+        self.assertEqual(None, self.indexer.step)
+        self.assertEqual(100, self.indexer.last_block)
+
+    def test_should_grow_step_up_to_network_max_step_on_small_responses(self):
+        self.indexer.step = 300
+        self.indexer.save()
+        self.fetcher.get_transfers_of_tokens.return_value = {}
+
+        self._cycle()
+        self.assertEqual(100 + PIPELINE_MAX_RANGES * 300, self.indexer.last_block)
+        self.assertEqual(600, self.indexer.step)
+
+        self._cycle()
+        self.assertEqual(100 + PIPELINE_MAX_RANGES * (300 + 600), self.indexer.last_block)
+        self.assertEqual(1000, self.indexer.step)
+
+    def test_should_not_grow_step_when_range_is_cut_by_latest_block(self):
+        self.indexer.step = 300
+        self.indexer.save()
+        self.fetcher.get_transfers_of_tokens.return_value = {}
+
+        self._cycle(latest_block=200)
+        self.assertEqual(200, self.indexer.last_block)
+        self.assertEqual(300, self.indexer.step)
+
+    def test_should_not_sleep_while_behind_head(self):
+        self.fetcher.get_transfers_of_tokens.return_value = {}
+
+        with patch("indexer.indexers.chain_head_tracker.get_block_time", return_value=12.0):
+            self._cycle()
+            self.assertEqual(0, self.worker.get_cycle_sleep_seconds())
+
+            self._cycle(latest_block=self.indexer.last_block + 10)
+            self.assertEqual(12.0, self.worker.get_cycle_sleep_seconds())
+
+    def test_should_pace_failed_cycles_with_block_time(self):
+        self.fetcher.get_transfers_of_tokens.side_effect = ValueError("execution reverted")
+
+        self._cycle()
+        with patch("indexer.indexers.chain_head_tracker.get_block_time", return_value=None):
+            self.assertEqual(self.indexer.short_sleep_seconds, self.worker.get_cycle_sleep_seconds())
+
+
+class TransferIndexerWorkerBackfillTestCase(TestCase):
+    network: Network
+    indexer: Indexer
+    worker: TransferIndexerWorker
+    fetcher: Mock
+    failing_from_blocks: Set[int]
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1,
+                                              name="Ethereum mainnet",
+                                              rpc_url="https://ethereum.org",
+                                              max_step=100,
+                                              type=NetworkType.no_filters,
+                                              need_poa=False)
+        self.indexer = Indexer.objects.create(name="test",
+                                              last_block=0,
+                                              network=self.network,
+                                              strategy=IndexerStrategy.token_scan,
+                                              short_sleep_seconds=0,
+                                              long_sleep_seconds=0,
+                                              strategy_params={},
+                                              status=IndexerStatus.on,
+                                              type=IndexerType.transfer_indexer,
+                                              backfill_workers=2)
+        self.worker = TransferIndexerWorker(self.indexer)
+        self.failing_from_blocks = set()
+        self.fetcher = Mock()
+        self.fetcher.get_transfers_of_tokens.side_effect = self._get_transfers_of_tokens
+        self.worker.transfer_fetchers = [self.fetcher]
+
+    def _get_transfers_of_tokens(self, from_block: int, to_block: int):
+        if from_block in self.failing_from_blocks:
+            raise ValueError("execution reverted")
+        return {}
+
+    def _cycle(self, latest_block: int = 1_000_000):
+        with patch.object(self.worker, "get_latest_block", return_value=latest_block):
+            self.worker._cycle_body()
+        self.indexer.refresh_from_db()
+
+    def _fetched_ranges(self) -> List[Tuple[int, int]]:
+        return sorted(call.args for call in self.fetcher.get_transfers_of_tokens.call_args_list)
+
+    def test_should_fetch_shards_and_advance_last_block_through_contiguous_ranges(self):
+        self._cycle()
+
+        # 2 workers with 4 ranges for every one
+        self.assertEqual([(1, 100), (101, 200), (201, 300), (301, 400), (401, 500), (501, 600), (601, 700),
+                          (701, 800)], self._fetched_ranges())
+        self.assertEqual(800, self.indexer.last_block)
+        self.assertEqual(0, IndexedBlockRange.objects.count())
+
+    def test_should_not_advance_last_block_above_gap(self):
+        self.failing_from_blocks = {201}
+        self._cycle()
+
+        self.assertEqual(200, self.indexer.last_block)
+        self.assertEqual([(301, 400), (401, 500), (501, 600), (601, 700), (701, 800)],
+                         list(IndexedBlockRange.objects.order_by("from_block").values_list("from_block", "to_block")))
+
+        # the gap is fetched on the next cycle and already indexed ranges are skipped
+        self.failing_from_blocks = set()
+        self.fetcher.get_transfers_of_tokens.reset_mock()
+        self._cycle()
+
+        self.assertEqual([(201, 300), (801, 900), (901, 1000), (1001, 1100), (1101, 1200), (1201, 1300),
+                          (1301, 1400), (1401, 1500)], self._fetched_ranges())
+        self.assertEqual(1500, self.indexer.last_block)
+        self.assertEqual(0, IndexedBlockRange.objects.count())
+
+    def test_should_fetch_ranges_one_by_one_near_latest_block(self):
+        self._cycle(latest_block=150)
+
+        self.assertEqual([(0, 100), (100, 150)], self._fetched_ranges())
+        self.assertEqual(150, self.indexer.last_block)
+
+
+class TransferIndexerWorkerPipelineTestCase(TestCase):
+    network: Network
+    token: Token
+    indexer: Indexer
+    worker: TransferIndexerWorker
+    fetcher: Mock
+    strategy: Mock
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1,
+                                              name="Ethereum mainnet",
+                                              rpc_url="https://ethereum.org",
+                                              max_step=100,
+                                              type=NetworkType.no_filters,
+                                              need_poa=False)
+        self.token = Token.objects.create(address="0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3",
+                                          name="DAI",
+                                          network=self.network,
+                                          strategy=TokenStrategy.event_based_transfer,
+                                          type=TokenType.erc20)
+        self.indexer = Indexer.objects.create(name="test",
+                                              last_block=0,
+                                              network=self.network,
+                                              strategy=IndexerStrategy.token_scan,
+                                              short_sleep_seconds=0,
+                                              long_sleep_seconds=0,
+                                              strategy_params={},
+                                              status=IndexerStatus.on,
+                                              type=IndexerType.transfer_indexer)
+        self.worker = TransferIndexerWorker(self.indexer)
+        self.fetcher = Mock()
+        self.fetcher.get_transfers_of_tokens.side_effect = self._get_transfers_of_tokens
+        self.worker.transfer_fetchers = [self.fetcher]
+        self.strategy = Mock()
+        self.worker.strategy = self.strategy
+
+    def _get_transfers_of_tokens(self, from_block: int, to_block: int):
+        return {self.token: [FungibleTransferTransaction(
+            sender=Web3.to_checksum_address("0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1"),
+            recipient=Web3.to_checksum_address("0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938"),
+            tx_hash=HexStr(f"0x{to_block:064x}"),
+            amount=1)]}
+
+    def _cycle(self, latest_block: int):
+        with patch.object(self.worker, "get_latest_block", return_value=latest_block):
+            self.worker._cycle_body()
+        self.indexer.refresh_from_db()
+
+    def test_should_persist_fetched_ranges_in_order(self):
+        self._cycle(latest_block=450)
+
+        self.assertEqual(450, self.indexer.last_block)
+        persisted_tx_hashes = [call.args[1][0].tx_hash for call in self.strategy.start.call_args_list]
+        self.assertEqual([f"0x{to_block:064x}" for to_block in (100, 200, 300, 400, 450)], persisted_tx_hashes)
+
+    def test_should_stop_at_last_persisted_range_when_persisting_fails(self):
+        self.strategy.start.side_effect = [None, None, ValueError("database is down")]
+
+        self._cycle(latest_block=450)
+
+        self.assertEqual(200, self.indexer.last_block)
+        self.assertEqual(3, self.strategy.start.call_count)
+        # fetching is stopped too, so it does not run further than the bounded queue allows
+        self.assertLessEqual(self.fetcher.get_transfers_of_tokens.call_count, 3 + PIPELINE_QUEUE_SIZE + 1)
+
+
+class FakeLogSubscription:
+    # pushes prepared batches of logs with heads and then drops connection
+    pushed_logs: List[Tuple[List[Dict], Optional[int]]]
+    filters: List[Dict]
+    head_block: Optional[int]
+
+    def __init__(self, pushed_logs: List[Tuple[List[Dict], Optional[int]]]):
+        self.pushed_logs = pushed_logs
+        self.filters = []
+        self.head_block = None
+
+    def __call__(self, ws_url: str, filters: List[Dict]) -> "FakeLogSubscription":
+        self.filters = filters
+        return self
+
+    def __enter__(self) -> "FakeLogSubscription":
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def receive(self, timeout: float) -> List[Dict]:
+        if not self.pushed_logs:
+            raise ConnectionError("connection closed")
+        logs, head_block = self.pushed_logs.pop(0)
+        if head_block is not None:
+            self.head_block = head_block
+        return [log_entry_formatter(log) for log in logs]
+
+
+class TransferIndexerWorkerLiveTestCase(TestCase):
+    network: Network
+    token: Token
+    indexer: Indexer
+    node: JsonRpcNodeMock
+    alice = "0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1"
+    bob = "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938"
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1,
+                                              name="Ethereum mainnet",
+                                              rpc_url="http://localhost:8545",
+                                              ws_url="ws://localhost:8546",
+                                              max_step=100,
+                                              type=NetworkType.no_filters,
+                                              need_poa=False)
+        self.token = Token.objects.create(address="0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3",
+                                          name="DAI",
+                                          network=self.network,
+                                          strategy=TokenStrategy.event_based_transfer,
+                                          type=TokenType.erc20)
+        self.indexer = Indexer.objects.create(name="test",
+                                              last_block=100,
+                                              network=self.network,
+                                              strategy=IndexerStrategy.token_scan,
+                                              short_sleep_seconds=0,
+                                              long_sleep_seconds=0,
+                                              strategy_params={},
+                                              status=IndexerStatus.on,
+                                              type=IndexerType.transfer_indexer,
+                                              live_mode=True)
+        self.indexer.watched_tokens.add(self.token)
+        self.node = JsonRpcNodeMock({"eth_blockNumber": lambda: hex(102), "eth_getLogs": lambda log_filter: [],
+                                     "eth_chainId": lambda: "0x1"})
+
+    def _transfer_log(self, block_number: int, amount: int, removed: bool = False) -> Dict:
+        return {"address": str(self.token.address).lower(),
+                "topics": [Web3.to_hex(Web3.keccak(text="Transfer(address,address,uint256)")),
+                           "0x" + "0" * 24 + self.alice[2:].lower(), "0x" + "0" * 24 + self.bob[2:].lower()],
+                "data": "0x" + f"{amount:064x}", "blockNumber": hex(block_number),
+                "transactionHash": f"0x{block_number:064x}", "logIndex": "0x0", "blockHash": "0x" + "0" * 64,
+                "transactionIndex": "0x0", "removed": removed}
+
+    def test_should_persist_pushed_logs_after_gap_repair(self):
+        subscription = FakeLogSubscription([([self._transfer_log(103, 5), self._transfer_log(102, 7, removed=True)],
+                                             103),
+                                            ([], 104)])
+        worker = TransferIndexerWorker(self.indexer)
+        # HTTP node is ahead of the WebSocket one
+        with patch("web3.providers.rpc.make_post_request", self.node), \
+                patch("indexer.indexers.LogSubscription", subscription), \
+                patch.object(worker, "get_latest_block", return_value=102), \
+                patch("indexer.chain_head.ChainHeadTracker.get_latest_block", return_value=110):
+            worker._cycle_body()
+        self.indexer.refresh_from_db()
+
+        self.assertEqual([str(self.token.address)], subscription.filters[0]["address"])
+        # blocks up to the head at subscription are polled once
+        self.assertEqual([{"fromBlock": hex(100), "toBlock": hex(102)}],
+                         [{key: request["params"][0][key] for key in ("fromBlock", "toBlock")}
+                          for request in self.node.requests_of_method("eth_getLogs")])
+        self.assertEqual([5], [int(transfer.amount or 0) for transfer in TokenTransfer.objects.all()])
+        # logs of the last head pushed over WebSocket may come after it, so only blocks below it are complete
+        self.assertEqual(103, self.indexer.last_block)
+
+    def test_should_delete_transfers_of_logs_removed_by_reorganization(self):
+        subscription = FakeLogSubscription([([self._transfer_log(103, 5)], 103),
+                                            ([self._transfer_log(103, 5, removed=True)], None)])
+        worker = TransferIndexerWorker(self.indexer)
+        with patch("web3.providers.rpc.make_post_request", self.node), \
+                patch("indexer.indexers.LogSubscription", subscription), \
+                patch.object(worker, "get_latest_block", return_value=102):
+            worker._cycle_body()
+        self.indexer.refresh_from_db()
+
+        self.assertEqual(0, TokenTransfer.objects.count())
+        # removed log does not complete its block
+        self.assertEqual(102, self.indexer.last_block)
+
+    def test_should_poll_ranges_without_websocket_url(self):
+        self.network.ws_url = ""
+        self.network.save()
+        self.indexer.refresh_from_db()
+        worker = TransferIndexerWorker(self.indexer)
+        with patch("web3.providers.rpc.make_post_request", self.node), \
+                patch("indexer.indexers.LogSubscription") as subscription, \
+                patch.object(worker, "get_latest_block", return_value=102):
+            worker._cycle_body()
+
+        subscription.assert_not_called()
+        self.indexer.refresh_from_db()
+        self.assertEqual(102, self.indexer.last_block)
+
+
+class BalanceIndexerWorkerLedgerTestCase(TestCase):
+    network: Network
+    erc20_token: Token
+    erc1155_token: Token
+    indexer: Indexer
+    zero_address = "0x0000000000000000000000000000000000000000"
+    alice = "0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1"
+    bob = "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938"
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1,
+                                              name="Ethereum mainnet",
+                                              rpc_url="https://ethereum.org",
+                                              max_step=100,
+                                              type=NetworkType.no_filters,
+                                              need_poa=False,
+                                              multicall_address="")
+        self.erc20_token = Token.objects.create(address="0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3",
+                                                name="DAI",
+                                                network=self.network,
+                                                strategy=TokenStrategy.event_based_transfer,
+                                                type=TokenType.erc20)
+        self.erc1155_token = Token.objects.create(address="0x9363bFCe94B1A51e0Bd1cc2B17B9D67D7AD29953",
+                                                  name="Some ERC1155",
+                                                  network=self.network,
+                                                  strategy=TokenStrategy.event_based_transfer,
+                                                  type=TokenType.erc1155)
+        self.indexer = Indexer.objects.create(name="test",
+                                              network=self.network,
+                                              strategy=IndexerStrategy.transfers_ledger,
+                                              short_sleep_seconds=0,
+                                              long_sleep_seconds=0,
+                                              strategy_params={},
+                                              status=IndexerStatus.on,
+                                              type=IndexerType.balance_indexer)
+        self.indexer.watched_tokens.add(self.erc20_token, self.erc1155_token)
+        Indexer.objects.create(name="all-transfers", network=self.network, last_block=1000,
+                               strategy=IndexerStrategy.token_scan, short_sleep_seconds=0, long_sleep_seconds=0,
+                               strategy_params={}, status=IndexerStatus.on, type=IndexerType.transfer_indexer) \
+            .watched_tokens.add(self.erc20_token, self.erc1155_token)
+
+    def _transfer(self, token: Token, sender: str, recipient: str, amount: int, token_id: Optional[int] = None):
+        TokenTransfer.objects.create(token_instance=token, sender=sender, recipient=recipient, amount=amount,
+                                     token_id=token_id, tx_hash=f"0x{TokenTransfer.objects.count():064x}",
+                                     log_index=0)
+
+    def _balances(self) -> Dict[Tuple[str, str, Optional[int]], int]:
+        return {(balance.token_instance.name, balance.holder,
+                 int(balance.token_id) if balance.token_id is not None else None): int(balance.amount or 0)
+                for balance in TokenBalance.objects.all()}
+
+    def test_should_apply_transfers_as_deltas(self):
+        self._transfer(self.erc20_token, self.zero_address, self.alice, 100)
+        self._transfer(self.erc20_token, self.alice, self.bob, 30)
+        self._transfer(self.erc1155_token, self.zero_address, self.alice, 5, token_id=1)
+        self._transfer(self.erc1155_token, self.alice, self.bob, 2, token_id=1)
+        worker = BalanceIndexerWorker(self.indexer)
+        worker._cycle_body()
+
+        self.assertEqual({("DAI", self.alice, None): 70,
+                          ("DAI", self.bob, None): 30,
+                          ("Some ERC1155", self.alice, 1): 3,
+                          ("Some ERC1155", self.bob, 1): 2}, self._balances())
+        self.indexer.refresh_from_db()
+        self.assertEqual(TokenTransfer.objects.latest("id").id, self.indexer.last_transfer_id)
+
+        # only new transfers are applied on the next cycle
+        self._transfer(self.erc20_token, self.bob, self.zero_address, 10)
+        worker._cycle_body()
+        self.assertEqual(20, self._balances()[("DAI", self.bob, None)])
+        self.assertEqual(70, self._balances()[("DAI", self.alice, None)])
+
+    def test_should_apply_deltas_to_balances_inserted_meanwhile(self):
+        self._transfer(self.erc20_token, self.zero_address, self.alice, 100)
+        worker = BalanceIndexerWorker(self.indexer)
+        select_balances = TransfersLedgerStrategy._select_balances
+        selected_keys: List[Set] = []
+
+        def select_balances_with_concurrent_insert(keys):
+            balances_by_key = select_balances(keys)
+            if not selected_keys:
+                # another process inserts the row after the ledger has found it missing
+                TokenBalance.objects.create(token_instance=self.erc20_token, holder=self.alice, amount=10)
+            selected_keys.append(set(keys))
+            return balances_by_key
+
+        with patch.object(TransfersLedgerStrategy, "_select_balances",
+                          side_effect=select_balances_with_concurrent_insert):
+            worker._cycle_body()
+
+        # the missing row is selected again under lock and the delta is added to the inserted amount
+        self.assertEqual(2, len(selected_keys))
+        self.assertEqual({("DAI", self.alice, None): 110}, self._balances())
+
+    def test_should_revert_applied_transfers_removed_by_reorganization(self):
+        self._transfer(self.erc20_token, self.zero_address, self.alice, 100)
+        self._transfer(self.erc20_token, self.alice, self.bob, 30)
+        worker = BalanceIndexerWorker(self.indexer)
+        worker._cycle_body()
+        self._transfer(self.erc20_token, self.alice, self.bob, 5)
+        removed_transfers = [FungibleTransferTransaction(self.alice, self.bob, HexStr(f"0x{1:064x}"), 30, log_index=0),
+                             FungibleTransferTransaction(self.alice, self.bob, HexStr(f"0x{2:064x}"), 5, log_index=0)]
+
+        TokenScanStrategy(Indexer.objects.get(name="all-transfers")).remove(self.erc20_token, removed_transfers)
+        worker._cycle_body()
+
+        # the applied transfer is subtracted, the one not applied yet is just deleted
+        self.assertEqual({("DAI", self.alice, None): 100, ("DAI", self.bob, None): 0}, self._balances())
+        self.assertEqual(1, TokenTransfer.objects.count())
+
+    def test_should_refuse_transfers_indexed_without_log_index(self):
+        TokenTransfer.objects.create(token_instance=self.erc20_token, sender=self.zero_address, recipient=self.alice,
+                                     amount=100, tx_hash=f"0x{1:064x}")
+        self.assertRaises(ValueError, lambda: BalanceIndexerWorker(self.indexer))
+
+    def test_should_replace_balances_written_before_ledger(self):
+        TokenBalance.objects.create(token_instance=self.erc20_token, holder=self.alice, amount=100)
+        self._transfer(self.erc20_token, self.zero_address, self.alice, 30)
+        BalanceIndexerWorker(self.indexer)._cycle_body()
+
+        self.assertEqual({("DAI", self.alice, None): 30}, self._balances())
+
+    def test_should_not_compute_balances_of_tokens_without_indexed_transfers(self):
+        erc777_token = Token.objects.create(address="0x41Cc6CE1CEeb68c9c297e04F97aB786915B0Dc9f", name="Some ERC777",
+                                            network=self.network, strategy=TokenStrategy.event_based_transfer,
+                                            type=TokenType.erc777)
+        self.indexer.watched_tokens.add(erc777_token)
+        worker = BalanceIndexerWorker(self.indexer)
+
+        self.assertNotIn(erc777_token, worker.ledger_tokens)
+
+    def test_should_spot_check_balances_of_touched_holders(self):
+        self.indexer.strategy_params = {"spot_check_holders": 1}
+        self.indexer.save()
+        self._transfer(self.erc20_token, self.zero_address, self.alice, 100)
+        worker = BalanceIndexerWorker(self.indexer)
+        erc20_fetcher = next(fetcher for fetcher in worker.balance_fetchers if fetcher.token == self.erc20_token)
+
+        with patch.object(erc20_fetcher.balance_caller, "_get_amounts", return_value={self.alice: 90}) as get_amounts, \
+                patch.object(worker, "get_latest_block", return_value=150):
+            worker._cycle_body()
+
+        get_amounts.assert_called_once_with([self.alice])
+        self.assertEqual(150, erc20_fetcher.balance_caller.block_number)
+        # drifted balances are reported only
+        self.assertEqual(100, self._balances()[("DAI", self.alice, None)])
+
+    def test_should_spot_check_balances_at_block_of_indexed_transfers(self):
+        self.indexer.strategy_params = {"spot_check_holders": 1}
+        self.indexer.save()
+        transfer_indexer = Indexer.objects.create(name="transfers", network=self.network, last_block=120,
+                                                  strategy=IndexerStrategy.token_scan, short_sleep_seconds=0,
+                                                  long_sleep_seconds=0, strategy_params={}, status=IndexerStatus.on,
+                                                  type=IndexerType.transfer_indexer)
+        transfer_indexer.watched_tokens.add(self.erc20_token)
+        self._transfer(self.erc20_token, self.zero_address, self.alice, 100)
+        worker = BalanceIndexerWorker(self.indexer)
+        erc20_fetcher = next(fetcher for fetcher in worker.balance_fetchers if fetcher.token == self.erc20_token)
+
+        with patch.object(erc20_fetcher.balance_caller, "_get_amounts", return_value={self.alice: 100}), \
+                patch.object(worker, "get_latest_block", return_value=150):
+            worker._cycle_body()
+
+        self.assertEqual(120, erc20_fetcher.balance_caller.block_number)
+        # the matching on-chain balance does not move the ledger balance to the block
+        self.assertEqual([None], list(TokenBalance.objects.values_list("block_number", flat=True)))
+
+
+class BalanceIndexerWorkerParticipantsTestCase(TestCase):
+    network: Network
+    token: Token
+    indexer: Indexer
+    alice = "0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1"
+    bob = "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938"
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1, name="Ethereum mainnet", rpc_url="https://ethereum.org",
+                                              max_step=100, type=NetworkType.no_filters, need_poa=False,
+                                              multicall_address="")
+        self.token = Token.objects.create(address="0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3", name="DAI",
+                                          network=self.network, strategy=TokenStrategy.event_based_transfer,
+                                          type=TokenType.erc20)
+        self.indexer = Indexer.objects.create(name="test", network=self.network,
+                                              strategy=IndexerStrategy.transfers_participants,
+                                              short_sleep_seconds=0, long_sleep_seconds=0, strategy_params={},
+                                              status=IndexerStatus.on, type=IndexerType.balance_indexer)
+        self.indexer.watched_tokens.add(self.token)
+
+    def test_should_move_transfer_cursor_and_retry_holders_whose_balances_failed(self):
+        TokenTransfer.objects.create(token_instance=self.token, sender=self.alice, recipient=self.bob, amount=1,
+                                     tx_hash=f"0x{1:064x}")
+        worker = BalanceIndexerWorker(self.indexer)
+        fetcher = worker.balance_fetchers[0]
+        with patch.object(worker, "get_latest_block", return_value=150):
+            with patch.object(fetcher, "get_balances", return_value=[self.bob]):
+                worker._cycle_body()
+            self.assertEqual(TokenTransfer.objects.latest("id").id,
+                             Indexer.objects.get(pk=self.indexer.pk).last_transfer_id)
+
+            with patch.object(fetcher, "get_balances", return_value=[]) as get_balances:
+                worker._cycle_body()
+                # only the failed holder is given again
+                self.assertEqual([self.bob], get_balances.call_args.args[0])
+                worker._cycle_body()
+
+        self.assertEqual([], get_balances.call_args.args[0])
+
+
+class BalanceIndexerWorkerLedgerConcurrencyTestCase(TransactionTestCase):
+    network: Network
+    token: Token
+    indexer: Indexer
+    zero_address = "0x0000000000000000000000000000000000000000"
+    alice = "0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1"
+    bob = "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938"
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1, name="Ethereum mainnet", rpc_url="https://ethereum.org",
+                                              max_step=100, type=NetworkType.no_filters, need_poa=False,
+                                              multicall_address="")
+        self.token = Token.objects.create(address="0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3", name="DAI",
+                                          network=self.network, strategy=TokenStrategy.event_based_transfer,
+                                          type=TokenType.erc20)
+        self.indexer = Indexer.objects.create(name="test", network=self.network,
+                                              strategy=IndexerStrategy.transfers_ledger, short_sleep_seconds=0,
+                                              long_sleep_seconds=0, strategy_params={}, status=IndexerStatus.on,
+                                              type=IndexerType.balance_indexer)
+        self.indexer.watched_tokens.add(self.token)
+        Indexer.objects.create(name="all-transfers", network=self.network, strategy=IndexerStrategy.token_scan,
+                               short_sleep_seconds=0, long_sleep_seconds=0, strategy_params={},
+                               status=IndexerStatus.on, type=IndexerType.transfer_indexer) \
+            .watched_tokens.add(self.token)
+
+    def _transfer(self, sender: str, recipient: str, amount: int, tx_hash: str):
+        TokenTransfer.objects.create(token_instance=self.token, sender=sender, recipient=recipient, amount=amount,
+                                     tx_hash=tx_hash, log_index=0)
+
+    def _transfer_in_open_transaction(self, inserted: threading.Event, commit: threading.Event):
+        try:
+            with transaction.atomic():
+                self._transfer(self.zero_address, self.alice, 100, f"0x{1:064x}")
+                inserted.set()
+                commit.wait(10)
+        finally:
+            connection.close()
+
+    def _balances(self) -> Dict[str, int]:
+        return {balance.holder: int(balance.amount or 0) for balance in TokenBalance.objects.all()}
+
+    def test_should_not_skip_transfers_committed_out_of_id_order(self):
+        inserted, commit = threading.Event(), threading.Event()
+        writer = threading.Thread(target=self._transfer_in_open_transaction, args=(inserted, commit))
+        writer.start()
+        inserted.wait(10)
+        # the mint takes the lower id but is committed after the transfer with the higher id
+        self._transfer(self.alice, self.bob, 30, f"0x{2:064x}")
+        worker = BalanceIndexerWorker(self.indexer)
+        with patch.object(worker, "get_latest_block", return_value=None):
+            worker._cycle_body()
+            self.assertEqual({}, self._balances())
+            self.assertEqual(0, Indexer.objects.get(pk=self.indexer.pk).last_transfer_id)
+
+            commit.set()
+            writer.join()
+            worker._cycle_body()
+
+        self.assertEqual({self.alice: 70, self.bob: 30}, self._balances())
+        self.assertEqual(TokenTransfer.objects.latest("id").id,
+                         Indexer.objects.get(pk=self.indexer.pk).last_transfer_id)
@@ -0,0 +1,73 @@
+import json
+from typing import Any, Dict, List, Optional
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from indexer.live import LogSubscription
+
+
+class FakeConnection:
+    # answers eth_subscribe with ids and gives prepared messages, then times out
+    messages: List[Dict[str, Any]]
+    sent: List[Dict[str, Any]]
+
+    def __init__(self, messages: List[Dict[str, Any]]):
+        self.messages = messages
+        self.sent = []
+
+    def send(self, message: str):
+        request = json.loads(message)
+        self.sent.append(request)
+        self.messages.append({"jsonrpc": "2.0", "id": request["id"], "result": f"0x{request['id'] + 1:x}"})
+
+    def recv(self, timeout: Optional[float] = None) -> str:
+        if not self.messages:
+            raise TimeoutError()
+        return json.dumps(self.messages.pop(0))
+
+    def close(self):
+        pass
+
+
+class LogSubscriptionTestCase(TestCase):
+
+    @staticmethod
+    def _notification(subscription: str, block_number: int) -> Dict[str, Any]:
+        return {"jsonrpc": "2.0", "method": "eth_subscription", "params": {"subscription": subscription, "result": {
+            "address": "0xeb3d38af7f3594014cf23c273f21eed623e1e0a3", "topics": ["0x" + "1" * 64], "data": "0x",
+            "blockNumber": hex(block_number), "transactionHash": "0x" + "2" * 64, "logIndex": "0x0",
+            "blockHash": "0x" + "3" * 64, "transactionIndex": "0x0", "removed": False}}}
+
+    @staticmethod
+    def _head(subscription: str, block_number: int) -> Dict[str, Any]:
+        return {"jsonrpc": "2.0", "method": "eth_subscription", "params": {"subscription": subscription, "result": {
+            "number": hex(block_number), "hash": "0x" + "3" * 64, "parentHash": "0x" + "4" * 64}}}
+
+    def test_should_subscribe_with_every_filter_and_receive_formatted_logs(self):
+        filters: List[Any] = [{"address": ["0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3"], "topics": [["0x" + "1" * 64]]},
+                              {"address": ["0x9363bFCe94B1A51e0Bd1cc2B17B9D67D7AD29953"], "topics": [["0x" + "4" * 64]]}]
+        # a log is pushed before the second subscription is confirmed
+        connection = FakeConnection([self._notification("0x1", 10)])
+        with patch("indexer.live.connect", return_value=connection), \
+                LogSubscription("ws://localhost:8546", filters) as subscription:
+            connection.messages.append(self._notification("0x2", 11))
+            logs = subscription.receive(1)
+            self.assertEqual([], subscription.receive(1))
+
+        self.assertEqual([["logs", log_filter] for log_filter in filters] + [["newHeads"]],
+                         [request["params"] for request in connection.sent])
+        self.assertEqual([10, 11], [log["blockNumber"] for log in logs])
+        self.assertEqual("0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3", logs[0]["address"])
+
+    def test_should_follow_heads_pushed_over_the_same_connection(self):
+        filters: List[Any] = [{"address": ["0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3"], "topics": [["0x" + "1" * 64]]}]
+        connection = FakeConnection([])
+        with patch("indexer.live.connect", return_value=connection), \
+                LogSubscription("ws://localhost:8546", filters) as subscription:
+            # the heads subscription is confirmed as 0x2 after the logs one
+            connection.messages.extend([self._notification("0x1", 12), self._head("0x2", 12), self._head("0x2", 13)])
+            logs = subscription.receive(1)
+
+        self.assertEqual([12], [log["blockNumber"] for log in logs])
+        self.assertEqual(13, subscription.head_block)
@@ -1,8 +1,9 @@
+from django.core.exceptions import ValidationError
 from django.db.utils import IntegrityError
 from django.test import TestCase
 
-from indexer_api.models import Network, Token
-from indexer_api.models import NetworkType, TokenStrategy
+from indexer_api.models import Network, Token, TokenBalance, TokenTransfer, Indexer
+from indexer_api.models import NetworkType, TokenStrategy, TokenType, IndexerStrategy, IndexerType
 
 
 class NetworkTestCase(TestCase):
@@ -87,3 +88,91 @@ class TokenTestCase(TestCase):
                              network=self.second_network)
         count = Token.objects.filter(name="Some Token").count()
         self.assertEqual(count, 2)
+
+
+class TokenTransferTestCase(TestCase):
+    token: Token
+
+    def setUp(self) -> None:
+        network = Network.objects.create(chain_id=1, name="Ethereum", rpc_url="https://rpc.ethereum.network",
+                                         max_step=1000, type=NetworkType.filterable, need_poa=False)
+        self.token = Token.objects.create(address="0x63CE09b8654390415BE84155eC5268cB4e206b63", name="USDT",
+                                          strategy=TokenStrategy.event_based_transfer, network=network,
+                                          type=TokenType.erc20)
+
+    def _transfer(self, log_index: int) -> TokenTransfer:
+        return TokenTransfer(token_instance=self.token, sender="0xdEeAe2a40467970142fa0FF3EF79e283Cf60a021",
+                             recipient="0x9363bFCe94B1A51e0Bd1cc2B17B9D67D7AD29953", tx_hash="0x" + "1" * 64,
+                             log_index=log_index, amount=5)
+
+    def test_transfer_without_token_id_passes_validation(self):
+        self._transfer(0).full_clean()
+
+    def test_duplicated_transfer_fails_validation(self):
+        self._transfer(0).save()
+        self._transfer(1).full_clean()
+        self.assertRaises(ValidationError, self._transfer(0).full_clean)
+
+
+class TokenBalanceTestCase(TestCase):
+    token: Token
+
+    def setUp(self) -> None:
+        network = Network.objects.create(chain_id=1, name="Ethereum", rpc_url="https://rpc.ethereum.network",
+                                         max_step=1000, type=NetworkType.filterable, need_poa=False)
+        self.token = Token.objects.create(address="0x63CE09b8654390415BE84155eC5268cB4e206b63", name="USDT",
+                                          strategy=TokenStrategy.event_based_transfer, network=network,
+                                          type=TokenType.erc20)
+
+    def _balance(self, holder: str) -> TokenBalance:
+        return TokenBalance(token_instance=self.token, holder=holder, amount=5)
+
+    def test_balance_without_token_id_passes_validation(self):
+        self._balance("0xdEeAe2a40467970142fa0FF3EF79e283Cf60a021").full_clean()
+
+    def test_duplicated_balance_fails_validation(self):
+        self._balance("0xdEeAe2a40467970142fa0FF3EF79e283Cf60a021").save()
+        self._balance("0x9363bFCe94B1A51e0Bd1cc2B17B9D67D7AD29953").full_clean()
+        self.assertRaises(ValidationError, self._balance("0xdEeAe2a40467970142fa0FF3EF79e283Cf60a021").full_clean)
+
+
+class IndexerLedgerSetupTestCase(TestCase):
+    network: Network
+    token: Token
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1, name="Ethereum", rpc_url="https://rpc.ethereum.network",
+                                              max_step=1000, type=NetworkType.filterable, need_poa=False)
+        self.token = Token.objects.create(address="0x63CE09b8654390415BE84155eC5268cB4e206b63", name="USDT",
+                                          strategy=TokenStrategy.event_based_transfer, network=self.network,
+                                          type=TokenType.erc20)
+
+    def _indexer(self, name: str, indexer_type: IndexerType, strategy: IndexerStrategy) -> Indexer:
+        indexer = Indexer.objects.create(name=name, network=self.network, type=indexer_type, strategy=strategy,
+                                         strategy_params={})
+        indexer.watched_tokens.add(self.token)
+        return indexer
+
+    def _validate_ledger(self):
+        Indexer.validate_ledger_setup(None, IndexerType.balance_indexer, IndexerStrategy.transfers_ledger,
+                                      [self.token])
+
+    def test_ledger_needs_token_scan_transfer_indexer(self):
+        self._indexer("recipient-transfers", IndexerType.transfer_indexer, IndexerStrategy.recipient)
+        self.assertRaises(ValidationError, self._validate_ledger)
+        self._indexer("all-transfers", IndexerType.transfer_indexer, IndexerStrategy.token_scan)
+        self._validate_ledger()
+
+    def test_ledger_cannot_share_token_with_other_balance_indexer(self):
+        self._indexer("all-transfers", IndexerType.transfer_indexer, IndexerStrategy.token_scan)
+        self._indexer("participants", IndexerType.balance_indexer, IndexerStrategy.transfers_participants)
+        self.assertRaises(ValidationError, self._validate_ledger)
+
+    def test_balance_indexer_cannot_watch_token_of_ledger(self):
+        ledger = self._indexer("ledger", IndexerType.balance_indexer, IndexerStrategy.transfers_ledger)
+        self.assertRaises(ValidationError, lambda: Indexer.validate_ledger_setup(
+            None, IndexerType.balance_indexer, IndexerStrategy.specified_holders, [self.token]))
+        # the ledger itself is excluded when it is edited
+        self._indexer("all-transfers", IndexerType.transfer_indexer, IndexerStrategy.token_scan)
+        Indexer.validate_ledger_setup(ledger.pk, IndexerType.balance_indexer, IndexerStrategy.transfers_ledger,
+                                      [self.token])
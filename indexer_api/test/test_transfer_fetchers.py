@@ -3,14 +3,15 @@ from typing import cast
 
 from django.test import TestCase
 
-from indexer.transfer_fetchers import EventTransferFetcher, ReceiptTransferFetcher
+from indexer.transfer_fetchers import EventTransferFetcher, ReceiptTransferFetcher, CombinedEventTransferFetcher
 from indexer.transfer_transactions import FungibleTransferTransaction, NonFungibleTransferTransaction, \
     ERC1155TransferTransaction, NativeCurrencyTransferTransaction
 from indexer_api.models import Token, Network, NetworkType, TokenStrategy, TokenType
 from web3.auto import w3
 
+from indexer_api.test.mock.json_rpc_mock import JsonRpcNodeMock
 from indexer_api.test.mock.transfer_fetchers_mock import EventTransferFetcherMock
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 from web3 import Web3
 from web3.types import BlockData, HexBytes, TxReceipt
 from web3.datastructures import AttributeDict
@@ -75,28 +76,6 @@ class EventTransferFetcherTestCase(TestCase):
             expected = json.load(file)
             self.assertEqual(abi, expected)
 
-    def test_should_fail_give_events_if_token_type_is_bad(self):
-        self.assertRaises(ValueError,
-                          lambda: EventTransferFetcher._get_event_names(TokenType.native))
-        self.assertRaises(ValueError,
-                          lambda: EventTransferFetcher._get_event_names("some_token_type_which_is_impossible"))
-
-    def test_should_give_events_erc20(self):
-        events = EventTransferFetcher._get_event_names(TokenType.erc20)
-        self.assertEqual(events, ["Transfer"])
-
-    def test_should_give_events_erc721(self):
-        events = EventTransferFetcher._get_event_names(TokenType.erc721)
-        self.assertEqual(events, ["Transfer"])
-
-    def test_should_give_events_erc721enumerable(self):
-        events = EventTransferFetcher._get_event_names(TokenType.erc721enumerable)
-        self.assertEqual(events, ["Transfer"])
-
-    def test_should_give_events_erc1155(self):
-        events = EventTransferFetcher._get_event_names(TokenType.erc1155)
-        self.assertEqual(events, ["TransferSingle", "TransferBatch"])
-
     def test_should_fail_give_transfer_transaction_type_for_bad_token_type(self):
         self.assertRaises(ValueError,
                           lambda: EventTransferFetcher._get_transfer_transaction_type("some_bad_token_type"))
@@ -117,17 +96,10 @@ class EventTransferFetcherTestCase(TestCase):
         transfer_transaction_type = EventTransferFetcher._get_transfer_transaction_type(TokenType.erc1155)
         self.assertEqual(ERC1155TransferTransaction, transfer_transaction_type)
 
-    def test_should_properly_dispatch_event_function_when_eth_filter_available(self):
+    def test_should_fetch_raw_logs_when_eth_filter_available(self):
         mocked_event_transfer_fetcher = EventTransferFetcherMock(w3, self.token_with_eth_filter)
         transfers = mocked_event_transfer_fetcher.get_transfers(100, 200)
-        self.assertEqual(1, len(transfers))
-        transfer = cast(FungibleTransferTransaction, transfers[0])
-        self.assertEqual(mocked_event_transfer_fetcher.mock_transfer_fetched_by_standard_filter.sender, transfer.sender)
-        self.assertEqual(mocked_event_transfer_fetcher.mock_transfer_fetched_by_standard_filter.recipient,
-                         transfer.recipient)
-        self.assertEqual(mocked_event_transfer_fetcher.mock_transfer_fetched_by_standard_filter.tx_hash,
-                         transfer.tx_hash)
-        self.assertEqual(mocked_event_transfer_fetcher.mock_transfer_fetched_by_standard_filter.amount, transfer.amount)
+        self.assertEqual([mocked_event_transfer_fetcher.mock_transfer_fetched_by_raw_filter], transfers)
 
     def test_should_properly_dispatch_event_function_when_only_raw_filters_available(self):
         mocked_event_transfer_fetcher = EventTransferFetcherMock(w3, self.token_without_filtering)
@@ -147,6 +119,116 @@ class EventTransferFetcherTestCase(TestCase):
         self.assertRaises(NotImplementedError, lambda: mocked_event_transfer_fetcher.get_transfers(100, 200))
 
 
+class CombinedEventTransferFetcherTestCase(TestCase):
+    network: Network
+    erc20_token: Token
+    erc1155_token: Token
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=137,
+                                              name="Polygon mainnet",
+                                              rpc_url="https://polygon.org",
+                                              max_step=1000,
+                                              type=NetworkType.no_filters,
+                                              need_poa=True)
+        self.erc20_token = Token.objects.create(address="0xc2132D05D31c914a87C6611C10748AEb04B58e8F",
+                                                name="USDT",
+                                                network=self.network,
+                                                strategy=TokenStrategy.event_based_transfer,
+                                                type=TokenType.erc20)
+        self.erc1155_token = Token.objects.create(address="0x9363bFCe94B1A51e0Bd1cc2B17B9D67D7AD29953",
+                                                  name="Some ERC1155",
+                                                  network=self.network,
+                                                  strategy=TokenStrategy.event_based_transfer,
+                                                  type=TokenType.erc1155)
+        self.sender_raw = "0x000000000000000000000000db6f2ed702823b903b6d185f68bdf715d1b3af76"
+        self.recipient_raw = "0x0000000000000000000000007ab6c736baf1dac266aab43884d82974a9adcccf"
+        self.tx_hash = "0xa35cac639bd0f75e19bf28ceb26e60ddd057cce6e702769abb7b3e470300debd"
+        self.logs = [
+            AttributeDict({
+                'address': self.erc20_token.address,
+                'topics': [
+                    HexBytes('0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'),
+                    HexBytes(self.sender_raw),
+                    HexBytes(self.recipient_raw)],
+                'data': HexBytes("0x0000000000000000000000000000000000000000000000000000000065e07c93"),
+                'transactionHash': HexBytes(self.tx_hash),
+                'logIndex': 5,
+            }),
+            AttributeDict({
+                'address': self.erc1155_token.address,
+                'topics': [
+                    HexBytes('0xc3d58168c5ae7397731d063d5bbf3d657854427343f4c083240f7aacaa2d0f62'),
+                    HexBytes(self.sender_raw),
+                    HexBytes(self.sender_raw),
+                    HexBytes(self.recipient_raw)],
+                'data': HexBytes("0x0000000000000000000000000000000000000000000000000000000000000001"
+                                 "0000000000000000000000000000000000000000000000000000000000000064"),
+                'transactionHash': HexBytes(self.tx_hash),
+                'logIndex': 6,
+            }),
+            # log of a token which is not watched is ignored
+            AttributeDict({
+                'address': "0x0000000000000000000000000000000000001010",
+                'topics': [
+                    HexBytes('0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'),
+                    HexBytes(self.sender_raw),
+                    HexBytes(self.recipient_raw)],
+                'data': HexBytes("0x0000000000000000000000000000000000000000000000000000000000000001"),
+                'transactionHash': HexBytes(self.tx_hash),
+                'logIndex': 7,
+            }),
+        ]
+
+    def test_should_fetch_logs_of_all_tokens_with_one_request(self):
+        fetcher = CombinedEventTransferFetcher(w3, [self.erc20_token, self.erc1155_token])
+        fetcher.w3 = cast(Web3, Mock())
+        fetcher.w3.eth.get_logs = Mock(return_value=self.logs)  # type: ignore
+
+        transfers_of_tokens = fetcher.get_transfers_of_tokens(100, 200)
+
+        fetcher.w3.eth.get_logs.assert_called_once()  # type: ignore
+        filter_params = fetcher.w3.eth.get_logs.call_args.args[0]  # type: ignore
+        self.assertEqual([self.erc20_token.address, self.erc1155_token.address], filter_params["address"])
+        self.assertEqual(3, len(filter_params["topics"][0]))
+        erc20_transfers = transfers_of_tokens[self.erc20_token]
+        self.assertEqual(1, len(erc20_transfers))
+        self.assertEqual(FungibleTransferTransaction, type(erc20_transfers[0]))
+        self.assertEqual(1709210771, cast(FungibleTransferTransaction, erc20_transfers[0]).amount)
+        erc1155_transfers = transfers_of_tokens[self.erc1155_token]
+        self.assertEqual(1, len(erc1155_transfers))
+        self.assertEqual(ERC1155TransferTransaction, type(erc1155_transfers[0]))
+        self.assertEqual(100, cast(ERC1155TransferTransaction, erc1155_transfers[0]).amount)
+
+    def test_should_push_recipient_filter_into_topics_of_every_event_layout(self):
+        recipient = Web3.to_checksum_address("0x7ab6c736baf1dac266aab43884d82974a9adcccf")
+        fetcher = CombinedEventTransferFetcher(w3, [self.erc20_token, self.erc1155_token], recipient=recipient)
+        fetcher.w3 = cast(Web3, Mock())
+        fetcher.w3.eth.get_logs = Mock(side_effect=[self.logs[:1], self.logs[1:2]])  # type: ignore
+
+        transfers_of_tokens = fetcher.get_transfers_of_tokens(100, 200)
+
+        erc20_filter, erc1155_filter = [call.args[0] for call in fetcher.w3.eth.get_logs.call_args_list]  # type: ignore
+        self.assertEqual([self.erc20_token.address], erc20_filter["address"])
+        self.assertEqual([None, self.recipient_raw], erc20_filter["topics"][1:])
+        self.assertEqual([self.erc1155_token.address], erc1155_filter["address"])
+        self.assertEqual([None, None, self.recipient_raw], erc1155_filter["topics"][1:])
+        self.assertEqual(1, len(transfers_of_tokens[self.erc20_token]))
+        self.assertEqual(1, len(transfers_of_tokens[self.erc1155_token]))
+
+    def test_should_push_sender_filter_into_topics(self):
+        sender = Web3.to_checksum_address("0xdb6f2ed702823b903b6d185f68bdf715d1b3af76")
+        fetcher = CombinedEventTransferFetcher(w3, [self.erc20_token], sender=sender)
+        fetcher.w3 = cast(Web3, Mock())
+        fetcher.w3.eth.get_logs = Mock(return_value=[])  # type: ignore
+
+        fetcher.get_transfers_of_tokens(100, 200)
+
+        filter_params = fetcher.w3.eth.get_logs.call_args.args[0]  # type: ignore
+        self.assertEqual([["0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"], self.sender_raw],
+                         filter_params["topics"])
+
+
 class ReceiptTransferFetcherTestCase(TestCase):
     sender: str
     recipient: str
@@ -256,3 +338,114 @@ class ReceiptTransferFetcherTestCase(TestCase):
         self.status = 0  # make the only tx in block failed
         native_currency_transfers = ReceiptTransferFetcher(self.w3, self.token).get_transfers(0, 0)
         self.assertEqual(0, len(native_currency_transfers))
+
+
+class ReceiptTransferFetcherBatchTestCase(TestCase):
+    network: Network
+    token: Token
+    node: JsonRpcNodeMock
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1,
+                                              name="Ethereum mainnet",
+                                              rpc_url="http://localhost:8545",
+                                              max_step=1000,
+                                              type=NetworkType.filterable,
+                                              need_poa=False,
+                                              rpc_batch_size=2)
+        self.token = Token.objects.create(address=None,
+                                          name="ETH",
+                                          network=self.network,
+                                          strategy=TokenStrategy.receipt_based_transfer,
+                                          type=TokenType.native)
+        self.sender = "0xB29b5336b4aFe2B43ea989479B170cdd55EC8C6e"
+        self.recipient = "0x1dDbFba689387f078449ff625454c5b302f6E9A4"
+        # block 10 has a native transfer and a call with no value, block 11 has a failed native transfer
+        self.transactions = {
+            10: [self._transaction("0x" + "a" * 64, 1000), self._transaction("0x" + "b" * 64, 0)],
+            11: [self._transaction("0x" + "c" * 64, 5)],
+        }
+        self.statuses = {"0x" + "a" * 64: 1, "0x" + "b" * 64: 1, "0x" + "c" * 64: 0}
+        self.node = JsonRpcNodeMock({
+            "eth_getBlockByNumber": self._get_block,
+            "eth_getTransactionReceipt": self._get_receipt,
+        })
+
+    def _transaction(self, tx_hash: str, value: int) -> dict:
+        return {"hash": tx_hash, "from": self.sender.lower(), "to": self.recipient.lower(), "value": hex(value)}
+
+    def _get_block(self, block_number: str, full_transactions: bool) -> dict:
+        return {"number": block_number, "transactions": self.transactions[int(block_number, 16)]}
+
+    def _get_receipt(self, tx_hash: str) -> dict:
+        return {"transactionHash": tx_hash, "from": self.sender.lower(), "to": self.recipient.lower(),
+                "status": hex(self.statuses[tx_hash])}
+
+    def _get_block_receipts(self, block_number: str) -> list:
+        if block_number == "latest":
+            return []
+        return [self._get_receipt(transaction["hash"]) for transaction in self.transactions[int(block_number, 16)]]
+
+    def _get_transfers(self, from_block: int, to_block: int):
+        fetcher = ReceiptTransferFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token)
+        with patch("indexer.json_rpc.make_post_request", self.node), \
+                patch("web3.providers.rpc.make_post_request", self.node):
+            return fetcher.get_transfers(from_block, to_block)
+
+    def _assert_the_only_native_transfer(self, transfers):
+        self.assertEqual(1, len(transfers))
+        transfer = cast(NativeCurrencyTransferTransaction, transfers[0])
+        self.assertEqual(self.sender, transfer.sender)
+        self.assertEqual(self.recipient, transfer.recipient)
+        self.assertEqual(1000, transfer.amount)
+        self.assertEqual("0x" + "a" * 64, transfer.tx_hash)
+
+    def test_should_fetch_blocks_and_receipts_with_batches(self):
+        transfers = self._get_transfers(10, 11)
+
+        self._assert_the_only_native_transfer(transfers)
+        self.assertEqual(2, len(self.node.requests_of_method("eth_getBlockByNumber")))
+        # receipts are requested only for transactions with value
+        self.assertEqual(["0x" + "a" * 64, "0x" + "c" * 64],
+                         [request["params"][0] for request in self.node.requests_of_method("eth_getTransactionReceipt")])
+        # one batch of two blocks, one batch of two receipts and a single eth_getBlockReceipts probe
+        self.assertEqual(3, len(self.node.http_requests))
+
+    def test_should_fetch_block_receipts_when_supported(self):
+        self.node.handlers["eth_getBlockReceipts"] = self._get_block_receipts
+
+        transfers = self._get_transfers(10, 11)
+        transfers_of_next_range = self._get_transfers(10, 11)
+
+        self._assert_the_only_native_transfer(transfers)
+        self._assert_the_only_native_transfer(transfers_of_next_range)
+        self.assertEqual(0, len(self.node.requests_of_method("eth_getTransactionReceipt")))
+        # support is probed only once per network
+        self.assertEqual(1, len([request for request in self.node.requests_of_method("eth_getBlockReceipts")
+                                 if request["params"] == ["latest"]]))
+        self.network.refresh_from_db()
+        self.assertTrue(self.network.block_receipts_supported)
+
+    def test_should_fall_back_to_sequential_requests_when_batches_rejected(self):
+        self.node.batches_supported = False
+        fetcher = ReceiptTransferFetcher(Web3(Web3.HTTPProvider(self.network.rpc_url)), self.token)
+        with patch("indexer.json_rpc.make_post_request", self.node), \
+                patch.object(fetcher, "_get_transfers_sequentially", return_value=[]) as sequential_fetching:
+            fetcher.get_transfers(10, 11)
+            fetcher.get_transfers(12, 13)
+
+        self.assertFalse(fetcher.batch_requests_supported)
+        self.assertEqual(2, sequential_fetching.call_count)
+        # batches are not tried again once provider rejected them
+        self.assertEqual(1, len(self.node.http_requests))
+
+    def test_should_count_every_request_of_batch_towards_rate_limit(self):
+        self.network.rpc_requests_per_second = 1000
+        self.network.rpc_burst = 10
+        self.network.save()
+        self.token.refresh_from_db()
+        with patch("indexer.utils.RateLimiter.acquire") as acquire:
+            self._get_transfers(10, 11)
+
+        # a batch of two blocks and a batch of two receipts
+        self.assertEqual([2, 2], [call.args[0] for call in acquire.call_args_list])
@@ -1,10 +1,12 @@
-from typing import List
+from typing import List, Sequence
+from unittest.mock import patch
 
 from django.test import TestCase
 from web3 import Web3
 from web3.types import ChecksumAddress, HexStr
 
-from indexer.strategies import SenderStrategy, RecipientStrategy, TokenScanStrategy
+from indexer.strategies import SenderStrategy, RecipientStrategy, TokenScanStrategy, TransfersParticipantsStrategy, \
+    HOLDER_RETRY_LIMIT
 from indexer.transfer_transactions import FungibleTransferTransaction, ERC1155TransferTransaction, TransferTransaction
 from indexer_api.models import Token, Network, NetworkType, TokenStrategy, TokenType, Indexer, IndexerStrategy, \
     IndexerStatus, IndexerType, TokenTransfer
@@ -81,6 +83,25 @@ class RecipientStrategyTestCase(TestCase):
         # two same transfers should be skipped; only one is saved
         self.assertEqual(1, transfers_with_recipient)
 
+    def test_should_save_several_transfers_of_one_tx_with_different_log_indices(self):
+        tx_hash = HexStr("0xa235c8a71c1310d8b735c6dece3aa7215ecd6b80ba6d6a3dade0129b4147a089")
+        transactions: List[TransferTransaction] = [
+            FungibleTransferTransaction(
+                sender=Web3.to_checksum_address("0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1"),
+                recipient=self.recipient,
+                tx_hash=tx_hash,
+                amount=100,
+                log_index=log_index
+            ) for log_index in (3, 7)
+        ]
+        strategy = RecipientStrategy(self.indexer)
+        strategy.start(self.token, transactions)
+        strategy.start(self.token, transactions)
+
+        # both logs of the tx are saved once even though the range was handled twice
+        self.assertEqual([3, 7], list(TokenTransfer.objects.filter(tx_hash=tx_hash).order_by("log_index")
+                                      .values_list("log_index", flat=True)))
+
 
 class SenderStrategyTestCase(TestCase):
     indexer: Indexer
@@ -234,3 +255,96 @@ class ERC1155TransferHandleStrategyTestCase(TestCase):
         ])
         count = TokenTransfer.objects.filter(tx_hash=self.tx_hash).count()
         self.assertEqual(3, count)
+
+
+class TransfersParticipantsStrategyTestCase(TestCase):
+    indexer: Indexer
+    network: Network
+    token: Token
+    alice = "0xeeA573D4CDa98601D5cf3fC5AD0ef44258B1Bfa1"
+    bob = "0x2AFA0fC03097dDc0C25e32EbbcA71Da5E7a11938"
+    carol = "0x41Cc6CE1CEeb68c9c297e04F97aB786915B0Dc9f"
+
+    def setUp(self) -> None:
+        self.network = Network.objects.create(chain_id=1,
+                                              name="Ethereum mainnet",
+                                              rpc_url="https://ethereum.org",
+                                              max_step=1000,
+                                              type=NetworkType.filterable,
+                                              need_poa=True)
+        self.token = Token.objects.create(address="0xeB3D38AF7f3594014cf23C273f21EEd623e1E0a3",
+                                          name="DAI",
+                                          network=self.network,
+                                          strategy=TokenStrategy.event_based_transfer,
+                                          type=TokenType.erc20)
+        self.indexer = Indexer.objects.create(name="test",
+                                              network=self.network,
+                                              strategy=IndexerStrategy.transfers_participants,
+                                              short_sleep_seconds=1,
+                                              long_sleep_seconds=1,
+                                              strategy_params={},
+                                              status=IndexerStatus.on,
+                                              type=IndexerType.balance_indexer)
+
+    def _transfer(self, sender: str, recipient: str):
+        TokenTransfer.objects.create(token_instance=self.token, sender=sender, recipient=recipient, amount=1,
+                                     tx_hash=f"0x{TokenTransfer.objects.count():064x}")
+
+    def _cycle(self, strategy: TransfersParticipantsStrategy,
+               failed_holders: Sequence[ChecksumAddress] = ()) -> List[ChecksumAddress]:
+        strategy.begin_cycle([self.token])
+        holders = strategy.start(self.token)
+        strategy.retry(self.token, list(failed_holders))
+        strategy.end_cycle()
+        return sorted(holders)
+
+    def test_should_give_participants_of_new_transfers_only(self):
+        strategy = TransfersParticipantsStrategy(self.indexer)
+        self._transfer(self.alice, self.bob)
+        self.assertEqual(sorted([self.alice, self.bob]), self._cycle(strategy))
+        self.assertEqual(TokenTransfer.objects.latest("id").id, self.indexer.last_transfer_id)
+
+        self._transfer(self.bob, self.carol)
+        self.assertEqual(sorted([self.bob, self.carol]), self._cycle(strategy))
+        self.assertEqual([], self._cycle(strategy))
+
+    def test_should_give_all_participants_on_full_sweep(self):
+        self.indexer.strategy_params = {"full_sweep_seconds": 60}
+        strategy = TransfersParticipantsStrategy(self.indexer)
+        self._transfer(self.alice, self.bob)
+        with patch("indexer.strategies.time.monotonic", return_value=1000):
+            self._cycle(strategy)
+        self._transfer(self.bob, self.carol)
+        with patch("indexer.strategies.time.monotonic", return_value=1030):
+            self.assertEqual(sorted([self.bob, self.carol]), self._cycle(strategy))
+        with patch("indexer.strategies.time.monotonic", return_value=1060):
+            self.assertEqual(sorted([self.alice, self.bob, self.carol]), self._cycle(strategy))
+
+    def test_should_retry_failed_holders_up_to_limit_with_full_sweeps(self):
+        self.indexer.strategy_params = {"full_sweep_seconds": 3600}
+        strategy = TransfersParticipantsStrategy(self.indexer)
+        self._transfer(self.alice, self.bob)
+        self._cycle(strategy, [ChecksumAddress(self.bob)])
+        for _ in range(HOLDER_RETRY_LIMIT):
+            self.assertEqual([self.bob], self._cycle(strategy, [ChecksumAddress(self.bob)]))
+        self.assertEqual([], self._cycle(strategy))
+
+    def test_should_not_retry_holders_fetched_on_retry(self):
+        strategy = TransfersParticipantsStrategy(self.indexer)
+        self._transfer(self.alice, self.bob)
+        self._cycle(strategy, [ChecksumAddress(self.bob)])
+        self.assertEqual([self.bob], self._cycle(strategy))
+        self.assertEqual([], self._cycle(strategy))
+
+    def test_should_retry_failed_holders_without_limit_without_full_sweeps(self):
+        strategy = TransfersParticipantsStrategy(self.indexer)
+        self._transfer(self.alice, self.bob)
+        for _ in range(HOLDER_RETRY_LIMIT + 2):
+            self._cycle(strategy, [ChecksumAddress(self.bob)])
+        self.assertEqual([self.bob], self._cycle(strategy))
+
+    def test_should_keep_failed_holders_after_restart(self):
+        self._transfer(self.alice, self.bob)
+        self._cycle(TransfersParticipantsStrategy(self.indexer), [ChecksumAddress(self.bob)])
+        restarted_strategy = TransfersParticipantsStrategy(Indexer.objects.get(pk=self.indexer.pk))
+        self.assertEqual([self.bob], self._cycle(restarted_strategy))
@@ -61,7 +61,6 @@ class FungibleTransferTransactionTestCase(TestCase):
     raw_amount: str
 
     tx_hash: str
-    event_entry: AttributeDict
 
     def setUp(self) -> None:
         self.network = Network.objects.create(chain_id=1,
@@ -85,22 +84,6 @@ class FungibleTransferTransactionTestCase(TestCase):
         self.raw_amount = "0x0000000000000000000000000000000000000000000000000000000065e07c93"
 
         self.tx_hash = "0xa35cac639bd0f75e19bf28ceb26e60ddd057cce6e702769abb7b3e470300debd"
-        self.event_entry = AttributeDict(
-            {
-                'args': AttributeDict(
-                    {'from': self.sender,
-                     'to': self.recipient,
-                     'value': self.amount
-                     }),
-                'event': 'Transfer',
-                'logIndex': 0,
-                'transactionIndex': 0,
-                'transactionHash': HexBytes(self.tx_hash),
-                'address': '0xe9e7CEA3DedcA5984780Bafc599bD69ADd087D56',
-                'blockHash': HexBytes('0xe87e98ac898edc2a8c811380f3be149ecf61e7d3ac4be1856df0724b2111f531'),
-                'blockNumber': 392245
-            }
-        )
         self.raw_topics_with_amount_in_data = cast(LogReceipt, AttributeDict(
             {
                 'address': '0xc2132D05D31c914a87C6611C10748AEb04B58e8F',
@@ -136,22 +119,6 @@ class FungibleTransferTransactionTestCase(TestCase):
             }
         ))
 
-    def test_should_create_model_instance_from_event_entry(self):
-        token_transfers = FungibleTransferTransaction.from_event_entry(self.event_entry)
-        self.assertEqual(1, len(token_transfers))
-        token_transfer = token_transfers[0]
-        model_instance = token_transfer.to_token_transfer_model()
-        model_instance.token_instance = self.token
-        model_instance.save()
-        model_instance_from_database: TokenTransfer = TokenTransfer.objects.get()
-
-        self.assertEqual(self.sender, model_instance_from_database.sender)
-        self.assertEqual(self.recipient, model_instance_from_database.recipient)
-        self.assertEqual(self.tx_hash, model_instance_from_database.tx_hash)
-        self.assertEqual(self.amount, model_instance_from_database.amount)
-        self.assertEqual(self.token, model_instance_from_database.token_instance)
-        self.assertEqual(None, model_instance_from_database.token_id)
-
     def test_should_create_model_instance_from_raw_logs_with_amount_in_data(self):
         # noinspection PyTypeChecker
         transfer_transactions = FungibleTransferTransaction.from_raw_log(self.raw_topics_with_amount_in_data)
@@ -165,6 +132,7 @@ class FungibleTransferTransactionTestCase(TestCase):
         self.assertEqual(self.amount, model_instance.amount)
         self.assertEqual(None, model_instance.token_id)
         self.assertEqual(self.token, model_instance.token_instance)
+        self.assertEqual(5, model_instance.log_index)
 
     def test_should_create_model_instance_from_raw_logs_with_amount_in_topic(self):
         # noinspection PyTypeChecker
@@ -180,6 +148,11 @@ class FungibleTransferTransactionTestCase(TestCase):
         self.assertEqual(None, model_instance.token_id)
         self.assertEqual(self.token, model_instance.token_instance)
 
+    def test_should_decode_raw_logs_batch_as_single_logs(self):
+        raw_logs = [self.raw_topics_with_amount_in_data, self.raw_topics_with_amount_in_topic]
+        expected = [transfer for raw_log in raw_logs for transfer in FungibleTransferTransaction.from_raw_log(raw_log)]
+        self.assertEqual(expected, FungibleTransferTransaction.from_raw_logs(raw_logs))
+
     def test_should_fail_when_no_enough_topics(self):
         transfer_transactions = FungibleTransferTransaction.from_raw_log(cast(LogReceipt, AttributeDict(
             {
@@ -258,24 +231,6 @@ class NonFungibleTransferTransactionTestCase(TestCase):
         self.token_id_raw = "0x0000000000000000000000000000000000000000000000000000000000d85199"
 
         self.tx_hash = "0x9a13e496abb52ddf8cdbec723df5c41c4004674a84939d042f807441d6159966"
-        self.event_entry = AttributeDict(
-            {
-                'args': AttributeDict(
-                    {
-                        'from': self.sender,
-                        'to': self.recipient,
-                        'tokenId': self.token_id
-                    }
-                ),
-                'event': 'Transfer',
-                'logIndex': 511,
-                'transactionIndex': 183,
-                'transactionHash': HexBytes(self.tx_hash),
-                'address': '0x9c614a8E5a23725214024d2C3633BE30D44806f9',
-                'blockHash': HexBytes('0x6ec315db1d5bbfe1cd0230e793caf276d23e8fefe423f8a6f97f3ffdc7d747d5'),
-                'blockNumber': 29263958
-            }
-        )
         self.raw_logs_with_token_id_in_topics = cast(LogReceipt, AttributeDict(
             {
                 'address': '0x5D666F215a85B87Cb042D59662A7ecd2C8Cc44e6',
@@ -311,19 +266,6 @@ class NonFungibleTransferTransactionTestCase(TestCase):
             }
         ))
 
-    def test_should_create_model_instance_from_event_entry(self):
-        transfer_transactions = NonFungibleTransferTransaction.from_event_entry(self.event_entry)
-        self.assertEqual(1, len(transfer_transactions))
-        transfer_transaction = transfer_transactions[0]
-        model_instance = transfer_transaction.to_token_transfer_model()
-        model_instance.token_instance = self.token
-        model_instance.save()
-        self.assertEqual(self.sender, model_instance.sender)
-        self.assertEqual(self.recipient, model_instance.recipient)
-        self.assertEqual(self.token_id, model_instance.token_id)
-        self.assertEqual(None, model_instance.amount)
-        self.assertEqual(self.token, model_instance.token_instance)
-
     def test_should_create_model_instance_from_raw_log_with_token_id_in_topics(self):
         # noinspection PyTypeChecker
         transfer_transactions = NonFungibleTransferTransaction.from_raw_log(self.raw_logs_with_token_id_in_topics)
@@ -352,6 +294,11 @@ class NonFungibleTransferTransactionTestCase(TestCase):
         self.assertEqual(None, model_instance.amount)
         self.assertEqual(self.token, model_instance.token_instance)
 
+    def test_should_decode_raw_logs_batch_as_single_logs(self):
+        raw_logs = [self.raw_logs_with_token_id_in_topics, self.raw_logs_with_token_id_in_data]
+        expected = [transfer for raw_log in raw_logs for transfer in NonFungibleTransferTransaction.from_raw_log(raw_log)]
+        self.assertEqual(expected, NonFungibleTransferTransaction.from_raw_logs(raw_logs))
+
     def test_should_fail_when_bad_topics(self):
         # noinspection PyTypeChecker
         transfer_transactions = NonFungibleTransferTransaction.from_raw_log(cast(LogReceipt, AttributeDict(
@@ -575,6 +522,14 @@ class ERC1155TransferTransactionTestCase(TestCase):
         self.assertEqual(self.token_ids, token_ids)
         self.assertEqual(self.amounts, amounts)
 
+    def test_should_decode_raw_logs_batch_as_single_logs(self):
+        raw_logs = [cast(LogReceipt, self.transfer_single_raw_with_token_in_data),
+                    cast(LogReceipt, self.transfer_single_raw_with_token_in_topics),
+                    cast(LogReceipt, self.transfer_batch_raw)]
+        expected = [transfer for raw_log in raw_logs for transfer in ERC1155TransferTransaction.from_raw_log(raw_log)]
+        self.assertEqual(5, len(expected))
+        self.assertEqual(expected, ERC1155TransferTransaction.from_raw_logs(raw_logs))
+
     def test_should_fail_single_transfer_when_bad_topics(self):
         transfers = ERC1155TransferTransaction.from_raw_log(cast(LogReceipt, AttributeDict(
             {
@@ -0,0 +1,72 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+from web3 import Web3
+from web3.types import HexBytes
+
+from indexer.utils import AbiDecoder, RateLimiter, to_checksum_address, get_rate_limiter, get_web3
+
+
+class ChecksumAddressCacheTestCase(TestCase):
+    address = "0xdb6f2ed702823b903b6d185f68bdf715d1b3af76"
+    topic = HexBytes("0x000000000000000000000000db6f2ed702823b903b6d185f68bdf715d1b3af76")
+
+    def setUp(self) -> None:
+        to_checksum_address.cache_clear()
+
+    def test_should_give_checksum_address_of_string_and_topic(self):
+        self.assertEqual(Web3.to_checksum_address(self.address), to_checksum_address(self.address))
+        self.assertEqual(Web3.to_checksum_address(self.address), AbiDecoder.bytes32_to_address(self.topic))
+
+    def test_should_count_hits_and_misses(self):
+        for _ in range(3):
+            AbiDecoder.bytes32_to_address(self.topic)
+        cache_info = to_checksum_address.cache_info()
+        self.assertEqual(1, cache_info.misses)
+        self.assertEqual(2, cache_info.hits)
+        self.assertEqual(1, cache_info.currsize)
+
+
+class RateLimiterTestCase(TestCase):
+
+    def test_should_space_requests_evenly(self):
+        rate_limiter = RateLimiter(requests_per_second=4)
+        with patch("indexer.utils.time.monotonic", return_value=100.0), \
+                patch("indexer.utils.time.sleep") as sleep:
+            for _ in range(3):
+                rate_limiter.acquire()
+        self.assertEqual([0.25, 0.5], [call.args[0] for call in sleep.call_args_list])
+
+    def test_should_send_burst_at_once_and_then_space_requests(self):
+        rate_limiter = RateLimiter(requests_per_second=4, burst=2)
+        with patch("indexer.utils.time.monotonic", return_value=100.0), \
+                patch("indexer.utils.time.sleep") as sleep:
+            for _ in range(4):
+                rate_limiter.acquire()
+            # a batch reserves a slot for every its request
+            rate_limiter.acquire(2)
+        self.assertEqual([0.25, 0.5, 1.0], [call.args[0] for call in sleep.call_args_list])
+
+    def test_should_refill_bucket_up_to_burst(self):
+        rate_limiter = RateLimiter(requests_per_second=4, burst=2)
+        with patch("indexer.utils.time.monotonic", return_value=100.0), \
+                patch("indexer.utils.time.sleep"):
+            rate_limiter.acquire(2)
+        with patch("indexer.utils.time.monotonic", return_value=110.0), \
+                patch("indexer.utils.time.sleep") as sleep:
+            rate_limiter.acquire(2)
+            rate_limiter.acquire()
+        self.assertEqual([0.25], [call.args[0] for call in sleep.call_args_list])
+
+    def test_should_share_rate_limiter_of_rpc(self):
+        rate_limiter = get_rate_limiter("http://localhost:8545", 10, 5)
+        self.assertIs(rate_limiter, get_rate_limiter("http://localhost:8545", 10, 5))
+        self.assertIsNot(rate_limiter, get_rate_limiter("http://localhost:8546", 10, 5))
+        self.assertIsNone(get_rate_limiter("http://localhost:8545", None))
+
+    def test_should_share_web3_of_network(self):
+        w3 = get_web3("http://localhost:8545", True, 10, 5)
+        self.assertIs(w3, get_web3("http://localhost:8545", True, 10, 5))
+        self.assertIsNot(w3, get_web3("http://localhost:8545", False, 10, 5))
+        self.assertIsNot(w3, get_web3("http://localhost:8546", True, 10, 5))
+        self.assertIn("rate_limit", [name for _, name in w3.middleware_onion.middlewares])